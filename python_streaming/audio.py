@@ -1,14 +1,17 @@
+import asyncio
 from math import ceil
 from pathlib import Path
-from pprint import pprint
 import re
-from typing import Iterator, Generator, AsyncIterator
+from typing import AsyncIterable, Generator, Iterable, Iterator
 import wave
 
 import pyaudio
 import soundfile as sf
 
-from python_streaming.config import BUFFER_SIZE, RANGED_REQUEST_BUFFERS
+from python_streaming.catalog import AudioEntry
+from python_streaming.config import AUDIO_TRANSPORT_HOST, AUDIO_TRANSPORT_PORT, BUFFER_SIZE, RANGED_REQUEST_BUFFERS
+from python_streaming.playback import OutputSink, PlaybackStats, create_sink, play
+from python_streaming.recorder import WaveRecorder
 
 
 def extract_bit_depth(file_info_string: str):
@@ -28,31 +31,17 @@ def frames_to_bytes(frames: int, bit_depth: int, channels: int):
     )
 
 
-def read_audio_frames(audio_file_path: Path, start_frame: int, frames: int):
-    header_size = 44
-    audio_info = sf.info(audio_file_path)
-    start_byte = (
-        header_size
-        + frames_to_bytes(
-            start_frame,
-            extract_bit_depth(audio_info.extra_info),
-            audio_info.channels,
-        )
-    )
-    end_byte = (
-        start_byte
-        + frames_to_bytes(
-            frames,
-            extract_bit_depth(audio_info.extra_info),
-            audio_info.channels,
-        )
-    )
-    pprint(f"Reading bytes {start_byte} to {end_byte}")
+def read_audio_frames(audio: AudioEntry, start_frame: int, frames: int) -> bytes:
+    """Read `frames` frames starting at `start_frame` from an indexed WAVE file.
 
-    with open(audio_file_path, "rb") as audio:
-        audio.seek(start_byte)
-        data = audio.read(end_byte - start_byte)
-        return data
+    The byte offsets come from the catalog entry, so no header is parsed here.
+    """
+    start_byte = audio.frame_to_byte(start_frame)
+    end_byte = audio.frame_to_byte(start_frame + frames)
+
+    with open(audio.path, "rb") as file:
+        file.seek(start_byte)
+        return file.read(end_byte - start_byte)
 
 
 def read_wav_frames(audio_file_path: Path, start_frame: int, n_frames: int):
@@ -63,13 +52,10 @@ def read_wav_frames(audio_file_path: Path, start_frame: int, n_frames: int):
 
 
 def iterate_over_wav_frames(audio_file_path: Path) -> Generator:
-    start_frame = 0
-    while True:
-        data = read_wav_frames(audio_file_path, start_frame, BUFFER_SIZE)
-        start_frame += BUFFER_SIZE
-        if not data:
-            raise ValueError("No more data to read")
-        yield data
+    # Read on from a single open file: seeking past the last frame raises
+    with wave.open(str(audio_file_path), "rb") as audio:
+        while data := audio.readframes(BUFFER_SIZE):
+            yield data
 
 
 def create_audio_iterator(audio_file_path: Path) -> Iterator:
@@ -125,87 +111,63 @@ def create_audio_iterator(audio_file_path: Path) -> Iterator:
 
 
 async def play_sound_from_iterator(
-    audio_data_iterator: Iterator[bytes] | AsyncIterator[bytes],
+    audio_data_iterator: Iterable[bytes] | AsyncIterable[bytes],
     output_file_path: Path,
     bit_depth: int,
     number_of_channels: int,
     sample_rate: int,
-    buffer_size: int
-):
-    # PyAudio stream setup
-    pya = pyaudio.PyAudio()
+    buffer_size: int,
+    sink: OutputSink | None = None,
+) -> PlaybackStats:
+    """Play (and record) a PCM stream until it ends.
+
+    The device pulls `buffer_size` frames at a time from a jitter buffer
+    (see python_streaming.playback): network hiccups are absorbed, and
+    the ones that aren't are counted in the returned stats.
+    """
+    # Recording happens in a background thread: the playback loop only copies
+    # each buffer into the recorder's ring buffer.
+    recorder = WaveRecorder(output_file_path, number_of_channels, sample_rate, bit_depth)
+    try:
+        return await play(
+            audio_data_iterator,
+            sink or create_sink(frames_per_buffer=buffer_size),
+            channels=number_of_channels,
+            sample_rate=sample_rate,
+            bit_depth=bit_depth,
+            on_buffer=recorder.write,
+        )
+    finally:
+        recorder.close()
 
-    # ... or that
-    stream = pya.open(
-        format=pya.get_format_from_width(bit_depth//8),
-        channels=number_of_channels,
-        rate=sample_rate,
-        output=True,
-        frames_per_buffer=buffer_size
-    )
 
-    if isinstance(audio_data_iterator, Iterator):
-        while (audio_data := next(audio_data_iterator)) is not None:
-            stream.write(audio_data, num_frames=buffer_size, exception_on_underflow=False)
-            with open(output_file_path, "ab") as file:
-                file.write(audio_data)
-    elif isinstance(audio_data_iterator, AsyncIterator):
-        while (audio_data := await anext(audio_data_iterator)) is not None:
-            stream.write(audio_data, num_frames=buffer_size, exception_on_underflow=False)
-            with open(output_file_path, "ab") as file:
-                file.write(audio_data)
-    else:
-        raise ValueError("Unsupported iterator type")
-
-    stream.close()
-    pya.terminate()
-
-
-def audio_stream():
-    import pickle
-    import os
-    import struct
+def audio_stream(host: str = AUDIO_TRANSPORT_HOST, port: int = AUDIO_TRANSPORT_PORT):
+    """Play the raw PCM sent by an `audio_transport` server."""
     import socket
-    host_ip, port = "192.0.0.1", 8080
+    from python_streaming.audio_transport import AudioReceiver
+
     p = pyaudio.PyAudio()
-    CHUNK = 1024
-    stream = p.open(format=p.get_format_from_width(2),
-                    channels=2,
-                    rate=44100,
-                    output=True,
-                    frames_per_buffer=CHUNK)
-
-    # create socket
-    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    socket_address = (host_ip, port - 1)
-    print('server listening at', socket_address)
-    client_socket.connect(socket_address)
-    print("CLIENT CONNECTED TO", socket_address)
-    data = b""
-    payload_size = struct.calcsize("Q")
-    while True:
+    stream = None
+    with socket.create_connection((host, port)) as client_socket:
+        print("CLIENT CONNECTED TO", (host, port))
+        receiver = AudioReceiver(client_socket)
         try:
-            while len(data) < payload_size:
-                packet = client_socket.recv(4 * 1024)  # 4K
-                if not packet: break
-                data += packet
-            packed_msg_size = data[:payload_size]
-            data = data[payload_size:]
-            msg_size = struct.unpack("Q", packed_msg_size)[0]
-            while len(data) < msg_size:
-                data += client_socket.recv(4 * 1024)
-            frame_data = data[:msg_size]
-            data = data[msg_size:]
-            frame = pickle.loads(frame_data)
-            stream.write(frame)
-
-        except:
-
-            break
-
-    client_socket.close()
-    print('Audio closed')
-    os._exit(1)
+            for header, payload in receiver:
+                if stream is None:
+                    # Every packet carries the format: open the device from the first one
+                    audio_format = header.audio_format
+                    stream = p.open(format=p.get_format_from_width(audio_format.bit_depth // 8),
+                                    channels=audio_format.channels,
+                                    rate=audio_format.sample_rate,
+                                    output=True,
+                                    frames_per_buffer=BUFFER_SIZE)
+                # PyAudio only takes immutable buffers: one copy per packet
+                stream.write(bytes(payload))
+        finally:
+            if stream is not None:
+                stream.close()
+            p.terminate()
+    print(f"Audio closed after {receiver.frames_received} frames")
 
 
 if __name__ == '__main__':
@@ -230,11 +192,12 @@ if __name__ == '__main__':
     file_info = sf.info(audio_path)
     iterator = iterate_over_wav_frames(audio_path)
 
-    play_sound_from_iterator(
+    stats = asyncio.run(play_sound_from_iterator(
         audio_data_iterator=iterator,
         output_file_path=Path("resources/audio_output.wav"),
         bit_depth=extract_bit_depth(file_info.extra_info),
         number_of_channels=file_info.channels,
         sample_rate=file_info.samplerate,
         buffer_size=BUFFER_SIZE*RANGED_REQUEST_BUFFERS
-    )
+    ))
+    print(stats)
@@ -1,81 +1,245 @@
 """Consume a ranged or streamed audio file from a remote server."""
 import asyncio
-import json
 from pathlib import Path
-from pprint import pprint
-from queue import SimpleQueue, Queue
 import time
-from typing import Optional
+from typing import AsyncIterator, Iterator
 
-from python_streaming.audio import play_sound_from_iterator, frames_to_bytes
+from python_streaming.audio import play_sound_from_iterator
 
 import urllib3
 
-from config import HTTP_PORT, RANGED_REQUEST_BUFFERS, BUFFER_SIZE
+from python_streaming.config import (
+    BUFFER_SIZE,
+    FRAME_STREAM_READ_SIZE,
+    HTTP_PORT,
+    PREFETCH_MAX_REQUESTS,
+    PREFETCH_QUEUE_SIZE,
+    RANGED_REQUEST_BUFFERS,
+)
+from python_streaming.frame_stream import END, FrameStreamDecoder
+from python_streaming.util import iterate_off_loop
 
 
-http = urllib3.PoolManager()
+http = urllib3.PoolManager(maxsize=PREFETCH_MAX_REQUESTS, block=True)
 
 
-async def buffer_remote_file(
-    audio_id: str,
-    number_of_frames: int,
-    fifo_queue: SimpleQueue,
-):
-    """Buffer a remote file by requesting chunks of data from the server.
+def parse_frame_range(frame_range: str) -> tuple[int, int, int | None]:
+    """Parse a `Frame-Range: frames <first>-<end>/<total>` header."""
+    frames = frame_range.removeprefix("frames").strip()
+    first_end, _, total = frames.partition("/")
+    first, _, end = first_end.partition("-")
+    return int(first), int(end), int(total) if total not in ("", "*") else None
+
+
+class AudioPrefetcher:
+    """Fetch frame buffers ahead of playback with several requests in flight.
+
+    Up to `concurrency` ranged requests run at once over the pooled keep-alive
+    connections. Responses may complete in any order: they are reordered by
+    frame offset and handed over, in order, through a bounded queue.
+
+    The concurrency is adapted to the aggregate throughput: frames delivered
+    per second by all the requests, measured over the window since the last
+    change. It grows while that falls short of the playback rate, unless the
+    last increase didn't raise it (the link's bandwidth, not its latency, is
+    the limit then), and shrinks back when the queue is comfortably full.
 
     Args:
         audio_id (str): The audio file's ID.
-        number_of_frames (int): The number of frames to request from the
-            server. A frame is an instant's sample, for all given channels.
-        fifo_queue (deque): The FIFO queue to store the audio data.
+        frames_per_request (int): Frames the server returns per request.
+        sample_rate (int): Playback rate, in frames per second.
+        total_frames (int | None): Length of the file, if known.
+        max_concurrency (int): Upper bound for requests in flight.
+        queue_size (int): Buffers kept ready for playback.
+        retries (int): Attempts per request before giving up.
+    """
+
+    def __init__(
+        self,
+        audio_id: str,
+        frames_per_request: int,
+        sample_rate: int,
+        total_frames: int | None = None,
+        max_concurrency: int = PREFETCH_MAX_REQUESTS,
+        queue_size: int = PREFETCH_QUEUE_SIZE,
+        retries: int = 3,
+    ):
+        self.audio_id = audio_id
+        self.frames_per_request = frames_per_request
+        self.sample_rate = sample_rate
+        self.total_frames = total_frames
+        self.max_concurrency = max_concurrency
+        self.concurrency = 1
+        self.retries = retries
+        self.queue: asyncio.Queue[bytes | None] = asyncio.Queue(queue_size)
+        # Aggregate frames per second, as of the last measurement window
+        self.throughput = 0.0
+        self._window_started = time.monotonic()
+        self._window_frames = 0
+        self._window_deliveries = 0
+        # Throughput before the last increase, and the concurrency not worth exceeding
+        self._throughput_before_increase: float | None = None
+        self._concurrency_ceiling = max_concurrency
+
+    def fetch(self, start_frame: int) -> tuple[bytes, int, int | None]:
+        """Blocking ranged request, run in a worker thread."""
+        for attempt in range(self.retries):
+            try:
+                response = http.request(
+                    'GET',
+                    f'http://localhost:{HTTP_PORT}/audios/frame-buffers/{self.audio_id}',
+                    fields={"start_frame": start_frame},
+                    retries=False,
+                )
+                if response.status == 416:
+                    # Past the end: nothing left to fetch
+                    total_frames = int(response.headers["Frame-Range"].rpartition("/")[2])
+                    return b"", start_frame, total_frames
+                if response.status != 200:
+                    raise ValueError(f"Error {response.status} fetching frame {start_frame}")
+                _, end_frame, total_frames = parse_frame_range(response.headers["Frame-Range"])
+                return response.data, end_frame, total_frames
+            except (urllib3.exceptions.HTTPError, ValueError):
+                if attempt == self.retries - 1:
+                    raise
+
+    def adapt_concurrency(self, frames: int):
+        self._window_frames += frames
+        self._window_deliveries += 1
+        # A window spans a couple of rounds of requests at the current concurrency
+        if self._window_deliveries < 2 * self.concurrency:
+            return
+        now = time.monotonic()
+        elapsed = now - self._window_started
+        self.throughput = self._window_frames / elapsed if elapsed > 0 else float("inf")
+
+        previous_concurrency = self.concurrency
+        if self.queue.qsize() > self.queue.maxsize // 2 and self.concurrency > 1:
+            self.concurrency -= 1
+        elif (
+            self._throughput_before_increase is not None
+            and self.throughput < 1.1 * self._throughput_before_increase
+        ):
+            # More requests in flight didn't deliver more: step back and stay there
+            self.concurrency -= 1
+            self._concurrency_ceiling = self.concurrency
+        elif self.throughput < 1.5 * self.sample_rate and self.concurrency < self._concurrency_ceiling:
+            self._throughput_before_increase = self.throughput
+            self.concurrency += 1
+        if self.concurrency <= previous_concurrency:
+            self._throughput_before_increase = None
+        self._window_started = now
+        self._window_frames = 0
+        self._window_deliveries = 0
 
-    Returns:
-        None
+    async def run(self):
+        """Fetch the whole file into the queue, then put None as end marker."""
+        in_flight: dict[asyncio.Task, int] = {}
+        completed: dict[int, tuple[bytes, int]] = {}
+        next_request = 0
+        next_delivery = 0
+        end_of_file = self.total_frames
+        self._window_started = time.monotonic()
+        try:
+            while end_of_file is None or next_delivery < end_of_file:
+                # Don't run further ahead than what the queue could take
+                window_end = next_delivery + (self.queue.maxsize + self.concurrency) * self.frames_per_request
+                while (
+                    len(in_flight) < self.concurrency
+                    and next_request < window_end
+                    and (end_of_file is None or next_request < end_of_file)
+                ):
+                    task = asyncio.create_task(asyncio.to_thread(self.fetch, next_request))
+                    in_flight[task] = next_request
+                    next_request += self.frames_per_request
+
+                if not in_flight and next_delivery not in completed:
+                    break
+                if in_flight:
+                    done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        start_frame = in_flight.pop(task)
+                        data, end_frame, total_frames = task.result()
+                        self.adapt_concurrency(end_frame - start_frame)
+                        completed[start_frame] = (data, end_frame)
+                        if total_frames is not None:
+                            end_of_file = total_frames
+                        elif end_frame - start_frame < self.frames_per_request:
+                            end_of_file = end_frame
+
+                while next_delivery in completed:
+                    data, end_frame = completed.pop(next_delivery)
+                    if data:
+                        await self.queue.put(data)
+                    if end_frame <= next_delivery:
+                        end_of_file = next_delivery
+                        break
+                    next_delivery = end_frame
+        except BaseException:
+            # Wake the consumer up (dropping a buffer if needed): it'll find
+            # the error when awaiting this task
+            if self.queue.full():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            raise
+        finally:
+            for task in in_flight:
+                task.cancel()
+        await self.queue.put(None)
+
+    async def __aiter__(self):
+        producer = asyncio.create_task(self.run())
+        try:
+            while (buffer := await self.queue.get()) is not None:
+                yield buffer
+            # Surface the producer's errors, if any
+            await producer
+        finally:
+            producer.cancel()
+
+
+def read_frame_stream_chunks(audio_id: str, start_frame: int) -> Iterator[bytes]:
+    """Blocking read of a frame stream response, as it arrives."""
+    with http.request(
+        'GET',
+        f'http://localhost:{HTTP_PORT}/audios/frame-stream/{audio_id}',
+        fields={"start_frame": start_frame},
+        preload_content=False,
+    ) as response:
+        if response.status != 200:
+            raise ValueError(f"Error {response.status} streaming frames from {start_frame}")
+        yield from response.stream(FRAME_STREAM_READ_SIZE)
+
+
+async def stream_remote_frames(
+    audio_id: str,
+    block_align: int,
+    start_frame: int = 0,
+    max_reconnects: int = 5,
+) -> AsyncIterator[bytes]:
+    """Yield the PCM payloads of a continuous frame stream, in order.
+
+    If the connection drops, the stream is resumed with a single request from
+    the end of the last complete record, at most `max_reconnects` times in a row.
     """
-    current_frame = 0
-    do_read_more = True
-    while do_read_more:
-        if fifo_queue.qsize() == 10:
-            await asyncio.sleep(0.01)
-            continue
-        response = http.request(
-            'GET',
-            f'http://localhost:{HTTP_PORT}/audios/frame-buffers/{audio_id}',
-            fields={"start_frame": current_frame}
-        )
-        # pprint(response.headers)
-        last_received_frame = int(response.headers.get("Frame-Range").split('-')[1].split('/')[0])
-        frames_read = last_received_frame - current_frame if current_frame > 0 else last_received_frame
-        if frames_read < number_of_frames:
-            do_read_more = False
-        current_frame = last_received_frame
-        fifo_queue.put_nowait(response.data)
-
-
-async def wait_for_queue(queue: SimpleQueue, retry_times: int = 5):
-    empty_counter = 0
-    while (queue_size := queue.qsize()) == 0:
-        print("Waiting for buffer...")
-        empty_counter += 1
-        if empty_counter == retry_times:
-            print("Queue has been empty for some time. Exiting...")
-            exit(0)
-        await asyncio.sleep(0.1)
-    pprint(f"Queue size: {queue_size}")
-    pprint("Reading from buffer queue")
-    next_buffer = queue.get_nowait()
-    return next_buffer
-
-
-async def buffer_and_read(audio_id: str, number_of_frames: int):
-    buffers_queue = SimpleQueue()
-    buffering_task = asyncio.create_task(
-        buffer_remote_file(audio_id, number_of_frames, buffers_queue)
-    )
+    resume_frame = start_frame
+    reconnects = 0
     while True:
-        next_buffer = await wait_for_queue(buffers_queue)
-        yield next_buffer
+        decoder = FrameStreamDecoder()
+        try:
+            async for chunk in iterate_off_loop(lambda start=resume_frame: read_frame_stream_chunks(audio_id, start)):
+                for kind, frame_offset, payload in decoder.feed(chunk):
+                    if kind == END:
+                        return
+                    resume_frame = frame_offset + len(payload) // block_align
+                    reconnects = 0
+                    yield payload
+            # The response ended without an END record: the connection was cut
+            raise urllib3.exceptions.ProtocolError("Frame stream ended prematurely")
+        except urllib3.exceptions.HTTPError:
+            reconnects += 1
+            if reconnects > max_reconnects:
+                raise
 
 
 def consume_wave_file_by_bytes(audio_file_id: str):
@@ -123,19 +287,49 @@ async def consume_wave_file_by_frames(audio_file_id: str):
     channels = response.get("channels")
     sample_rate = response.get("sample_rate")
     bit_depth = response.get("bit_depth")
-    content_length = response.get("content_length", None)
+    total_frames = response.get("frames")
 
     number_of_frames = BUFFER_SIZE * RANGED_REQUEST_BUFFERS
+    prefetcher = AudioPrefetcher(
+        audio_id=audio_file_id,
+        frames_per_request=number_of_frames,
+        sample_rate=sample_rate,
+        total_frames=total_frames,
+    )
 
-    await play_sound_from_iterator(
-        audio_data_iterator=buffer_and_read(),
+    stats = await play_sound_from_iterator(
+        audio_data_iterator=aiter(prefetcher),
         output_file_path=Path(f"resources/audio_{audio_file_id}.wav"),
         bit_depth=bit_depth,
         number_of_channels=channels,
         sample_rate=sample_rate,
         buffer_size=number_of_frames,
     )
+    print(f"Playback: {stats}")
+
+
+async def consume_wave_file_by_stream(audio_file_id: str):
+    # Same as consume_wave_file_by_frames, but over a single continuous response
+    response = http.request('GET', f'http://localhost:{HTTP_PORT}/audios/{audio_file_id}')
+    if response.status != 200:
+        print(f"Error: {response.status} - {response.data.decode('utf-8')}")
+        raise ValueError("Error retrieving audio metadata")
+    response = response.json()
+
+    channels = response.get("channels")
+    sample_rate = response.get("sample_rate")
+    bit_depth = response.get("bit_depth")
+
+    stats = await play_sound_from_iterator(
+        audio_data_iterator=stream_remote_frames(audio_file_id, block_align=channels * bit_depth // 8),
+        output_file_path=Path(f"resources/audio_{audio_file_id}.wav"),
+        bit_depth=bit_depth,
+        number_of_channels=channels,
+        sample_rate=sample_rate,
+        buffer_size=BUFFER_SIZE,
+    )
+    print(f"Playback: {stats}")
 
 
 if __name__ == '__main__':
-    asyncio.run(consume_wave_file_by_frames(audio_file_id="1"))
+    asyncio.run(consume_wave_file_by_frames(audio_file_id="audio"))
@@ -0,0 +1,208 @@
+"""Vectorized PCM transforms: downmix, resampling, gain and bit-depth conversion.
+
+Transforms work on consecutive buffers of one stream and keep their state
+(partial frames, resampler history and phase) between calls, so that the
+output is the same whether the input comes in one piece or in many.
+"""
+from dataclasses import dataclass
+from math import ceil, gcd
+
+import numpy as np
+
+from python_streaming.catalog import AudioEntry
+
+
+SUPPORTED_BIT_DEPTHS = (8, 16, 24, 32)
+
+
+@dataclass(frozen=True)
+class RenditionSpec:
+    """The output format requested by a client. None keeps the source's."""
+    channels: int | None = None
+    sample_rate: int | None = None
+    bit_depth: int | None = None
+    gain_db: float = 0.0
+
+    def output_format(self, audio: AudioEntry) -> tuple[int, int, int]:
+        """(channels, sample rate, bit depth) of the rendition of `audio`."""
+        default_bit_depth = audio.bit_depth if audio.format == "PCM" else 16
+        return (
+            self.channels or audio.channels,
+            self.sample_rate or audio.sample_rate,
+            self.bit_depth or default_bit_depth,
+        )
+
+    def is_identity(self, audio: AudioEntry) -> bool:
+        return (
+            audio.format == "PCM"
+            and self.output_format(audio) == (audio.channels, audio.sample_rate, audio.bit_depth)
+            and self.gain_db == 0
+        )
+
+    def output_frames(self, audio: AudioEntry) -> int:
+        _, sample_rate, _ = self.output_format(audio)
+        return ceil(audio.frames * sample_rate / audio.sample_rate)
+
+    @property
+    def label(self) -> str:
+        return (
+            f"c{self.channels or ''}-r{self.sample_rate or ''}"
+            f"-b{self.bit_depth or ''}-g{self.gain_db:g}"
+        )
+
+
+def decode_pcm(data: bytes, sample_format: str, bit_depth: int, channels: int) -> np.ndarray:
+    """Interleaved PCM bytes to a (frames, channels) float32 array in [-1, 1)."""
+    if sample_format == "FLOAT":
+        samples = np.frombuffer(data, dtype="<f4" if bit_depth == 32 else "<f8").astype(np.float32)
+    elif bit_depth == 8:
+        # 8-bit WAVE is unsigned
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif bit_depth == 16:
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / (1 << 15)
+    elif bit_depth == 24:
+        triplets = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = triplets[:, 0] | (triplets[:, 1] << 8) | (triplets[:, 2] << 16)
+        values = np.where(values & 0x800000, values - (1 << 24), values)
+        samples = values.astype(np.float32) / (1 << 23)
+    elif bit_depth == 32:
+        samples = np.frombuffer(data, dtype="<i4").astype(np.float32) / (1 << 31)
+    else:
+        raise ValueError(f"Unsupported {sample_format} bit depth: {bit_depth}")
+    return samples.reshape(-1, channels)
+
+
+def encode_pcm(samples: np.ndarray, bit_depth: int) -> bytes:
+    """A (frames, channels) float array to interleaved integer PCM bytes."""
+    scale = 1 << (bit_depth - 1)
+    samples = samples.reshape(-1)
+    if bit_depth == 32:
+        # float32 can't represent 2**31 - 1: clip in double precision
+        samples = samples.astype(np.float64)
+    values = np.clip(np.rint(samples * scale), -scale, scale - 1)
+    if bit_depth == 8:
+        return (values + 128).astype(np.uint8).tobytes()
+    if bit_depth == 16:
+        return values.astype("<i2").tobytes()
+    if bit_depth == 24:
+        return values.astype("<i4").view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    if bit_depth == 32:
+        return values.astype("<i4").tobytes()
+    raise ValueError(f"Unsupported bit depth: {bit_depth}")
+
+
+def remix(samples: np.ndarray, channels: int) -> np.ndarray:
+    """Downmix to mono by averaging, upmix mono by copying, else keep the first channels."""
+    source_channels = samples.shape[1]
+    if channels == source_channels:
+        return samples
+    if channels == 1:
+        return samples.mean(axis=1, keepdims=True)
+    if source_channels == 1:
+        return np.repeat(samples, channels, axis=1)
+    if channels < source_channels:
+        return samples[:, :channels]
+    return np.pad(samples, ((0, 0), (0, channels - source_channels)))
+
+
+class StreamingResampler:
+    """Polyphase windowed-sinc resampler for chunked input.
+
+    The ratio is reduced to `up/down` integers, so output positions are
+    tracked exactly (no drift) and the kernel is a precomputed `up`-phase
+    table. When downsampling, the cutoff follows the output Nyquist frequency
+    so the result isn't aliased. The last input samples and the phase of the
+    next output sample carry over from one chunk to the next.
+
+    Args:
+        input_rate (int): Input frames per second.
+        output_rate (int): Output frames per second.
+        channels (int): Number of channels.
+        half_taps (int): Half the kernel length, in input samples.
+    """
+
+    def __init__(self, input_rate: int, output_rate: int, channels: int, half_taps: int = 16):
+        divisor = gcd(input_rate, output_rate)
+        self.up = output_rate // divisor
+        self.down = input_rate // divisor
+        self.half_taps = half_taps
+        self.channels = channels
+
+        self.offsets = np.arange(-half_taps + 1, half_taps + 1)
+        cutoff = min(1.0, self.up / self.down)
+        distances = (np.arange(self.up) / self.up)[:, None] - self.offsets[None, :]
+        window = 0.5 * (1 + np.cos(np.pi * distances / half_taps))
+        table = cutoff * np.sinc(cutoff * distances) * window
+        # Unity gain at DC for every phase
+        self.table = (table / table.sum(axis=1, keepdims=True)).astype(np.float32)
+
+        # Zeros stand for the signal before the first sample
+        self.history = np.zeros((half_taps, channels), dtype=np.float32)
+        # Position of the next output sample in the history, in 1/up input samples
+        self.position = half_taps * self.up
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        buffer = np.concatenate([self.history, samples.astype(np.float32, copy=False)])
+        # The last output must have all of its taps in the buffer
+        limit = (len(buffer) - self.half_taps) * self.up
+        count = max(ceil((limit - self.position) / self.down), 0)
+
+        positions = self.position + np.arange(count) * self.down
+        indices = positions // self.up
+        phases = positions % self.up
+        taps = buffer[indices[:, None] + self.offsets[None, :]]
+        output = np.einsum("ntc,nt->nc", taps, self.table[phases])
+
+        next_position = self.position + count * self.down
+        keep_from = min(max(next_position // self.up - self.half_taps + 1, 0), len(buffer))
+        self.history = buffer[keep_from:]
+        self.position = next_position - keep_from * self.up
+        return output
+
+    def flush(self) -> np.ndarray:
+        """Output the samples still waiting for their right-hand taps."""
+        return self.process(np.zeros((self.half_taps, self.channels), dtype=np.float32))
+
+
+class AudioTransformer:
+    """Applies a `RenditionSpec` to the consecutive PCM buffers of a file.
+
+    Args:
+        audio (AudioEntry): The source file's format.
+        spec (RenditionSpec): The requested output.
+    """
+
+    def __init__(self, audio: AudioEntry, spec: RenditionSpec):
+        self.source = audio
+        self.spec = spec
+        self.channels, self.sample_rate, self.bit_depth = spec.output_format(audio)
+        if self.bit_depth not in SUPPORTED_BIT_DEPTHS:
+            raise ValueError(f"Unsupported bit depth: {self.bit_depth}")
+        self.block_align = self.channels * self.bit_depth // 8
+        self.gain = np.float32(10 ** (spec.gain_db / 20))
+        self.resampler = (
+            StreamingResampler(audio.sample_rate, self.sample_rate, self.channels)
+            if self.sample_rate != audio.sample_rate else None
+        )
+        self._partial_frame = b""
+
+    def process(self, data: bytes) -> bytes:
+        data = self._partial_frame + bytes(data)
+        usable = len(data) - len(data) % self.source.block_align
+        self._partial_frame = data[usable:]
+        samples = decode_pcm(data[:usable], self.source.format, self.source.bit_depth, self.source.channels)
+        # Downmix before resampling: fewer channels to filter
+        samples = remix(samples, self.channels)
+        if self.resampler is not None:
+            samples = self.resampler.process(samples)
+        return self._encode(samples)
+
+    def flush(self) -> bytes:
+        if self.resampler is None:
+            return b""
+        return self._encode(self.resampler.flush())
+
+    def _encode(self, samples: np.ndarray) -> bytes:
+        if self.gain != 1:
+            samples = samples * self.gain
+        return encode_pcm(samples, self.bit_depth)
@@ -0,0 +1,264 @@
+"""Binary transport of raw PCM over TCP.
+
+The connection carries a sequence of packets, each made of a fixed header and
+its payload:
+
+    magic (4 bytes) | kind (1 byte) | channels (uint8) | bit depth (uint8)
+    | sample rate (uint32) | sequence (uint32) | frame offset (uint64)
+    | payload length (uint32) | payload
+
+All integers are little-endian. `DATA` packets carry interleaved PCM frames
+starting at the given frame offset; a final `END` packet carries the total
+number of frames sent. Every packet restates the format, so a receiver can
+open its output device from the first one, and the sequence number catches
+lost or reordered packets.
+
+The sender writes header and payload with a single scatter/gather call,
+straight from the source buffer. The receiver reads into one preallocated
+buffer with `recv_into`, so no bytes are copied between the socket and the
+consumer.
+"""
+import argparse
+from dataclasses import dataclass
+import logging
+from pathlib import Path
+import socket
+import socketserver
+import struct
+from typing import Iterator, NamedTuple
+
+from python_streaming.catalog import AudioCatalog, AudioEntry
+from python_streaming.config import AUDIO_TRANSPORT_HOST, AUDIO_TRANSPORT_MAX_PAYLOAD, AUDIO_TRANSPORT_PORT, \
+    BUFFER_SIZE, MEDIA_DIRECTORY
+from python_streaming.frame_stream import DATA, END
+from python_streaming.mapped_audio import MappedAudioFiles
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"PCMT"
+PACKET_HEADER = struct.Struct("<4scBBIIQI")
+
+
+class TransportError(ConnectionError):
+    """The peer sent something that isn't a valid packet stream."""
+
+
+@dataclass(frozen=True)
+class AudioFormat:
+    channels: int
+    sample_rate: int
+    bit_depth: int
+
+    @property
+    def block_align(self) -> int:
+        return self.channels * self.bit_depth // 8
+
+    @classmethod
+    def of(cls, audio: AudioEntry) -> "AudioFormat":
+        return cls(audio.channels, audio.sample_rate, audio.bit_depth)
+
+
+class PacketHeader(NamedTuple):
+    kind: bytes
+    audio_format: AudioFormat
+    sequence: int
+    frame_offset: int
+    payload_length: int
+
+
+def encode_packet_header(
+    kind: bytes,
+    audio_format: AudioFormat,
+    sequence: int,
+    frame_offset: int,
+    payload_length: int = 0,
+) -> bytes:
+    return PACKET_HEADER.pack(
+        MAGIC, kind, audio_format.channels, audio_format.bit_depth,
+        audio_format.sample_rate, sequence, frame_offset, payload_length,
+    )
+
+
+def decode_packet_header(data: bytes | memoryview) -> PacketHeader:
+    (magic, kind, channels, bit_depth, sample_rate,
+     sequence, frame_offset, payload_length) = PACKET_HEADER.unpack(data)
+    if magic != MAGIC or kind not in (DATA, END):
+        raise TransportError("Not an audio transport packet")
+    # The format comes from the peer: a bogus one would make block_align 0
+    if channels < 1 or bit_depth < 8 or bit_depth % 8 or sample_rate < 1:
+        raise TransportError(f"Invalid audio format: {channels} channels, {bit_depth} bits, {sample_rate} Hz")
+    audio_format = AudioFormat(channels, sample_rate, bit_depth)
+    if payload_length % audio_format.block_align:
+        raise TransportError(f"Payload of {payload_length} bytes isn't made of whole frames")
+    return PacketHeader(kind, audio_format, sequence, frame_offset, payload_length)
+
+
+class AudioSender:
+    """Writes PCM buffers to a connected socket as `DATA` packets.
+
+    Args:
+        sock (socket.socket): A connected stream socket.
+        audio_format (AudioFormat): Format of every payload.
+        start_frame (int): Frame offset of the first payload.
+    """
+
+    def __init__(self, sock: socket.socket, audio_format: AudioFormat, start_frame: int = 0):
+        self.sock = sock
+        self.audio_format = audio_format
+        self.sequence = 0
+        self.frame_offset = start_frame
+
+    def _send(self, header: bytes, payload: bytes | memoryview = b""):
+        if not hasattr(self.sock, "sendmsg"):
+            self.sock.sendall(header)
+            self.sock.sendall(payload)
+            return
+        sent = self.sock.sendmsg([header, payload])
+        if sent < len(header):
+            self.sock.sendall(header[sent:])
+            self.sock.sendall(payload)
+        elif sent < len(header) + len(payload):
+            self.sock.sendall(memoryview(payload)[sent - len(header):])
+
+    def send(self, payload: bytes | memoryview):
+        """Send whole frames; the payload isn't copied."""
+        frames, remainder = divmod(len(payload), self.audio_format.block_align)
+        if remainder:
+            raise ValueError("Payloads must hold whole frames")
+        header = encode_packet_header(DATA, self.audio_format, self.sequence, self.frame_offset, len(payload))
+        self._send(header, payload)
+        self.sequence += 1
+        self.frame_offset += frames
+
+    def end(self):
+        self._send(encode_packet_header(END, self.audio_format, self.sequence, self.frame_offset))
+
+
+class AudioReceiver:
+    """Reads packets from a connected socket into a preallocated buffer.
+
+    Iterating yields `(header, payload)` for each `DATA` packet. The payload
+    is a view of the receive buffer: it's only valid until the next packet
+    is read, so consumers that keep it must copy it.
+
+    Args:
+        sock (socket.socket): A connected stream socket.
+        max_payload (int): Largest payload accepted, i.e. the buffer's size.
+    """
+
+    def __init__(self, sock: socket.socket, max_payload: int = AUDIO_TRANSPORT_MAX_PAYLOAD):
+        self.sock = sock
+        self._header = bytearray(PACKET_HEADER.size)
+        self._buffer = bytearray(max_payload)
+        self._view = memoryview(self._buffer)
+        self.expected_sequence = 0
+        self.frames_received = 0
+        self.end: PacketHeader | None = None
+
+    def _receive_exactly(self, view: memoryview):
+        while view:
+            received = self.sock.recv_into(view)
+            if not received:
+                raise ConnectionError("Connection closed in the middle of the stream")
+            view = view[received:]
+
+    def receive(self) -> tuple[PacketHeader, memoryview]:
+        self._receive_exactly(memoryview(self._header))
+        header = decode_packet_header(self._header)
+        if header.sequence != self.expected_sequence:
+            raise TransportError(f"Expected packet {self.expected_sequence}, got {header.sequence}")
+        if header.payload_length > len(self._buffer):
+            raise TransportError(f"Payload of {header.payload_length} bytes exceeds {len(self._buffer)}")
+        payload = self._view[:header.payload_length]
+        self._receive_exactly(payload)
+        self.expected_sequence += 1
+        return header, payload
+
+    def __iter__(self) -> Iterator[tuple[PacketHeader, memoryview]]:
+        while True:
+            header, payload = self.receive()
+            if header.kind == END:
+                self.end = header
+                return
+            self.frames_received += header.payload_length // header.audio_format.block_align
+            yield header, payload
+
+
+def send_audio_file(
+    sock: socket.socket,
+    mapped_files: MappedAudioFiles,
+    audio: AudioEntry,
+    start_frame: int = 0,
+    frames_per_packet: int = BUFFER_SIZE,
+):
+    """Send a catalog file from `start_frame`, as slices of its memory map."""
+    sender = AudioSender(sock, AudioFormat.of(audio), start_frame)
+    data = mapped_files.data_view(audio)
+    for first_frame in range(start_frame, audio.frames, frames_per_packet):
+        sender.send(data[
+            first_frame * audio.block_align:
+            min(first_frame + frames_per_packet, audio.frames) * audio.block_align
+        ])
+    sender.end()
+
+
+class AudioTransportServer(socketserver.ThreadingTCPServer):
+    """Sends one catalog file to every client that connects, each in its own thread.
+
+    Args:
+        audio (AudioEntry): The file to send.
+        address (tuple[str, int]): Where to listen. Port 0 picks a free one.
+        frames_per_packet (int): Frames in each `DATA` packet.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        audio: AudioEntry,
+        address: tuple[str, int] = (AUDIO_TRANSPORT_HOST, AUDIO_TRANSPORT_PORT),
+        frames_per_packet: int = BUFFER_SIZE,
+    ):
+        self.audio = audio
+        self.frames_per_packet = frames_per_packet
+        self.mapped_files = MappedAudioFiles()
+        super().__init__(address, _AudioTransportHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.mapped_files.clear()
+
+
+class _AudioTransportHandler(socketserver.BaseRequestHandler):
+    server: AudioTransportServer
+
+    def handle(self):
+        try:
+            send_audio_file(
+                self.request, self.server.mapped_files, self.server.audio,
+                frames_per_packet=self.server.frames_per_packet,
+            )
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Client %s disconnected", self.client_address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a catalog audio file to every client that connects.")
+    parser.add_argument("audio_id")
+    parser.add_argument("--host", default=AUDIO_TRANSPORT_HOST)
+    parser.add_argument("--port", type=int, default=AUDIO_TRANSPORT_PORT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    catalog = AudioCatalog(Path(MEDIA_DIRECTORY))
+    catalog.scan()
+    if (audio := catalog.get(args.audio_id)) is None:
+        parser.error(f"No audio {args.audio_id!r} in {MEDIA_DIRECTORY}")
+    with AudioTransportServer(audio, (args.host, args.port)) as server:
+        logger.info("Serving %s on %s:%d", audio.audio_id, *server.server_address[:2])
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Loopback check and benchmark of the binary audio transport against the
+former pickle-over-TCP protocol (8-byte length prefix, `data += packet`
+receive loop, `pickle.loads` per frame).
+
+Both run over a local socket with the same file and packet size. The binary
+receiver's output is then received again, hashed and compared with the
+source: the script exits with an error if they differ. CPU time is the
+receiving thread's.
+
+Run it with `python -m python_streaming.benchmarks.audio_transport`.
+"""
+import argparse
+import hashlib
+import json
+from pathlib import Path
+import pickle
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+from python_streaming.audio_transport import AudioReceiver, AudioTransportServer
+from python_streaming.benchmarks.frame_serving import generate_wave_file
+from python_streaming.catalog import AudioCatalog
+from python_streaming.mapped_audio import MappedAudioFiles
+
+
+def legacy_send(sock: socket.socket, data: memoryview, packet_size: int):
+    for start in range(0, len(data), packet_size):
+        message = pickle.dumps(bytes(data[start:start + packet_size]))
+        sock.sendall(struct.pack("Q", len(message)) + message)
+
+
+def legacy_receive(sock: socket.socket) -> int:
+    data = b""
+    payload_size = struct.calcsize("Q")
+    received = 0
+    while True:
+        while len(data) < payload_size:
+            packet = sock.recv(4 * 1024)
+            if not packet:
+                return received
+            data += packet
+        message_size = struct.unpack("Q", data[:payload_size])[0]
+        data = data[payload_size:]
+        while len(data) < message_size:
+            data += sock.recv(4 * 1024)
+        frame = pickle.loads(data[:message_size])
+        data = data[message_size:]
+        received += len(frame)
+
+
+def measure(receive) -> dict:
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    received = receive()
+    cpu = time.thread_time() - cpu_started
+    elapsed = time.perf_counter() - started
+    return {
+        "megabytes_per_second": received / elapsed / 1e6,
+        "receiver_cpu_seconds": cpu,
+        "elapsed": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument("--sample-rate", type=int, default=192000)
+    parser.add_argument("--frames-per-packet", type=int, default=65536)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        generate_wave_file(Path(temporary_directory) / "benchmark.wav", args.seconds, args.sample_rate)
+        catalog = AudioCatalog(Path(temporary_directory))
+        catalog.scan()
+        audio = catalog.get("benchmark")
+        mapped_files = MappedAudioFiles()
+        expected_digest = hashlib.sha256(mapped_files.data_view(audio)).hexdigest()
+
+        with AudioTransportServer(audio, ("localhost", 0), args.frames_per_packet) as server:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+            def receive_binary(digest=None) -> int:
+                received = 0
+                with socket.create_connection(server.server_address) as sock:
+                    for _, payload in AudioReceiver(sock):
+                        received += len(payload)
+                        if digest is not None:
+                            digest.update(payload)
+                return received
+
+            binary = measure(receive_binary)
+            # Checked in a separate run, so that hashing isn't timed
+            digest = hashlib.sha256()
+            receive_binary(digest)
+            server.shutdown()
+
+        listener = socket.create_server(("localhost", 0))
+        legacy_data = mapped_files.data_view(audio)
+
+        def serve_legacy():
+            connection, _ = listener.accept()
+            with connection:
+                legacy_send(connection, legacy_data, args.frames_per_packet * audio.block_align)
+
+        threading.Thread(target=serve_legacy, daemon=True).start()
+        with socket.create_connection(listener.getsockname()) as sock:
+            legacy = measure(lambda: legacy_receive(sock))
+        listener.close()
+        mapped_files.clear()
+
+    results = {
+        "megabytes": audio.data_size / 1e6,
+        "frames_per_packet": args.frames_per_packet,
+        "binary": binary,
+        "pickle": legacy,
+        "speedup": binary["megabytes_per_second"] / legacy["megabytes_per_second"],
+        "loopback_identical": digest.hexdigest() == expected_digest,
+    }
+    print(json.dumps(results, indent=2))
+    if not results["loopback_identical"]:
+        raise SystemExit("The received audio differs from the source")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Measure what the chat flush policy saves: HTTP body chunks sent, chunks/s
+and CPU time, for the same token streams sent as-is and coalesced.
+
+The responses are driven straight through the ASGI interface with the stub
+chat backend, and every body chunk is framed like chunked encoding and
+written to a local socket, as a server would. No server, network nor AWS
+account is involved. Run it with `python -m python_streaming.benchmarks.chat_flush`.
+"""
+import argparse
+import asyncio
+import json
+import socket
+import threading
+import time
+
+from fastapi.responses import StreamingResponse
+
+from python_streaming import chatting_service
+from python_streaming.chatting_service import StubBackend
+from python_streaming.flush_policy import FlushPolicy, coalesce_chunks
+
+
+def open_discarding_socket() -> socket.socket:
+    """A socket whose peer reads and drops everything, in a daemon thread."""
+    writer, reader = socket.socketpair()
+
+    def drain():
+        while reader.recv(1 << 16):
+            pass
+
+    threading.Thread(target=drain, daemon=True).start()
+    return writer
+
+
+async def send_response(response: StreamingResponse, transport: socket.socket) -> tuple[int, int]:
+    chunks = 0
+    size = 0
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal chunks, size
+        if message["type"] == "http.response.body" and message.get("body"):
+            body = message["body"]
+            chunks += 1
+            size += len(body)
+            transport.sendall(b"%x\r\n%b\r\n" % (len(body), body))
+
+    scope = {"type": "http", "asgi": {"spec_version": "2.4"}, "http_version": "1.1", "method": "POST"}
+    await response(scope, receive, send)
+    return chunks, size
+
+
+async def run(policy: FlushPolicy | None, streams: int, prompt: str, token_interval: float) -> dict:
+    backend = StubBackend(first_token_delay=0.0, token_interval=token_interval)
+    transport = open_discarding_socket()
+
+    async def one_stream():
+        tokens = await chatting_service.chat(prompt, backend)
+        body = coalesce_chunks(tokens, policy) if policy is not None else tokens
+        return await send_response(StreamingResponse(body, media_type="text/plain"), transport)
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one_stream() for _ in range(streams)))
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    transport.close()
+    chunks = sum(chunks for chunks, _ in results)
+    return {
+        "chunks": chunks,
+        "bytes": sum(size for _, size in results),
+        "chunks_per_second": chunks / elapsed,
+        "cpu_seconds": cpu,
+        "cpu_microseconds_per_byte": cpu / max(sum(size for _, size in results), 1) * 1e6,
+        "elapsed": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--prompt-words", type=int, default=400)
+    parser.add_argument("--token-interval", type=float, default=0.0)
+    parser.add_argument("--min-bytes", type=int, default=FlushPolicy.min_bytes)
+    parser.add_argument("--max-delay", type=float, default=FlushPolicy.max_delay)
+    args = parser.parse_args()
+
+    # The stub backend echoes the prompt, so its length sets the answer's
+    prompt = " ".join(["token"] * args.prompt_words)
+    policy = FlushPolicy(min_bytes=args.min_bytes, max_delay=args.max_delay)
+    results = {
+        "streams": args.streams,
+        "unbuffered": asyncio.run(run(None, args.streams, prompt, args.token_interval)),
+        "coalesced": asyncio.run(run(policy, args.streams, prompt, args.token_interval)),
+    }
+    results["chunk_reduction"] = results["unbuffered"]["chunks"] / max(results["coalesced"]["chunks"], 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Compare the per-request open/seek/read path against memory-mapped frame
+serving, for the same random frame requests.
+
+Run it with `python -m python_streaming.benchmarks.frame_serving`. If the
+media directory holds no WAVE files, a synthetic one is generated.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+from pathlib import Path
+import random
+import tempfile
+import time
+import wave
+
+from python_streaming.audio import read_audio_frames
+from python_streaming.catalog import AudioCatalog, AudioEntry
+from python_streaming.config import BUFFER_SIZE, MEDIA_DIRECTORY, RANGED_REQUEST_BUFFERS
+from python_streaming.mapped_audio import MappedAudioFiles, read_mapped_audio_frames
+
+
+def generate_wave_file(path: Path, seconds: int = 60, sample_rate: int = 44100):
+    with wave.open(str(path), "wb") as audio:
+        audio.setnchannels(2)
+        audio.setsampwidth(2)
+        audio.setframerate(sample_rate)
+        audio.writeframes(random.randbytes(seconds * sample_rate * 4))
+
+
+def run(read_frames, start_frames: list[int], number_of_frames: int, threads: int) -> dict:
+    def serve(start_frame: int) -> int:
+        # Taking the length is the only thing a response body does with the data
+        # before handing it to the transport
+        return len(read_frames(start_frame, number_of_frames))
+
+    started = time.perf_counter()
+    if threads == 1:
+        total_bytes = sum(map(serve, start_frames))
+    else:
+        with ThreadPoolExecutor(threads) as executor:
+            total_bytes = sum(executor.map(serve, start_frames))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests_per_second": len(start_frames) / elapsed,
+        "megabytes_per_second": total_bytes / elapsed / 1e6,
+        "elapsed": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--frames", type=int, default=BUFFER_SIZE * RANGED_REQUEST_BUFFERS)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        catalog = AudioCatalog(Path(MEDIA_DIRECTORY))
+        catalog.scan()
+        if not len(catalog):
+            catalog = AudioCatalog(Path(temporary_directory))
+            generate_wave_file(Path(temporary_directory) / "benchmark.wav")
+            catalog.scan()
+        audio: AudioEntry = next(iter(catalog))
+
+        start_frames = [
+            random.randrange(0, max(audio.frames - args.frames, 1))
+            for _ in range(args.requests)
+        ]
+        mapped_files = MappedAudioFiles()
+        results = {
+            "audio_id": audio.audio_id,
+            "frames_per_request": args.frames,
+            "threads": args.threads,
+            "read": run(
+                lambda start, frames: read_audio_frames(audio, start, frames),
+                start_frames, args.frames, args.threads,
+            ),
+            "mmap": run(
+                lambda start, frames: read_mapped_audio_frames(mapped_files, audio, start, frames),
+                start_frames, args.frames, args.threads,
+            ),
+        }
+        mapped_files.clear()
+    results["speedup"] = results["mmap"]["requests_per_second"] / results["read"]["requests_per_second"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
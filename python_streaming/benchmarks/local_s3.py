@@ -0,0 +1,158 @@
+"""A local stand-in for S3, serving a directory as a bucket.
+
+It implements what `python_streaming.s3_media` uses: HEAD and GET of
+objects, single `Range` GETs and `If-Match`, with S3's error codes. Each
+request can be given a latency and each connection a bandwidth, so that it
+behaves like S3 rather than like a local disk: one connection is slow, and
+the throughput comes from running several.
+
+Serve the resources directory as the "media" bucket with
+`python -m python_streaming.benchmarks.local_s3 --directory resources --bucket media`,
+then run an app with `MEDIA_BACKEND=s3 S3_MEDIA_BUCKET=media
+S3_ENDPOINT_URL=http://localhost:9000` (and any AWS credentials).
+"""
+import argparse
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import mimetypes
+from pathlib import Path
+import re
+import time
+from urllib.parse import unquote, urlsplit
+
+
+RANGE = re.compile(r"bytes=(\d+)-(\d*)$")
+SEND_SIZE = 64 * 1024
+
+
+class LocalS3Server(ThreadingHTTPServer):
+    """Serves `directory` as the bucket `bucket`.
+
+    Args:
+        address (tuple[str, int]): Where to listen.
+        directory (Path): The bucket's content; keys are relative paths.
+        bucket (str): The bucket name.
+        latency (float): Seconds before each response.
+        bandwidth (float | None): Bytes per second per response, or None for no limit.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address: tuple[str, int], directory: Path, bucket: str,
+                 latency: float = 0.0, bandwidth: float | None = None):
+        super().__init__(address, LocalS3Handler)
+        self.directory = directory.resolve()
+        self.bucket = bucket
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests = 0
+
+    @property
+    def endpoint_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class LocalS3Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: LocalS3Server
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_error_code(self, status: int, code: str, with_body: bool = True):
+        body = f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><Error><Code>{code}</Code></Error>".encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body) if with_body else 0))
+        self.end_headers()
+        if with_body:
+            self.wfile.write(body)
+
+    def resolve(self) -> Path | None:
+        bucket, _, key = unquote(urlsplit(self.path).path).lstrip("/").partition("/")
+        if bucket != self.server.bucket or not key:
+            return None
+        path = (self.server.directory / key).resolve()
+        if self.server.directory not in path.parents or not path.is_file():
+            return None
+        return path
+
+    def do_HEAD(self):
+        self.respond(with_body=False)
+
+    def do_GET(self):
+        self.respond(with_body=True)
+
+    def respond(self, with_body: bool):
+        self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        path = self.resolve()
+        if path is None:
+            self.send_error_code(404, "NoSuchKey", with_body)
+            return
+        stat = path.stat()
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        if_match = self.headers.get("If-Match")
+        if if_match and if_match.strip() != etag:
+            self.send_error_code(412, "PreconditionFailed", with_body)
+            return
+
+        first, last = 0, stat.st_size - 1
+        status = 200
+        if range_header := self.headers.get("Range"):
+            match = RANGE.match(range_header.strip())
+            if match is None or int(match.group(1)) >= stat.st_size:
+                self.send_error_code(416, "InvalidRange", with_body)
+                return
+            first = int(match.group(1))
+            last = min(int(match.group(2)), last) if match.group(2) else last
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Length", str(last - first + 1))
+        self.send_header("Content-Type", mimetypes.guess_type(path.name)[0] or "binary/octet-stream")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {first}-{last}/{stat.st_size}")
+        self.end_headers()
+        if with_body:
+            self.send_body(path, first, last - first + 1)
+
+    def send_body(self, path: Path, offset: int, length: int):
+        started = time.monotonic()
+        sent = 0
+        with open(path, "rb") as file:
+            file.seek(offset)
+            while sent < length:
+                data = file.read(min(SEND_SIZE, length - sent))
+                if not data:
+                    break
+                self.wfile.write(data)
+                sent += len(data)
+                if self.server.bandwidth:
+                    ahead = sent / self.server.bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--directory", type=Path, default=Path("resources"))
+    parser.add_argument("--bucket", default="media")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per request")
+    parser.add_argument("--bandwidth", type=float, default=None, help="Bytes per second per connection")
+    args = parser.parse_args()
+
+    with LocalS3Server((args.host, args.port), args.directory, args.bucket, args.latency, args.bandwidth) as server:
+        print(f"Serving {args.directory} as s3://{args.bucket} on {server.endpoint_url}", flush=True)
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Measure dropouts of jittery streams played through fixed and adaptive
+jitter buffers.
+
+Every configuration plays the same synthetic stream: buffers whose arrival
+times vary (log-normally, plus occasional stalls, as on a congested
+network), from a source slightly faster than real time on average. The
+audio goes to a `NullSink` running `--speed` times faster than real time,
+with the arrival delays and the buffers' clocks scaled alike, so no sound
+hardware is involved. Run it with `python -m python_streaming.benchmarks.playback`.
+"""
+import argparse
+import asyncio
+from dataclasses import asdict
+import json
+import random
+import time
+
+from python_streaming.playback import JitterBuffer, NullSink, play
+
+
+CHANNELS = 2
+SAMPLE_RATE = 44100
+BIT_DEPTH = 16
+
+
+def arrival_delays(args: argparse.Namespace) -> list[float]:
+    """Seconds (of real time) taken by each buffer, the same for every run."""
+    rng = random.Random(args.seed)
+    chunk_seconds = args.chunk_frames / SAMPLE_RATE
+    delays = []
+    for _ in range(int(args.seconds / chunk_seconds)):
+        # Log-normal with a mean of 1, so that the source averages `headroom` times real time
+        delay = chunk_seconds / args.headroom * rng.lognormvariate(-args.sigma ** 2 / 2, args.sigma)
+        if rng.random() < args.stall_probability:
+            delay += rng.uniform(0.5, 1.5) * args.stall_seconds
+        delays.append(delay)
+    return delays
+
+
+async def jittery_buffers(delays: list[float], chunk: bytes, speed: float):
+    for delay in delays:
+        await asyncio.sleep(delay / speed)
+        yield chunk
+
+
+async def run(delays: list[float], min_depth: float, max_depth: float, args: argparse.Namespace) -> dict:
+    started = time.monotonic()
+    jitter_buffer = JitterBuffer(
+        CHANNELS, SAMPLE_RATE, BIT_DEPTH, min_depth, max_depth,
+        clock=lambda: time.monotonic() * args.speed,
+    )
+    chunk = bytes(args.chunk_frames * CHANNELS * BIT_DEPTH // 8)
+    stats = await play(
+        jittery_buffers(delays, chunk, args.speed),
+        NullSink(args.device_frames, speed=args.speed),
+        CHANNELS, SAMPLE_RATE, BIT_DEPTH,
+        jitter_buffer=jitter_buffer,
+    )
+    return {
+        **asdict(stats),
+        "dropout_seconds": stats.dropout_frames / SAMPLE_RATE,
+        "wall_seconds": time.monotonic() - started,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=120, help="Audio played per configuration")
+    parser.add_argument("--speed", type=float, default=4.0)
+    parser.add_argument("--chunk-frames", type=int, default=4096)
+    parser.add_argument("--device-frames", type=int, default=1024)
+    parser.add_argument("--headroom", type=float, default=1.1, help="Average source speed over real time")
+    parser.add_argument("--sigma", type=float, default=0.5, help="Log-normal spread of the arrival times")
+    parser.add_argument("--stall-probability", type=float, default=0.01)
+    parser.add_argument("--stall-seconds", type=float, default=0.4)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    delays = arrival_delays(args)
+    configurations = {
+        "fixed_100ms": (0.1, 0.1),
+        "fixed_500ms": (0.5, 0.5),
+        "adaptive": (0.1, 3.0),
+    }
+    results = {
+        name: asyncio.run(run(delays, min_depth, max_depth, args))
+        for name, (min_depth, max_depth) in configurations.items()
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Loopback check and benchmark of the parallel ranged S3 downloads against
+the former single GET read 1 KiB at a time, on the local S3 stand-in.
+
+The stand-in gets a per-request latency and a per-connection bandwidth, like
+S3. The downloaded bytes are hashed and compared with the file, and two
+failures are checked to surface as exceptions: a missing object, and an
+object replaced in the middle of a download. The script exits with an error
+if any check fails.
+
+Run it with `python -m python_streaming.benchmarks.s3_download`.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+
+from python_streaming.benchmarks.local_s3 import LocalS3Server
+from python_streaming.s3_media import S3ClientPool, S3DownloadError, S3Downloader, S3ObjectNotFound
+
+
+def legacy_download(endpoint_url: str, bucket: str, key: str) -> hashlib.sha256:
+    digest = hashlib.sha256()
+    s3 = boto3.resource("s3", endpoint_url=endpoint_url, config=Config(s3={"addressing_style": "path"}))
+    streaming_body = s3.Object(bucket, key).get()["Body"]
+    for chunk in iter(lambda: streaming_body.read(1024), b""):
+        digest.update(chunk)
+    return digest
+
+
+def parallel_download(downloader: S3Downloader, bucket: str, key: str) -> hashlib.sha256:
+    digest = hashlib.sha256()
+    for chunk in downloader.iterate(downloader.head(bucket, key)):
+        digest.update(chunk)
+    return digest
+
+
+def measure(download, size: int) -> tuple[dict, str]:
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    digest = download()
+    elapsed = time.perf_counter() - started
+    return {
+        "megabytes_per_second": size / elapsed / 1e6,
+        "cpu_seconds": time.process_time() - cpu_started,
+        "elapsed": elapsed,
+    }, digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--megabytes", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per request")
+    parser.add_argument("--bandwidth", type=float, default=20e6, help="Bytes per second per connection")
+    args = parser.parse_args()
+
+    # The stand-in doesn't check signatures, but botocore wants something to sign with
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        directory = Path(temporary_directory)
+        data = os.urandom(args.megabytes * 1024 * 1024)
+        (directory / "media.bin").write_bytes(data)
+        expected_digest = hashlib.sha256(data).hexdigest()
+
+        with LocalS3Server(("127.0.0.1", 0), directory, "bucket", args.latency, args.bandwidth) as server:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            with ThreadPoolExecutor(max_workers=16, thread_name_prefix="s3") as executor:
+                downloader = S3Downloader(S3ClientPool(endpoint_url=server.endpoint_url), executor)
+
+                parallel, parallel_digest = measure(
+                    lambda: parallel_download(downloader, "bucket", "media.bin"), len(data)
+                )
+                parallel["requests"] = server.requests
+                legacy, legacy_digest = measure(
+                    lambda: legacy_download(server.endpoint_url, "bucket", "media.bin"), len(data)
+                )
+
+                errors = {}
+                try:
+                    parallel_download(downloader, "bucket", "missing.bin")
+                except S3ObjectNotFound:
+                    errors["missing_object"] = "S3ObjectNotFound"
+                try:
+                    chunks = downloader.iterate(downloader.head("bucket", "media.bin"))
+                    next(chunks)
+                    (directory / "media.bin").write_bytes(data[::-1])
+                    for _ in chunks:
+                        pass
+                except S3DownloadError as e:
+                    errors["replaced_object"] = type(e).__name__
+            server.shutdown()
+
+    results = {
+        "megabytes": len(data) / 1e6,
+        "stand_in": {"latency": args.latency, "bandwidth_per_connection": args.bandwidth},
+        "parallel": parallel,
+        "legacy": legacy,
+        "speedup": parallel["megabytes_per_second"] / legacy["megabytes_per_second"],
+        "parallel_identical": parallel_digest == expected_digest,
+        "legacy_identical": legacy_digest == expected_digest,
+        "errors_raised": errors,
+    }
+    print(json.dumps(results, indent=2))
+    if not results["parallel_identical"]:
+        raise SystemExit("The downloaded object differs from the source")
+    if set(errors) != {"missing_object", "replaced_object"}:
+        raise SystemExit("Download failures weren't raised")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""Streaming benchmark of every streaming route of the FastAPI, Flask and
+websockets servers.
+
+Each response is consumed incrementally, recording when every chunk (HTTP
+read or WebSocket message) arrives. Per route, the report gives the
+time-to-first-byte and inter-chunk gap distributions, throughput and the
+number of stalls, i.e. gaps longer than `--stall-threshold`.
+
+The servers run in-process on free local ports, with the stub chat backend
+and a generated WAVE file, so neither AWS nor the media directory are
+involved. Chat prompts are unique per request so the chat cache doesn't
+answer them.
+
+Run it with `python -m python_streaming.benchmarks.streaming --output report.json`.
+Pass an earlier report as `--baseline` to list the routes that got slower
+than `--tolerance` allows; the script then exits with an error.
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import datetime
+import json
+import os
+from pathlib import Path
+import platform
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Callable
+
+import urllib3
+
+
+@dataclass
+class StreamTiming:
+    started: float
+    chunk_times: list[float] = field(default_factory=list)
+    size: int = 0
+    error: str | None = None
+
+    def chunk(self, size: int):
+        self.chunk_times.append(time.perf_counter())
+        self.size += size
+
+
+@dataclass
+class Scenario:
+    name: str
+    consume: Callable[[int, StreamTiming], None]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"Nothing listening on port {port}")
+
+
+def start_fastapi(port: int):
+    import uvicorn
+    from python_streaming.fastapi_app.app import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    wait_for_port(port)
+
+
+def start_flask(port: int):
+    import uvicorn
+    from python_streaming.flask_app.app import asgi_app
+
+    # Served the way the launcher serves it
+    server = uvicorn.Server(uvicorn.Config(asgi_app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    wait_for_port(port)
+
+
+def start_websockets(port: int):
+    import websockets
+    from python_streaming.websocket_app import server
+
+    async def serve():
+        feed = asyncio.create_task(server.feed_json_data(server.json_data_hub))
+        async with websockets.serve(server.stream_json_data, "127.0.0.1", port):
+            await feed
+
+    threading.Thread(target=asyncio.run, args=(serve(),), daemon=True).start()
+    wait_for_port(port)
+
+
+def http_scenario(http: urllib3.PoolManager, name: str, method: str, url: str, json_body=None) -> Scenario:
+    def consume(index: int, timing: StreamTiming):
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body(index) if callable(json_body) else json_body).encode("utf-8")
+        response = http.request(
+            method, url, body=body, headers={"Content-Type": "application/json"},
+            preload_content=False, retries=False,
+        )
+        try:
+            if response.status >= 400:
+                response.drain_conn()
+                raise RuntimeError(f"HTTP {response.status}")
+            # Chunked bodies are read chunk by chunk, others as the socket delivers them
+            chunks = (
+                response.read_chunked(decode_content=False) if response.chunked
+                else iter(lambda: response.read1(64 * 1024), b"")
+            )
+            for chunk in chunks:
+                timing.chunk(len(chunk))
+        finally:
+            response.release_conn()
+
+    return Scenario(name, consume)
+
+
+def websocket_scenario(name: str, uri: str, request: str | None = None, end: str | None = None) -> Scenario:
+    from websockets.exceptions import ConnectionClosedOK
+    from websockets.sync.client import connect
+
+    def consume(index: int, timing: StreamTiming):
+        with connect(uri, max_size=None) as websocket:
+            if request is not None:
+                websocket.send(request)
+            try:
+                while True:
+                    message = websocket.recv()
+                    if message == end:
+                        return
+                    timing.chunk(len(message))
+            except ConnectionClosedOK:
+                return
+
+    return Scenario(name, consume)
+
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def rank(fraction: float) -> float:
+        return values[min(int(fraction * len(values)), len(values) - 1)]
+
+    return {
+        "p50": rank(0.5),
+        "p90": rank(0.9),
+        "p99": rank(0.99),
+        "max": values[-1],
+        "mean": sum(values) / len(values),
+    }
+
+
+def run_scenario(scenario: Scenario, requests: int, concurrency: int, stall_threshold: float) -> dict:
+    def one(index: int) -> StreamTiming:
+        timing = StreamTiming(time.perf_counter())
+        try:
+            scenario.consume(index, timing)
+        except Exception as e:
+            timing.error = f"{type(e).__name__}: {e}"
+        else:
+            if not timing.chunk_times:
+                timing.error = "The stream ended without any data"
+        return timing
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        timings = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    succeeded = [timing for timing in timings if timing.error is None]
+    gaps = [
+        later - earlier
+        for timing in succeeded
+        for earlier, later in zip(timing.chunk_times, timing.chunk_times[1:])
+    ]
+    durations = [timing.chunk_times[-1] - timing.started for timing in succeeded]
+    total_bytes = sum(timing.size for timing in succeeded)
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": len(timings) - len(succeeded),
+        "error_samples": sorted({timing.error for timing in timings if timing.error})[:3],
+        "ttfb": percentiles([timing.chunk_times[0] - timing.started for timing in succeeded]),
+        "inter_chunk_gap": percentiles(gaps),
+        "chunks_per_stream": sum(len(timing.chunk_times) for timing in succeeded) / max(len(succeeded), 1),
+        "stalls": sum(gap > stall_threshold for gap in gaps),
+        "duration": percentiles(durations),
+        "bytes": total_bytes,
+        "bytes_per_second": total_bytes / elapsed,
+        "stream_bytes_per_second": percentiles([
+            timing.size / duration for timing, duration in zip(succeeded, durations) if duration > 0
+        ]),
+        "elapsed": elapsed,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Routes whose latency grew, or throughput dropped, by more than `tolerance`."""
+    regressions = []
+    for name, result in report["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or not result.get("ttfb") or not previous.get("ttfb"):
+            continue
+        checks = [
+            ("ttfb p50", result["ttfb"]["p50"], previous["ttfb"]["p50"], True),
+            ("inter-chunk gap p99", result["inter_chunk_gap"].get("p99", 0),
+             previous["inter_chunk_gap"].get("p99", 0), True),
+            ("bytes/s", result["bytes_per_second"], previous["bytes_per_second"], False),
+        ]
+        for metric, value, previous_value, lower_is_better in checks:
+            if not previous_value:
+                continue
+            change = value / previous_value - 1
+            if (change > tolerance) if lower_is_better else (change < -tolerance):
+                regressions.append(f"{name}: {metric} {previous_value:.4g} -> {value:.4g} ({change:+.0%})")
+        if result["stalls"] > previous["stalls"] * (1 + tolerance):
+            regressions.append(f"{name}: stalls {previous['stalls']} -> {result['stalls']}")
+    return regressions
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20, help="Requests per route")
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--stall-threshold", type=float, default=0.25, help="Seconds")
+    parser.add_argument("--token-interval", type=float, default=0.02, help="Stub backend, seconds")
+    parser.add_argument("--first-token-delay", type=float, default=0.4, help="Stub backend, seconds")
+    parser.add_argument("--routes", help="Only run the routes whose name contains this")
+    parser.add_argument("--output", type=Path, help="Where to write the JSON report")
+    parser.add_argument("--baseline", type=Path, help="An earlier report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    temporary_directory = tempfile.TemporaryDirectory()
+    media_directory = Path(temporary_directory.name)
+    # Configuration is read at import time: set it before importing the apps
+    os.environ.update({
+        "CHAT_BACKEND": "stub",
+        "CHAT_STUB_FIRST_TOKEN_DELAY": str(args.first_token_delay),
+        "CHAT_STUB_TOKEN_INTERVAL": str(args.token_interval),
+        "MEDIA_DIRECTORY": str(media_directory),
+        "CATALOG_INDEX_PATH": str(media_directory / ".catalog.json"),
+        "RENDITION_CACHE_DIRECTORY": str(media_directory / ".renditions"),
+    })
+    from python_streaming.benchmarks.frame_serving import generate_wave_file
+    generate_wave_file(media_directory / "benchmark.wav", seconds=30)
+
+    fastapi_port, flask_port, websockets_port = free_port(), free_port(), free_port()
+    start_fastapi(fastapi_port)
+    start_flask(flask_port)
+    start_websockets(websockets_port)
+
+    http = urllib3.PoolManager(maxsize=args.concurrency)
+    fastapi = f"http://127.0.0.1:{fastapi_port}"
+    flask = f"http://127.0.0.1:{flask_port}"
+
+    def chat_body(index: int) -> dict:
+        return {"user_id": "benchmark", "message": f"Benchmark prompt number {index} at {time.time()}"}
+
+    scenarios = [
+        http_scenario(http, "fastapi GET /audios/file-stream", "GET", f"{fastapi}/audios/file-stream"),
+        http_scenario(http, "fastapi GET /audios/streaming-response", "GET", f"{fastapi}/audios/streaming-response"),
+        http_scenario(http, "fastapi GET /data/stream", "GET", f"{fastapi}/data/stream"),
+        http_scenario(
+            http, "fastapi GET /audios/frame-stream", "GET", f"{fastapi}/audios/frame-stream/benchmark"
+        ),
+        http_scenario(http, "fastapi POST /chat", "POST", f"{fastapi}/chat", chat_body),
+        websocket_scenario(
+            "fastapi WS /data/websocket",
+            f"ws://127.0.0.1:{fastapi_port}/data/websocket?messages_per_second=0",
+        ),
+        http_scenario(http, "flask GET /audios/streaming-response", "GET", f"{flask}/audios/streaming-response"),
+        http_scenario(http, "flask GET /data/stream", "GET", f"{flask}/data/stream"),
+        http_scenario(http, "flask POST /chat", "POST", f"{flask}/chat", chat_body),
+        websocket_scenario("websockets json feed", f"ws://127.0.0.1:{websockets_port}", "json", "EOF"),
+    ]
+    if args.routes:
+        scenarios = [scenario for scenario in scenarios if args.routes in scenario.name]
+
+    report = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "settings": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "stall_threshold": args.stall_threshold,
+            "stub_first_token_delay": args.first_token_delay,
+            "stub_token_interval": args.token_interval,
+        },
+        "results": {},
+    }
+    for scenario in scenarios:
+        report["results"][scenario.name] = run_scenario(
+            scenario, args.requests, args.concurrency, args.stall_threshold
+        )
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            report["regressions"] = compare(report, json.load(file), args.tolerance)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+    for name, result in report["results"].items():
+        print(
+            f"{name:42} ttfb p50 {result['ttfb'].get('p50', float('nan')) * 1000:8.1f} ms"
+            f"  gap p99 {result['inter_chunk_gap'].get('p99', float('nan')) * 1000:8.1f} ms"
+            f"  {result['bytes_per_second'] / 1e6:8.2f} MB/s  stalls {result['stalls']:4}"
+            f"  errors {result['errors']}",
+            flush=True,
+        )
+    temporary_directory.cleanup()
+    if report.get("regressions"):
+        raise SystemExit("Regressions:\n" + "\n".join(report["regressions"]))
+
+
+if __name__ == "__main__":
+    main()
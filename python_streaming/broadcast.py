@@ -0,0 +1,191 @@
+"""Fan-out of a single feed to many WebSocket clients.
+
+One producer publishes each message once, already encoded, and the hub hands
+the same bytes object to every subscriber's bounded queue. Publishing never
+waits for a client: what happens when a queue is full is decided by the
+slow-consumer policy:
+
+- "drop_oldest": discard the oldest queued message to make room.
+- "coalesce": merge the new message into the last queued one, so a slow
+  client gets fewer, bigger frames but no gaps.
+- "disconnect": close the connection of the client that fell behind.
+
+A feed made of passes with a beginning and an end (e.g. a file read over and
+over) can hold new subscribers until the next pass starts, so that every
+client gets a whole pass rather than the tail of the current one.
+"""
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from python_streaming.config import BROADCAST_QUEUE_SIZE, BROADCAST_SLOW_CONSUMER_POLICY
+
+
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+
+class SlowConsumerError(ConnectionError):
+    """The subscriber's queue overflowed under the "disconnect" policy."""
+
+
+@dataclass
+class BroadcastStats:
+    subscribers: int = 0
+    published: int = 0
+    dropped: int = 0
+    coalesced: int = 0
+    disconnected: int = 0
+
+
+class Subscription:
+    """A subscriber's queue of pending messages.
+
+    Entries are `(message, mergeable)` pairs: control messages (e.g. end of
+    feed markers) are never dropped nor merged.
+    """
+
+    def __init__(self, hub: "BroadcastHub"):
+        self.hub = hub
+        self._queue: deque[tuple[bytes | str, bool]] = deque()
+        self._ready = asyncio.Event()
+        self.overflowed = False
+        self.closed = False
+
+    def __aiter__(self) -> AsyncIterator[bytes | str]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[bytes | str]:
+        while True:
+            while not self._queue:
+                if self.overflowed:
+                    raise SlowConsumerError("Subscriber fell behind the feed")
+                if self.closed:
+                    return
+                self._ready.clear()
+                await self._ready.wait()
+            yield self._queue.popleft()[0]
+
+    def offer(self, message: bytes | str, mergeable: bool):
+        if self.closed or self.overflowed:
+            return
+        if mergeable and len(self._queue) >= self.hub.queue_size:
+            stats = self.hub.stats
+            if self.hub.policy == "disconnect":
+                self.overflowed = True
+                self._queue.clear()
+                stats.disconnected += 1
+            elif self.hub.policy == "coalesce" and self._queue[-1][1]:
+                self._queue[-1] = (self._queue[-1][0] + self.hub.separator + message, True)
+                stats.coalesced += 1
+            else:
+                for index, (_, droppable) in enumerate(self._queue):
+                    if droppable:
+                        del self._queue[index]
+                        break
+                self._queue.append((message, True))
+                stats.dropped += 1
+        else:
+            self._queue.append((message, mergeable))
+        self._ready.set()
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+
+class BroadcastHub:
+    """Publishes messages to every current subscriber.
+
+    Args:
+        queue_size (int): Messages a subscriber may have pending before the
+            slow-consumer policy kicks in.
+        policy (str): One of `SLOW_CONSUMER_POLICIES`.
+        separator (bytes): Inserted between messages merged by "coalesce".
+    """
+
+    def __init__(
+        self,
+        queue_size: int = BROADCAST_QUEUE_SIZE,
+        policy: str = BROADCAST_SLOW_CONSUMER_POLICY,
+        separator: bytes = b"\n",
+    ):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy!r}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.separator = separator
+        self.stats = BroadcastStats()
+        self._subscriptions: set[Subscription] = set()
+        # Subscriptions held until the next pass of the feed starts
+        self._waiting: set[Subscription] = set()
+        self._has_subscribers = asyncio.Event()
+
+    def __len__(self) -> int:
+        """Subscribers receiving what's being published."""
+        return len(self._subscriptions)
+
+    @property
+    def waiting(self) -> int:
+        """Subscribers held until the next pass starts."""
+        return len(self._waiting)
+
+    def _update_subscribers(self):
+        self.stats.subscribers = len(self._subscriptions) + len(self._waiting)
+        if self.stats.subscribers:
+            self._has_subscribers.set()
+        else:
+            self._has_subscribers.clear()
+
+    def subscribe(self, from_start: bool = False) -> Subscription:
+        """Args:
+            from_start (bool): Hold the subscription until the next pass
+                starts (see `start_pass`) instead of joining the current one.
+        """
+        subscription = Subscription(self)
+        (self._waiting if from_start else self._subscriptions).add(subscription)
+        self._update_subscribers()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.close()
+        self._subscriptions.discard(subscription)
+        self._waiting.discard(subscription)
+        self._update_subscribers()
+
+    async def wait_for_subscribers(self):
+        """Let producers idle instead of reading a feed nobody listens to."""
+        await self._has_subscribers.wait()
+
+    def start_pass(self):
+        """Let the subscriptions held for the next pass receive it."""
+        self._subscriptions |= self._waiting
+        self._waiting.clear()
+
+    def end_pass(self, message: bytes | str):
+        """Publish a final control message and close the subscriptions that
+        received the pass. They end once they have read it."""
+        self.publish_control(message)
+        for subscription in self._subscriptions:
+            subscription.close()
+        self._subscriptions.clear()
+        self._update_subscribers()
+
+    def close(self):
+        """End every subscription, e.g. when the feed has failed."""
+        for subscription in self._subscriptions | self._waiting:
+            subscription.close()
+        self._subscriptions.clear()
+        self._waiting.clear()
+        self._update_subscribers()
+
+    def publish(self, message: bytes):
+        """Queue an encoded data message for every subscriber. Never blocks."""
+        self.stats.published += 1
+        for subscription in self._subscriptions:
+            subscription.offer(message, True)
+
+    def publish_control(self, message: bytes | str):
+        """Queue a message that must reach every subscriber as is."""
+        for subscription in self._subscriptions:
+            subscription.offer(message, False)
@@ -0,0 +1,229 @@
+"""Audio catalog: an in-memory index of the WAVE files in the media directory.
+
+The catalog parses each file's RIFF header once, keeps the results in a dict
+keyed by audio ID and persists them to disk, so that serving a frame buffer is
+a dictionary lookup followed by a read. Entries are invalidated whenever the
+file's modification time or size changes.
+"""
+from dataclasses import asdict, dataclass
+import json
+import logging
+import os
+from pathlib import Path
+import struct
+from typing import Iterator
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+WAVE_FORMAT_NAMES = {
+    WAVE_FORMAT_PCM: "PCM",
+    WAVE_FORMAT_IEEE_FLOAT: "FLOAT",
+}
+
+
+class WaveHeaderError(ValueError):
+    """The file is not a RIFF/WAVE file we know how to index."""
+
+
+class StaleAudioError(RuntimeError):
+    """The file changed since its catalog entry was made."""
+
+
+@dataclass(frozen=True)
+class AudioEntry:
+    """Metadata of a single WAVE file, as parsed from its header."""
+    audio_id: str
+    path: str
+    format: str
+    sample_rate: int
+    channels: int
+    bit_depth: int
+    block_align: int
+    data_offset: int
+    data_size: int
+    mtime_ns: int
+    file_size: int
+
+    @property
+    def frames(self) -> int:
+        return self.data_size // self.block_align
+
+    @property
+    def duration(self) -> float:
+        return self.frames / self.sample_rate
+
+    def frame_to_byte(self, frame: int) -> int:
+        """Absolute file offset of the given frame, clamped to the data chunk."""
+        return self.data_offset + min(frame, self.frames) * self.block_align
+
+
+def parse_wave_header(audio_file_path: Path) -> dict:
+    """Walk the RIFF chunks of a WAVE file and extract its format and the real
+    position of the `data` chunk (which isn't always at byte 44)."""
+    with open(audio_file_path, "rb") as file:
+        riff_header = file.read(12)
+        if len(riff_header) < 12 or riff_header[:4] != b"RIFF" or riff_header[8:12] != b"WAVE":
+            raise WaveHeaderError(f"{audio_file_path} is not a RIFF/WAVE file")
+
+        fmt = None
+        while chunk_header := file.read(8):
+            if len(chunk_header) < 8:
+                break
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+            if chunk_id == b"fmt ":
+                fmt_data = file.read(chunk_size)
+                if len(fmt_data) < 16:
+                    raise WaveHeaderError(f"{audio_file_path} has a truncated fmt chunk")
+                (audio_format, channels, sample_rate,
+                 _byte_rate, block_align, bit_depth) = struct.unpack("<HHIIHH", fmt_data[:16])
+                if audio_format == WAVE_FORMAT_EXTENSIBLE and len(fmt_data) >= 26:
+                    # The actual format tag is the first two bytes of the sub-format GUID
+                    audio_format = struct.unpack("<H", fmt_data[24:26])[0]
+                fmt = {
+                    "format": WAVE_FORMAT_NAMES.get(audio_format, f"0x{audio_format:04X}"),
+                    "sample_rate": sample_rate,
+                    "channels": channels,
+                    "bit_depth": bit_depth,
+                    "block_align": block_align,
+                }
+                if chunk_size % 2:
+                    file.seek(1, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise WaveHeaderError(f"{audio_file_path} has a data chunk before its fmt chunk")
+                data_offset = file.tell()
+                # Streamed WAVE files may leave the size unset or too large
+                data_size = min(chunk_size, os.fstat(file.fileno()).st_size - data_offset)
+                return {**fmt, "data_offset": data_offset, "data_size": data_size}
+            else:
+                # Chunks are word-aligned: odd sizes carry a padding byte
+                file.seek(chunk_size + (chunk_size % 2), os.SEEK_CUR)
+
+    raise WaveHeaderError(f"{audio_file_path} has no data chunk")
+
+
+def read_audio_entry(audio_id: str, audio_file_path: Path, stat: os.stat_result | None = None) -> AudioEntry:
+    stat = stat or os.stat(audio_file_path)
+    return AudioEntry(
+        audio_id=audio_id,
+        path=str(audio_file_path),
+        mtime_ns=stat.st_mtime_ns,
+        file_size=stat.st_size,
+        **parse_wave_header(audio_file_path),
+    )
+
+
+def ensure_unchanged(audio: AudioEntry, fileno: int):
+    """Check an open file against its catalog entry before trusting the
+    entry's offsets, or anything derived from its identity.
+
+    Raises:
+        StaleAudioError: If the file's mtime or size differ. Rescanning the
+            catalog fixes it.
+    """
+    stat = os.fstat(fileno)
+    if stat.st_mtime_ns != audio.mtime_ns or stat.st_size != audio.file_size:
+        raise StaleAudioError(f"{audio.path} changed since it was cataloged")
+
+
+class AudioCatalog:
+    """Index of the WAVE files under a media directory.
+
+    Args:
+        media_directory (Path): Directory to scan (recursively) for `.wav` files.
+        index_path (Path | None): Where to persist the index between restarts.
+            If None, the index only lives in memory.
+    """
+
+    def __init__(self, media_directory: Path, index_path: Path | None = None):
+        self.media_directory = Path(media_directory)
+        self.index_path = Path(index_path) if index_path is not None else None
+        self._entries: dict[str, AudioEntry] = {}
+
+    def __contains__(self, audio_id: str) -> bool:
+        return audio_id in self._entries
+
+    def __iter__(self) -> Iterator[AudioEntry]:
+        return iter(self._entries.values())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, audio_id: str) -> AudioEntry | None:
+        return self._entries.get(audio_id)
+
+    def audio_id_for(self, audio_file_path: Path) -> str:
+        """IDs are the file's path relative to the media directory, without suffix."""
+        return Path(audio_file_path).relative_to(self.media_directory).with_suffix("").as_posix()
+
+    def scan(self) -> None:
+        """(Re)build the index, reusing the persisted entries of unchanged files."""
+        previous = self._entries or self._load_index()
+        entries = {}
+        parsed = 0
+        for audio_file_path in sorted(self.media_directory.rglob("*.wav")):
+            audio_id = self.audio_id_for(audio_file_path)
+            if any(part.startswith(".") for part in Path(audio_id).parts):
+                # Hidden directories hold caches (renditions, segments...), not media
+                continue
+            try:
+                stat = audio_file_path.stat()
+            except OSError as e:
+                # A broken symlink, or a file deleted while scanning
+                logger.warning("Skipping %s: %s", audio_file_path, e)
+                continue
+            cached = previous.get(audio_id)
+            if (
+                cached is not None
+                and cached.mtime_ns == stat.st_mtime_ns
+                and cached.file_size == stat.st_size
+            ):
+                entries[audio_id] = cached
+                continue
+            try:
+                entries[audio_id] = read_audio_entry(audio_id, audio_file_path, stat)
+            except (WaveHeaderError, struct.error, OSError) as e:
+                logger.warning("Skipping %s: %s", audio_file_path, e)
+                continue
+            parsed += 1
+
+        self._entries = entries
+        logger.info("Audio catalog: %d files indexed, %d headers parsed", len(entries), parsed)
+        if parsed or len(entries) != len(previous):
+            self._save_index()
+
+    def _load_index(self) -> dict[str, AudioEntry]:
+        if self.index_path is None or not self.index_path.exists():
+            return {}
+        try:
+            with open(self.index_path, "r") as file:
+                index = json.load(file)
+            if index.get("version") != INDEX_VERSION:
+                return {}
+            return {
+                entry["audio_id"]: AudioEntry(**entry)
+                for entry in index["entries"]
+            }
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Ignoring unreadable catalog index %s: %s", self.index_path, e)
+            return {}
+
+    def _save_index(self) -> None:
+        if self.index_path is None:
+            return
+        index = {
+            "version": INDEX_VERSION,
+            "entries": [asdict(entry) for entry in self._entries.values()],
+        }
+        # Write to a temporary file first so a crash never leaves a torn index
+        temporary_path = self.index_path.with_suffix(self.index_path.suffix + ".tmp")
+        temporary_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(temporary_path, "w") as file:
+            json.dump(index, file)
+        os.replace(temporary_path, self.index_path)
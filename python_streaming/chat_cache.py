@@ -0,0 +1,178 @@
+"""Single-flight coalescing and replay cache for chat completions.
+
+Identical prompts that arrive while a completion is being streamed share its
+upstream stream: every subscriber gets the chunks produced so far and then
+follows along live. Completed streams are kept in an LRU (bounded by entries,
+bytes and TTL) and replayed with their original chunking.
+"""
+import asyncio
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import time
+from typing import AsyncIterator, Awaitable, Callable
+
+from python_streaming.config import CHAT_CACHE_MAX_BYTES, CHAT_CACHE_MAX_ENTRIES, CHAT_CACHE_TTL
+
+
+UpstreamFactory = Callable[[], Awaitable[AsyncIterator[str]]]
+
+
+class SharedStream:
+    """An upstream stream being fanned out to any number of subscribers."""
+
+    def __init__(self):
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self.task: asyncio.Task | None = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def produce(self, upstream_factory: UpstreamFactory):
+        upstream = None
+        try:
+            upstream = await upstream_factory()
+            async for chunk in upstream:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = ConnectionAbortedError("Upstream stream was cancelled")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            if upstream is not None and hasattr(upstream, "aclose"):
+                await upstream.aclose()
+            self.done = True
+            self._notify()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        position = 0
+        while True:
+            changed = self._changed
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+@dataclass
+class CachedStream:
+    chunks: tuple[str, ...]
+    size: int
+    expires_at: float
+
+
+@dataclass
+class ChatCacheStats:
+    hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    evictions: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+
+class ChatStreamCache:
+    """Coalesces identical in-flight prompts and replays completed ones.
+
+    Args:
+        ttl (float): Seconds a completed stream may be replayed for.
+        max_entries (int): Maximum number of completed streams kept.
+        max_bytes (int): Maximum UTF-8 size of all the completed streams kept.
+            A stream larger than this is served but not cached.
+    """
+
+    def __init__(
+        self,
+        ttl: float = CHAT_CACHE_TTL,
+        max_entries: int = CHAT_CACHE_MAX_ENTRIES,
+        max_bytes: int = CHAT_CACHE_MAX_BYTES,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = ChatCacheStats()
+        self._completed: OrderedDict[str, CachedStream] = OrderedDict()
+        self._in_flight: dict[str, SharedStream] = {}
+
+    @staticmethod
+    def key_for(user_message: str) -> str:
+        return hashlib.sha256(user_message.strip().encode("utf-8")).hexdigest()
+
+    async def stream(self, user_message: str, upstream_factory: UpstreamFactory) -> AsyncIterator[str]:
+        """Yield the chunks of the completion for `user_message`, starting an
+        upstream stream through `upstream_factory` only when neither the cache
+        nor an in-flight stream can provide them."""
+        key = self.key_for(user_message)
+
+        if (cached := self._get_completed(key)) is not None:
+            self.stats.hits += 1
+            for chunk in cached.chunks:
+                yield chunk
+            return
+
+        shared = self._in_flight.get(key)
+        if shared is None:
+            self.stats.misses += 1
+            shared = SharedStream()
+            self._in_flight[key] = shared
+            shared.task = asyncio.create_task(shared.produce(upstream_factory))
+            shared.task.add_done_callback(lambda _: self._complete(key, shared))
+        else:
+            self.stats.coalesced += 1
+
+        shared.subscribers += 1
+        try:
+            async for chunk in shared.subscribe():
+                yield chunk
+        finally:
+            shared.subscribers -= 1
+            if shared.subscribers == 0 and not shared.done:
+                # Nobody is listening any more: stop paying for the generation.
+                # Forget it right away, or a request arriving before the task
+                # has wound down would join the cancelled stream.
+                if self._in_flight.get(key) is shared:
+                    del self._in_flight[key]
+                shared.task.cancel()
+
+    def _get_completed(self, key: str) -> CachedStream | None:
+        cached = self._completed.get(key)
+        if cached is None:
+            return None
+        if cached.expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._completed.move_to_end(key)
+        return cached
+
+    def _complete(self, key: str, shared: SharedStream):
+        if self._in_flight.get(key) is shared:
+            del self._in_flight[key]
+        if shared.error is not None:
+            return
+        size = sum(len(chunk.encode("utf-8")) for chunk in shared.chunks)
+        if size > self.max_bytes:
+            return
+        if key in self._completed:
+            self._remove(key)
+        self._completed[key] = CachedStream(tuple(shared.chunks), size, time.monotonic() + self.ttl)
+        self.stats.entries += 1
+        self.stats.bytes += size
+        while len(self._completed) > self.max_entries or self.stats.bytes > self.max_bytes:
+            self._remove(next(iter(self._completed)))
+            self.stats.evictions += 1
+
+    def _remove(self, key: str):
+        cached = self._completed.pop(key)
+        self.stats.entries -= 1
+        self.stats.bytes -= cached.size
@@ -1,17 +1,20 @@
 """An example of how to consume a text/plain response that's being streamed, from the HTTP client side."""
 
-from typing import Iterator
+import time
+from typing import Iterable, Iterator, NamedTuple
 
 import reactivex as rx
-from reactivex import operators as ops
 import urllib3
 
+from python_streaming.text_chunks import decode_utf8, rx_decode_utf8, rx_rechunk, split_lines
+
 
 http = urllib3.PoolManager()
 
 
 def consume_chat_response(prompt: str, do_print: bool = False) -> Iterator[str]:
-    """Invoke the streamed chat endpoint and yield as each chunk is received."""
+    """Invoke the streamed chat endpoint and yield the text of each chunk as
+    it's received."""
     request_payload = {
         'user_id': '12345',
         'message': prompt,
@@ -26,11 +29,79 @@ def consume_chat_response(prompt: str, do_print: bool = False) -> Iterator[str]:
         json=request_payload,
         preload_content=False,
     ) as response:
-        for chunk in response.stream():
-            text_chunk = chunk.decode('utf-8')
+        # Decoded incrementally: a chunk may end in the middle of a multibyte character
+        for text_chunk in decode_utf8(response.stream()):
             if do_print:
                 print(text_chunk, end='')
-            yield chunk
+            yield text_chunk
+
+
+class ServerSentEvent(NamedTuple):
+    event: str
+    data: str
+    id: str | None
+
+
+def iterate_server_sent_events(lines: Iterable[str]) -> Iterator[ServerSentEvent]:
+    """Parse the lines of a text/event-stream body into events."""
+    event, data, event_id = "message", [], None
+    for line in lines:
+        if not line:
+            if data:
+                yield ServerSentEvent(event, "\n".join(data), event_id)
+            event, data = "message", []
+            continue
+        field, _, value = line.partition(":")
+        value = value.removeprefix(" ")
+        if field == "data":
+            data.append(value)
+        elif field == "event":
+            event = value
+        elif field == "id":
+            event_id = value
+
+
+def consume_chat_events(prompt: str, max_reconnects: int = 5, retry_delay: float = 1.0) -> Iterator[str]:
+    """Like `consume_chat_response`, over Server-Sent Events: when the
+    connection drops, the answer is resumed after the last event received
+    instead of being generated again."""
+    request_payload = {
+        'user_id': '12345',
+        'message': prompt,
+    }
+    stream_id = None
+    last_event_id = None
+    reconnects = 0
+    while True:
+        headers = {'Last-Event-ID': last_event_id} if last_event_id else {}
+        try:
+            if stream_id is None:
+                response = http.request('POST', 'http://localhost:5000/chat/events', json=request_payload,
+                                        headers=headers, preload_content=False)
+            else:
+                response = http.request('GET', f'http://localhost:5000/chat/events/{stream_id}',
+                                        headers=headers, preload_content=False)
+            with response:
+                if response.status == 204:
+                    return
+                if response.status != 200:
+                    raise ValueError(f"Error {response.status} streaming the chat answer")
+                stream_id = response.headers.get('Chat-Stream-Id', stream_id)
+                for event in iterate_server_sent_events(split_lines(decode_utf8(response.stream()))):
+                    if event.event == 'end':
+                        return
+                    if event.event == 'error':
+                        raise RuntimeError(f"The chat answer failed: {event.data}")
+                    last_event_id = event.id
+                    reconnects = 0
+                    yield event.data
+            # The response ended without an end event: the connection was cut
+            raise urllib3.exceptions.ProtocolError("Chat stream ended prematurely")
+        except urllib3.exceptions.HTTPError:
+            reconnects += 1
+            if stream_id is None or reconnects > max_reconnects:
+                raise
+            time.sleep(retry_delay)
 
 
 def buffer_response_reactively(prompt: str):
@@ -48,15 +119,14 @@ def buffer_response_reactively(prompt: str):
         preload_content=False
     )
 
-    # Here's the reactive part of the code, with mapping, flat-mapping,
-    # buffering, etc.
+    # Here's the reactive part of the code, with decoding, buffering, etc.
+    # The operators work on whole chunks (see python_streaming.text_chunks),
+    # not on one object per character.
     (
         rx.from_iterable(response.stream())
         .pipe(
-            ops.map(lambda bytes_chunk: bytes_chunk.decode('utf-8')),
-            ops.flat_map(lambda text: [character for character in text]),
-            ops.buffer_with_count(80),  # Pick a buffer size or time window
-            ops.map(lambda characters: ''.join(characters)),
+            rx_decode_utf8(),
+            rx_rechunk(80),  # Pick a buffer size, a time window (rx_buffer_by_time) or sentences
         )
         .subscribe(
             on_next=lambda text: print(text, end='\n\n'),
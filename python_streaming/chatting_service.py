@@ -1,18 +1,37 @@
-import asyncio
+"""Chat completions streamed from Bedrock (or from a local stub backend).
+
+Bedrock clients are long-lived and shared. The blocking calls (opening the
+stream and iterating over its events) run in worker threads, and their
+output reaches the event loop through a bounded queue, so a chat request
+never stalls the loop.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from itertools import cycle
 import json
-from typing import Iterable
+from pathlib import Path
+import random
+import threading
+import time
+from typing import AsyncIterator, Iterable, Iterator, Protocol
 
 import boto3
+from botocore.config import Config
 
+from python_streaming.config import (
+    BEDROCK_MODEL_ID,
+    CHAT_BACKEND,
+    CHAT_CLIENT_POOL_SIZE,
+    CHAT_MAX_CONCURRENT_STREAMS,
+    CHAT_STREAM_QUEUE_SIZE,
+    CHAT_STUB_FIRST_TOKEN_DELAY,
+    CHAT_STUB_RECORDINGS,
+    CHAT_STUB_TOKEN_INTERVAL,
+)
+from python_streaming.util import iterate_off_loop
 
-async def chat(user_message: str):
-    def extract_chunk_from_body(response_body: Iterable):
-        for event in response_body:
-            chunk = json.loads(event["chunk"]["bytes"])
-            if chunk["type"] == "content_block_delta":
-                text: str = chunk["delta"].get("text", "")
-                yield chunk["delta"].get("text", "")
-    bedrock = boto3.client("bedrock-runtime")
+
+def build_request_body(user_message: str) -> str:
     body = {
         "anthropic_version": "bedrock-2023-05-31",
         "max_tokens": 512,
@@ -24,11 +43,194 @@ async def chat(user_message: str):
             },
         ],
     }
-    body = json.dumps(body)
-    response = bedrock.invoke_model_with_response_stream(
-        body=body,
-        contentType="application/json",
-        accept="application/json",
-        modelId="anthropic.claude-3-haiku-20240307-v1:0"
+    return json.dumps(body)
+
+
+def extract_chunk_from_body(response_body: Iterable) -> Iterator[str]:
+    for event in response_body:
+        chunk = json.loads(event["chunk"]["bytes"])
+        if chunk["type"] == "content_block_delta":
+            yield chunk["delta"].get("text", "")
+
+
+class ChatBackend(Protocol):
+    def open_stream(self, body: str) -> Iterable[dict]:
+        """Start a completion and return its (blocking) event stream, made of
+        `{"chunk": {"bytes": ...}}` events like Bedrock's."""
+
+
+class BedrockClientPool:
+    """A fixed set of `bedrock-runtime` clients, created lazily and handed out
+    round-robin. Clients are thread-safe; having a few of them only spreads
+    the connections across several pools.
+
+    Args:
+        size (int): Number of clients.
+        max_pool_connections (int): Connections kept alive by each client.
+    """
+
+    def __init__(self, size: int = CHAT_CLIENT_POOL_SIZE, max_pool_connections: int = 50):
+        self.size = size
+        self.max_pool_connections = max_pool_connections
+        self._clients = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._clients is None:
+                config = Config(max_pool_connections=self.max_pool_connections)
+                # boto3.client() isn't thread-safe on the default session
+                session = boto3.session.Session()
+                self._clients = cycle([
+                    session.client("bedrock-runtime", config=config)
+                    for _ in range(self.size)
+                ])
+            return next(self._clients)
+
+
+class BedrockBackend:
+    def __init__(self, client_pool: BedrockClientPool, model_id: str = BEDROCK_MODEL_ID):
+        self.client_pool = client_pool
+        self.model_id = model_id
+
+    def open_stream(self, body: str) -> Iterable[dict]:
+        response = self.client_pool.get().invoke_model_with_response_stream(
+            body=body,
+            contentType="application/json",
+            accept="application/json",
+            modelId=self.model_id,
+        )
+        return response["body"]
+
+
+class StubEventStream:
+    """Replays a list of `(delay, chunk)` pairs, sleeping before each event."""
+
+    def __init__(self, events: list[tuple[float, dict]]):
+        self.events = events
+        self.closed = False
+
+    def __iter__(self) -> Iterator[dict]:
+        for delay, chunk in self.events:
+            if self.closed:
+                return
+            time.sleep(delay)
+            yield {"chunk": {"bytes": json.dumps(chunk).encode("utf-8")}}
+
+    def close(self):
+        self.closed = True
+
+
+class StubBackend:
+    """Local stand-in for Bedrock, for development and load tests.
+
+    Replays event streams recorded with `record_chat` (one JSON object per
+    line, with the delay since the previous event and the chunk), picking one
+    deterministically from the prompt. Without recordings, it synthesizes a
+    reply with the configured time-to-first-token and inter-token interval.
+
+    Args:
+        recordings (Path | None): A recording, or a directory of `.jsonl` ones.
+        first_token_delay (float): Seconds before the first synthetic token.
+        token_interval (float): Mean seconds between synthetic tokens.
+    """
+
+    def __init__(
+        self,
+        recordings: Path | None = None,
+        first_token_delay: float = CHAT_STUB_FIRST_TOKEN_DELAY,
+        token_interval: float = CHAT_STUB_TOKEN_INTERVAL,
+    ):
+        self.first_token_delay = first_token_delay
+        self.token_interval = token_interval
+        self.recordings = self._load_recordings(Path(recordings)) if recordings else []
+
+    @staticmethod
+    def _load_recordings(path: Path) -> list[list[tuple[float, dict]]]:
+        paths = sorted(path.glob("*.jsonl")) if path.is_dir() else [path]
+        recordings = []
+        for recording_path in paths:
+            with open(recording_path, "r") as file:
+                events = [json.loads(line) for line in file if line.strip()]
+            recordings.append([(event["delay"], event["chunk"]) for event in events])
+        return recordings
+
+    def open_stream(self, body: str) -> StubEventStream:
+        prompt = json.loads(body)["messages"][-1]["content"][0]["text"]
+        seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "big")
+        if self.recordings:
+            return StubEventStream(self.recordings[seed % len(self.recordings)])
+        return StubEventStream(self.synthesize_events(prompt, random.Random(seed)))
+
+    def synthesize_events(self, prompt: str, rng: random.Random) -> list[tuple[float, dict]]:
+        words = (
+            f"This is a stubbed answer to: {prompt}. "
+            "It is streamed token by token with a realistic cadence, so that "
+            "the whole pipeline can be load-tested without calling the model."
+        ).split(" ")
+        # Roughly one token per word, spaces included, like Claude's deltas
+        tokens = [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+        events = [
+            (self.first_token_delay, {"type": "message_start", "message": {"role": "assistant"}}),
+            (0.0, {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}),
+        ]
+        for token in tokens:
+            delay = rng.expovariate(1 / self.token_interval) if self.token_interval else 0.0
+            events.append((delay, {
+                "type": "content_block_delta",
+                "index": 0,
+                "delta": {"type": "text_delta", "text": token},
+            }))
+        events += [
+            (0.0, {"type": "content_block_stop", "index": 0}),
+            (0.0, {"type": "message_delta", "delta": {"stop_reason": "end_turn"}}),
+            (0.0, {"type": "message_stop"}),
+        ]
+        return events
+
+
+def create_backend(name: str = CHAT_BACKEND) -> ChatBackend:
+    if name == "bedrock":
+        return BedrockBackend(BedrockClientPool())
+    if name == "stub":
+        return StubBackend(Path(CHAT_STUB_RECORDINGS) if CHAT_STUB_RECORDINGS else None)
+    raise ValueError(f"Unknown chat backend: {name}")
+
+
+backend: ChatBackend = create_backend()
+# One thread per concurrent stream: the threads spend their time waiting on I/O
+stream_executor = ThreadPoolExecutor(
+    max_workers=CHAT_MAX_CONCURRENT_STREAMS,
+    thread_name_prefix="chat-stream",
+)
+
+
+def chat_sync(user_message: str, chat_backend: ChatBackend | None = None) -> Iterator[str]:
+    """Blocking variant of `chat`, for WSGI workers."""
+    event_stream = (chat_backend or backend).open_stream(build_request_body(user_message))
+    try:
+        yield from extract_chunk_from_body(event_stream)
+    finally:
+        if hasattr(event_stream, "close"):
+            event_stream.close()
+
+
+async def chat(user_message: str, chat_backend: ChatBackend | None = None) -> AsyncIterator[str]:
+    """Start a chat completion and return an async iterator over its text deltas."""
+    return iterate_off_loop(
+        lambda: chat_sync(user_message, chat_backend),
+        max_queued=CHAT_STREAM_QUEUE_SIZE,
+        executor=stream_executor,
     )
-    return extract_chunk_from_body(response["body"])
+
+
+def record_chat(user_message: str, recording_path: Path):
+    """Record a real Bedrock event stream, with its timing, for `StubBackend`."""
+    event_stream = BedrockBackend(BedrockClientPool(size=1)).open_stream(build_request_body(user_message))
+    previous = time.perf_counter()
+    with open(recording_path, "w") as file:
+        for event in event_stream:
+            now = time.perf_counter()
+            chunk = json.loads(event["chunk"]["bytes"])
+            file.write(json.dumps({"delay": round(now - previous, 4), "chunk": chunk}) + "\n")
+            previous = now
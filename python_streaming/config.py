@@ -6,3 +6,104 @@ load_dotenv()
 BUFFER_SIZE = int(os.getenv("BUFFER_SIZE", 4096))
 RANGED_REQUEST_BUFFERS = int(os.getenv("RANGED_REQUEST_BUFFERS", 10))
 HTTP_PORT = int(os.getenv("PORT", 5000))
+MEDIA_DIRECTORY = os.getenv("MEDIA_DIRECTORY", "resources")
+CATALOG_INDEX_PATH = os.getenv("CATALOG_INDEX_PATH", "resources/.catalog.json")
+# "mmap" serves frame buffers as slices of memory-mapped files, "read" opens and reads the file per request
+FRAME_SERVING_MODE = os.getenv("FRAME_SERVING_MODE", "mmap")
+MAX_OPEN_AUDIO_MAPS = int(os.getenv("MAX_OPEN_AUDIO_MAPS", 64))
+FILE_CHUNK_SIZE = int(os.getenv("FILE_CHUNK_SIZE", 64 * 1024))
+# Let the ASGI server send files with sendfile(2) when it supports the zero-copy extension
+USE_SENDFILE = os.getenv("USE_SENDFILE", "false").lower() in ("1", "true", "yes")
+DATA_FILE_PATH = os.getenv("DATA_FILE_PATH", "resources/data.json")
+# A batch of data lines is flushed as one HTTP chunk/WebSocket frame when it reaches either limit
+DATA_BATCH_LINES = int(os.getenv("DATA_BATCH_LINES", 32))
+DATA_BATCH_BYTES = int(os.getenv("DATA_BATCH_BYTES", 16 * 1024))
+# "bedrock" calls the model, "stub" replays recorded (or synthetic) event streams locally
+CHAT_BACKEND = os.getenv("CHAT_BACKEND", "bedrock")
+BEDROCK_MODEL_ID = os.getenv("BEDROCK_MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0")
+CHAT_CLIENT_POOL_SIZE = int(os.getenv("CHAT_CLIENT_POOL_SIZE", 4))
+CHAT_MAX_CONCURRENT_STREAMS = int(os.getenv("CHAT_MAX_CONCURRENT_STREAMS", 64))
+CHAT_STREAM_QUEUE_SIZE = int(os.getenv("CHAT_STREAM_QUEUE_SIZE", 64))
+CHAT_STUB_RECORDINGS = os.getenv("CHAT_STUB_RECORDINGS")
+CHAT_STUB_FIRST_TOKEN_DELAY = float(os.getenv("CHAT_STUB_FIRST_TOKEN_DELAY", 0.4))
+CHAT_STUB_TOKEN_INTERVAL = float(os.getenv("CHAT_STUB_TOKEN_INTERVAL", 0.02))
+# Completed chat streams are replayed for identical prompts; 0 entries disables the replay cache
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", 300))
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", 1024))
+CHAT_CACHE_MAX_BYTES = int(os.getenv("CHAT_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+# Resumable chat streams (SSE): seconds a stream outlives its last connection, events
+# buffered per stream, streams kept, and the reconnection delay suggested to clients
+CHAT_RESUME_TTL = float(os.getenv("CHAT_RESUME_TTL", 60))
+CHAT_RESUME_MAX_EVENTS = int(os.getenv("CHAT_RESUME_MAX_EVENTS", 4096))
+CHAT_RESUME_MAX_STREAMS = int(os.getenv("CHAT_RESUME_MAX_STREAMS", 1024))
+CHAT_SSE_RETRY_MILLISECONDS = int(os.getenv("CHAT_SSE_RETRY_MILLISECONDS", 1000))
+# Chat token streams are coalesced into chunks of at least this size, or flushed after this delay
+CHAT_FLUSH_MIN_BYTES = int(os.getenv("CHAT_FLUSH_MIN_BYTES", 64))
+CHAT_FLUSH_MAX_DELAY = float(os.getenv("CHAT_FLUSH_MAX_DELAY", 0.05))
+# "word", "sentence" or empty to ignore text boundaries
+CHAT_FLUSH_BOUNDARY = os.getenv("CHAT_FLUSH_BOUNDARY", "word") or None
+# Audio client: upper bound of frame-buffer requests in flight, and buffers kept ahead of playback
+PREFETCH_MAX_REQUESTS = int(os.getenv("PREFETCH_MAX_REQUESTS", 8))
+PREFETCH_QUEUE_SIZE = int(os.getenv("PREFETCH_QUEUE_SIZE", 10))
+FRAME_STREAM_READ_SIZE = int(os.getenv("FRAME_STREAM_READ_SIZE", 64 * 1024))
+# Recordings are written to disk in blocks of this size, from a ring buffer of this capacity
+RECORDER_BLOCK_SIZE = int(os.getenv("RECORDER_BLOCK_SIZE", 256 * 1024))
+RECORDER_RING_SIZE = int(os.getenv("RECORDER_RING_SIZE", 8 * 1024 * 1024))
+# Transformed audio (resampled, downmixed...) is cached here, up to this many bytes
+RENDITION_CACHE_DIRECTORY = os.getenv("RENDITION_CACHE_DIRECTORY", "resources/.renditions")
+RENDITION_CACHE_MAX_BYTES = int(os.getenv("RENDITION_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+# WebSocket broadcast: messages a client may lag behind, and what to do when it lags further
+# ("drop_oldest", "coalesce" or "disconnect")
+BROADCAST_QUEUE_SIZE = int(os.getenv("BROADCAST_QUEUE_SIZE", 64))
+BROADCAST_SLOW_CONSUMER_POLICY = os.getenv("BROADCAST_SLOW_CONSUMER_POLICY", "drop_oldest")
+BROADCAST_FEED_INTERVAL = float(os.getenv("BROADCAST_FEED_INTERVAL", 0.05))
+# Pacing of /data/websocket, per connection. 0 means unlimited; clients may ask
+# for other rates, up to the maximums (0: no maximum)
+PACING_MESSAGES_PER_SECOND = float(os.getenv("PACING_MESSAGES_PER_SECOND", 10))
+PACING_BYTES_PER_SECOND = float(os.getenv("PACING_BYTES_PER_SECOND", 0))
+PACING_MAX_MESSAGES_PER_SECOND = float(os.getenv("PACING_MAX_MESSAGES_PER_SECOND", 1000))
+PACING_MAX_BYTES_PER_SECOND = float(os.getenv("PACING_MAX_BYTES_PER_SECOND", 0))
+PACING_BURST_SECONDS = float(os.getenv("PACING_BURST_SECONDS", 0.1))
+# Raw PCM over TCP (python_streaming.audio_transport)
+AUDIO_TRANSPORT_HOST = os.getenv("AUDIO_TRANSPORT_HOST", "localhost")
+AUDIO_TRANSPORT_PORT = int(os.getenv("AUDIO_TRANSPORT_PORT", 8079))
+AUDIO_TRANSPORT_MAX_PAYLOAD = int(os.getenv("AUDIO_TRANSPORT_MAX_PAYLOAD", 1024 * 1024))
+# Multi-process launcher (python_streaming.launcher)
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", os.cpu_count() or 1))
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", 30))
+# Set by the launcher in its workers: the shared memory block holding the audio catalog
+SHARED_CATALOG_NAME = os.getenv("SHARED_CATALOG_NAME")
+# WSGI apps served by python_streaming.streaming_core.WSGIStreamingBridge: threads running
+# views and blocking response bodies, and chunks queued per stream iterated by a blocking server
+WSGI_MAX_THREADS = int(os.getenv("WSGI_MAX_THREADS", 32))
+WSGI_STREAM_QUEUE_SIZE = int(os.getenv("WSGI_STREAM_QUEUE_SIZE", 16))
+# "local" serves /audios/file-stream, /audios/streaming-response and /videos/buffering from
+# the resources directory, "s3" from S3_MEDIA_BUCKET (objects named S3_MEDIA_PREFIX + file name)
+MEDIA_BACKEND = os.getenv("MEDIA_BACKEND", "local")
+S3_MEDIA_BUCKET = os.getenv("S3_MEDIA_BUCKET", "")
+S3_MEDIA_PREFIX = os.getenv("S3_MEDIA_PREFIX", "")
+# Set to use an S3-compatible server, e.g. python -m python_streaming.benchmarks.local_s3
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_CLIENT_POOL_SIZE = int(os.getenv("S3_CLIENT_POOL_SIZE", 4))
+# Ranged GETs in flight across all downloads, and per download (which bounds its reorder buffer)
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", 32))
+S3_BLOCKS_IN_FLIGHT = int(os.getenv("S3_BLOCKS_IN_FLIGHT", 4))
+# Blocks start small for a short time to first byte, then are sized to take about this long
+S3_MIN_BLOCK_SIZE = int(os.getenv("S3_MIN_BLOCK_SIZE", 256 * 1024))
+S3_MAX_BLOCK_SIZE = int(os.getenv("S3_MAX_BLOCK_SIZE", 16 * 1024 * 1024))
+S3_BLOCK_TARGET_SECONDS = float(os.getenv("S3_BLOCK_TARGET_SECONDS", 0.5))
+# MP3 seek indexes (frame offsets) are cached here, and the last ones used kept in memory
+SEEK_INDEX_DIRECTORY = os.getenv("SEEK_INDEX_DIRECTORY", "resources/.seek-index")
+SEEK_INDEX_MEMORY_ENTRIES = int(os.getenv("SEEK_INDEX_MEMORY_ENTRIES", 64))
+# Catalog audio is cut into segments of this many seconds, cached here up to this many bytes
+SEGMENT_DURATION = float(os.getenv("SEGMENT_DURATION", 6.0))
+SEGMENT_CACHE_DIRECTORY = os.getenv("SEGMENT_CACHE_DIRECTORY", "resources/.segments")
+SEGMENT_CACHE_MAX_BYTES = int(os.getenv("SEGMENT_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+# Seconds a segment playlist may be cached (segments themselves never change)
+SEGMENT_PLAYLIST_MAX_AGE = int(os.getenv("SEGMENT_PLAYLIST_MAX_AGE", 10))
+# Playback goes to "pyaudio" (the sound card), "null" or "file" (PLAYBACK_FILE_PATH), through
+# a jitter buffer whose target depth adapts between these bounds, in seconds
+PLAYBACK_SINK = os.getenv("PLAYBACK_SINK", "pyaudio")
+PLAYBACK_FILE_PATH = os.getenv("PLAYBACK_FILE_PATH", "resources/playback.wav")
+PLAYBACK_MIN_BUFFER_SECONDS = float(os.getenv("PLAYBACK_MIN_BUFFER_SECONDS", 0.1))
+PLAYBACK_MAX_BUFFER_SECONDS = float(os.getenv("PLAYBACK_MAX_BUFFER_SECONDS", 3.0))
@@ -0,0 +1,110 @@
+"""Base for caches of files built on demand and kept on disk.
+
+Each cached file is built once, in a worker thread, however many requests ask
+for it at the same time, and is written to a temporary file first so that
+readers never see it half-written. The least recently used files are deleted
+when the cache grows past its size limit; their access times are set
+explicitly on use, as noatime mounts don't.
+"""
+import asyncio
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import threading
+import time
+from typing import BinaryIO, Callable, Iterator, TypeVar
+
+
+T = TypeVar("T")
+
+
+class DiskCache:
+    """Single-flight builds, atomic writes and LRU eviction of cached files.
+
+    Args:
+        directory (Path): Where the files are stored.
+        max_bytes (int): Total size above which old files are evicted.
+        pattern (str): Glob matching the cached files within `directory`.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, pattern: str):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.pattern = pattern
+        self._building: dict[Path, asyncio.Future] = {}
+        self._eviction_lock = threading.Lock()
+        # Tracked between scans of the directory, which only run when it's over the limit
+        self._total_bytes: int | None = None
+
+    @staticmethod
+    def touch(path: Path, mtime_ns: int | None = None) -> bool:
+        """Mark a cached file as just used. False if it isn't there."""
+        try:
+            os.utime(path, ns=(time.time_ns(), path.stat().st_mtime_ns if mtime_ns is None else mtime_ns))
+        except FileNotFoundError:
+            return False
+        return True
+
+    async def single_flight(self, path: Path, build: Callable[[], T]) -> T:
+        """Run `build` in a worker thread. Concurrent calls for the same path
+        wait for a single run."""
+        if (building := self._building.get(path)) is None:
+            building = asyncio.ensure_future(asyncio.to_thread(build))
+            self._building[path] = building
+            building.add_done_callback(lambda _: self._building.pop(path, None))
+        return await asyncio.shield(building)
+
+    @contextmanager
+    def writing(self, path: Path, mtime_ns: int | None = None) -> Iterator[BinaryIO]:
+        """A file that replaces `path` once written without errors, and is
+        deleted otherwise. The cache is then trimmed to `max_bytes`.
+
+        Args:
+            path (Path): The cached file.
+            mtime_ns (int | None): Modification time to give the file, e.g.
+                its source's, so that a rebuilt file keeps its ETag.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            with open(temporary_path, "wb") as file:
+                yield file
+                size = os.fstat(file.fileno()).st_size
+            if mtime_ns is not None:
+                os.utime(temporary_path, ns=(time.time_ns(), mtime_ns))
+            try:
+                replaced_size = path.stat().st_size
+            except FileNotFoundError:
+                replaced_size = 0
+            os.replace(temporary_path, path)
+        except BaseException:
+            temporary_path.unlink(missing_ok=True)
+            raise
+
+        with self._eviction_lock:
+            if self._total_bytes is not None:
+                self._total_bytes += size - replaced_size
+        if self._total_bytes is None or self._total_bytes > self.max_bytes:
+            self.evict()
+
+    def evicted(self, path: Path):
+        """Called for every file deleted by `evict`."""
+
+    def evict(self):
+        """Delete the least recently used files beyond `max_bytes`."""
+        with self._eviction_lock:
+            cached_files = []
+            for path in self.directory.glob(self.pattern):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                cached_files.append((stat.st_atime_ns, stat.st_size, path))
+            total_size = sum(size for _, size, _ in cached_files)
+            for _, size, path in sorted(cached_files):
+                if total_size <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                self.evicted(path)
+                total_size -= size
+            self._total_bytes = total_size
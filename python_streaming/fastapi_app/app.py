@@ -1,134 +1,387 @@
 """FastAPI application with example endpoints for streaming."""
 
 import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+import logging
 from pathlib import Path
-from pprint import pprint
 from typing import Annotated
 
-from fastapi import FastAPI, Header, Query, Response
-from fastapi.websockets import WebSocket
-from fastapi.responses import StreamingResponse, FileResponse
-import soundfile as sf
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.websockets import WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
-from python_streaming import chatting_service
-from python_streaming.audio import read_audio_frames, BUFFER_SIZE, frames_to_bytes, RANGED_REQUEST_BUFFERS, \
-    extract_bit_depth
+from python_streaming.audio import read_audio_frames, BUFFER_SIZE, RANGED_REQUEST_BUFFERS
+from python_streaming.audio_transforms import AudioTransformer, RenditionSpec, SUPPORTED_BIT_DEPTHS
+from python_streaming.catalog import AudioCatalog, AudioEntry, StaleAudioError
+from python_streaming.config import MEDIA_DIRECTORY, CATALOG_INDEX_PATH, DATA_FILE_PATH, FRAME_SERVING_MODE, \
+    MAX_OPEN_AUDIO_MAPS, PACING_MESSAGES_PER_SECOND, PACING_BYTES_PER_SECOND, PACING_MAX_MESSAGES_PER_SECOND, \
+    PACING_MAX_BYTES_PER_SECOND, SHARED_CATALOG_NAME, MEDIA_BACKEND, S3_MEDIA_BUCKET, S3_MEDIA_PREFIX, \
+    SEGMENT_PLAYLIST_MAX_AGE
 from python_streaming.fastapi_app.dto import ChatRequestDto
-from python_streaming.util import iterate_over_audio, iterate_over_json_data
+from python_streaming.frame_stream import iterate_frame_stream, iterate_transformed_frame_stream
+from python_streaming.http_ranges import if_none_match_matches, ranged_file_response, ranged_s3_response
+from python_streaming.mapped_audio import MappedAudioFiles
+from python_streaming.pacing import Pacer, negotiate_rate, pace_batches
+from python_streaming.mp3_index import SeekPastEndError, SeekPoint
+from python_streaming.pipelines import audio_pipeline, chat_event_streams, chat_events_pipeline, chat_pipeline, \
+    chat_stream_cache, data_pipeline, locate_audio, resumed_chat_events_pipeline
+from python_streaming.responses import FileChunksResponse
+from python_streaming.resumable_streams import SSE_MEDIA_TYPE, parse_event_id
+from python_streaming.renditions import RenditionCache
+from python_streaming.s3_media import S3DownloadError
+from python_streaming.segments import PLAYLIST_MEDIA_TYPE, SegmentCache
+from python_streaming.shared_catalog import SharedAudioCatalog
+from python_streaming.stream_metrics import PROMETHEUS_CONTENT_TYPE, StreamMetricsMiddleware, stream_metrics
+from python_streaming.streaming_core import asgi_response
+from python_streaming.util import iterate_lines
 
 
-app = FastAPI(title="HTTP streaming example")
+logger = logging.getLogger(__name__)
+
+# Under the multi-process launcher, workers share the catalog it scanned
+audio_catalog = (
+    SharedAudioCatalog.attach(SHARED_CATALOG_NAME) if SHARED_CATALOG_NAME
+    else AudioCatalog(Path(MEDIA_DIRECTORY), Path(CATALOG_INDEX_PATH))
+)
+mapped_audio_files = MappedAudioFiles(MAX_OPEN_AUDIO_MAPS)
+rendition_cache = RenditionCache()
+segment_cache = SegmentCache()
+# Work started by a request that outlives it; referenced so it isn't garbage collected
+background_tasks: set[asyncio.Task] = set()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Parse the WAVE headers once, not on every request
+    await asyncio.to_thread(audio_catalog.scan)
+    yield
+    mapped_audio_files.clear()
+
+
+app = FastAPI(title="HTTP streaming example", lifespan=lifespan)
+app.add_middleware(StreamMetricsMiddleware, metrics=stream_metrics)
+
+
+def get_catalog_entry(audio_id: str) -> AudioEntry:
+    if (audio := audio_catalog.get(audio_id)) is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    return audio
+
+
+def get_rendition_spec(
+    channels: Annotated[int | None, Query(ge=1, le=8)] = None,
+    sample_rate: Annotated[int | None, Query(ge=1000, le=384000)] = None,
+    bit_depth: Annotated[int | None, Query()] = None,
+    gain_db: Annotated[float, Query(ge=-60, le=24)] = 0.0,
+) -> RenditionSpec:
+    if bit_depth is not None and bit_depth not in SUPPORTED_BIT_DEPTHS:
+        raise HTTPException(status_code=422, detail=f"bit_depth must be one of {SUPPORTED_BIT_DEPTHS}")
+    return RenditionSpec(channels, sample_rate, bit_depth, gain_db)
+
+
+def run_in_background(coroutine, description: str, name: str | None = None) -> asyncio.Task:
+    def log_failure(task: asyncio.Task):
+        background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Failed to %s", description, exc_info=task.exception())
+
+    task = asyncio.create_task(coroutine, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(log_failure)
+    return task
+
+
+@app.exception_handler(StaleAudioError)
+async def rescan_stale_audio(request: Request, error: StaleAudioError):
+    # A media file was replaced after the scan: serve it once the catalog has caught up
+    logger.warning("%s, rescanning the audio catalog", error)
+    if not any(task.get_name() == "catalog-rescan" for task in background_tasks):
+        run_in_background(asyncio.to_thread(audio_catalog.scan), "rescan the audio catalog", name="catalog-rescan")
+    return PlainTextResponse("The audio changed, retry shortly.", status_code=503, headers={"Retry-After": "1"})
+
+
+async def get_data_view(audio: AudioEntry) -> memoryview:
+    """The file's mapped `data` chunk. Mapping it (open, fstat, mmap) only
+    happens on first use, in a worker thread."""
+    if (view := mapped_audio_files.cached_view(audio)) is not None:
+        return view
+    return await asyncio.to_thread(mapped_audio_files.data_view, audio)
+
+
+async def get_rendition(audio: AudioEntry, spec: RenditionSpec) -> AudioEntry:
+    """The audio converted to the requested format, built once and cached."""
+    if spec.is_identity(audio):
+        return audio
+    return await rendition_cache.get_or_build(audio, spec)
+
+
+def seek_headers(start: SeekPoint) -> dict[str, str]:
+    return {"Start-Time": f"{start.time:.6f}", "Start-Frame": str(start.frame)}
+
+
+def locate_mp3(name: str, seconds: float) -> SeekPoint:
+    try:
+        return locate_audio(seconds, name)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    except SeekPastEndError as e:
+        # As for frames past the end: nothing to send is not a success
+        raise HTTPException(status_code=416, detail=str(e), headers={"Duration": f"{e.duration:.6f}"})
+    except S3DownloadError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+
+def media_file_response(request: Request, name: str, media_type: str, seconds: float | None = None) -> Response:
+    if seconds is not None:
+        # The file from the frame playing at `seconds`: a playable MP3 of its own
+        start = locate_mp3(name, seconds)
+        if MEDIA_BACKEND == "s3":
+            return asgi_response(audio_pipeline(start.byte_offset), media_type=media_type, headers=seek_headers(start))
+        return FileChunksResponse(
+            f"resources/{name}", media_type=media_type, headers=seek_headers(start), offset=start.byte_offset,
+        )
+    # Range/If-Range are honoured so that players can seek without
+    # downloading the file all over again
+    if MEDIA_BACKEND == "s3":
+        try:
+            return ranged_s3_response(request, S3_MEDIA_BUCKET, S3_MEDIA_PREFIX + name, media_type)
+        except S3DownloadError as e:
+            raise HTTPException(status_code=502, detail=str(e))
+    return ranged_file_response(request, f"resources/{name}", media_type=media_type)
 
 
 @app.get("/audios/file-stream")
 def get_audio_file_stream(
-    audio_format: Annotated[str | None, Query(examples=["mp3", "wav"])] = "mp3"
+    request: Request,
+    audio_format: Annotated[str | None, Query(examples=["mp3", "wav"])] = "mp3",
+    t: Annotated[float | None, Query(ge=0, description="Seconds to start from (mp3 only)")] = None,
 ):
-    # Stream a chunked response directly from a pre-loaded file.
-    # You only need a path to the file and the media type.
-    # This option is faster than streaming from an iterator.
-    return FileResponse(
-        f"resources/audio.{audio_format}",
-        media_type="audio/mpeg"
-    )
+    # Stream the file in bounded chunks, from disk or from S3
+    media_types = {"mp3": "audio/mpeg", "wav": "audio/wav"}
+    if audio_format not in media_types:
+        raise HTTPException(status_code=404, detail="Audio format not found")
+    if t is not None and audio_format != "mp3":
+        raise HTTPException(status_code=422, detail="Seeking with t is only supported for mp3")
+    return media_file_response(request, f"audio.{audio_format}", media_types[audio_format], t)
 
 
 @app.get("/audios/streaming-response")
-def get_audio_streaming_response():
-    # Stream a chunked response from an iterator.
+async def get_audio_streaming_response(
+    t: Annotated[float | None, Query(ge=0, description="Seconds to start from")] = None,
+):
+    # Stream a chunked response from an async iterator.
     # This option is slower than streaming from a pre-loaded file (FileResponse),
     # but it allows you to serve the data on the fly, while some other service
     # is producing it upstream.
-    return StreamingResponse(
-        iterate_over_audio(),
-        media_type="audio/mpeg",
-    )
+    if t is None:
+        return asgi_response(audio_pipeline(), media_type="audio/mpeg")
+    start = await asyncio.to_thread(locate_mp3, "audio.mp3", t)
+    return asgi_response(audio_pipeline(start.byte_offset), media_type="audio/mpeg", headers=seek_headers(start))
 
 
 @app.get("/data/stream")
-def get_data_http_stream():
-    # Stream a chunked response from an iterator.
-    # This option is slower than streaming from a pre-loaded file (FileResponse),
-    # but it allows you to serve the data on the fly, while some other service
-    # is producing it upstream.
-    return StreamingResponse(
-        iterate_over_json_data(),
-        media_type="application/json"
+async def get_data_http_stream():
+    # Stream a chunked response from an async iterator of line batches.
+    return asgi_response(data_pipeline(), media_type="application/json")
+
+
+def negotiate_pacing(messages_per_second: float | None, bytes_per_second: float | None) -> tuple:
+    return (
+        negotiate_rate(messages_per_second, PACING_MESSAGES_PER_SECOND, PACING_MAX_MESSAGES_PER_SECOND),
+        negotiate_rate(bytes_per_second, PACING_BYTES_PER_SECOND, PACING_MAX_BYTES_PER_SECOND),
     )
 
 
-@app.websocket("/data/websocket")
-async def websocket_endpoint(websocket: WebSocket):
-    data_iterator = iterate_over_json_data()
-    await websocket.accept()
+async def receive_pacing_changes(websocket: WebSocket, pacer: Pacer):
+    # Clients may renegotiate their rates mid-stream by sending
+    # {"messages_per_second": ..., "bytes_per_second": ...}
     try:
-        while new_data := next(data_iterator):
-            await asyncio.sleep(0.1)
-            await websocket.send_text(new_data)
-    except StopIteration:
+        while True:
+            try:
+                rates = await websocket.receive_json()
+                pacer.set_rates(*negotiate_pacing(
+                    rates.get("messages_per_second"), rates.get("bytes_per_second")
+                ))
+            except (ValueError, TypeError, AttributeError):
+                continue
+    except WebSocketDisconnect:
         pass
-    finally:
-        await websocket.close()
 
 
-@app.get("/videos/buffering")
-async def video_buffering(range: str = Header(None)):  # TODO: clarify header
-    video_path = "resources/video.mp4"
-    start, end = range.replace("bytes=", "").split("-")
-    start = int(start)
-    end = int(end) if end else start + 1024 * 1024  # Default chunk size
-
-    with open(video_path, "rb") as video:
-        video.seek(start)
-        data = video.read(end - start)
-        return StreamingResponse(
-            content=data,
-            media_type="video/mp4",
-            headers={
-                "Content-Range": f"bytes {start}-{end}/{video.stat().st_size}",
-                "Accept-Ranges": "bytes"
-            }
-        )
+@app.websocket("/data/websocket")
+async def websocket_endpoint(
+    websocket: WebSocket,
+    messages_per_second: Annotated[float | None, Query(ge=0)] = None,
+    bytes_per_second: Annotated[float | None, Query(ge=0)] = None,
+):
+    # Lines go out as fast as the connection's token buckets allow, packed
+    # into bigger frames when the client can't take them one by one.
+    await websocket.accept()
+    pacer = Pacer(*negotiate_pacing(messages_per_second, bytes_per_second))
 
+    async def send_batches():
+        async for batch in pace_batches(iterate_lines(DATA_FILE_PATH), pacer):
+            await websocket.send_text(batch.decode("utf-8"))
+
+    sender = asyncio.create_task(send_batches())
+    receiver = asyncio.create_task(receive_pacing_changes(websocket, pacer))
+    # The receiver only returns when the client goes away: stop sending then
+    await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    receiver.cancel()
+    if not sender.done():
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        return
+    sender.result()
+    await websocket.close()
 
-@app.get("/audios/{audio_id}")
-async def get_audio_info(audio_id: str):
-    if audio_id != "1":
-        return Response({"error": "Audio not found"}, status_code=404)
-    audio_path = Path("resources/audio.wav")
-    audio_info = sf.info(str(audio_path))
-    return {
-        "audio_id": audio_id,
-        "format": audio_info.format,
-        "sample_rate": audio_info.samplerate,
-        "bit_depth": extract_bit_depth(audio_info.extra_info),
-        "channels": audio_info.channels,
-        "content_length": "*",
-    }
 
-@app.get("/audios/frame-buffers/{audio_id}")
-async def audio_frame_buffering(audio_id: str, start_frame: Annotated[int, Query(ge=0)] = 0):
-    if audio_id != "1":
-        return Response({"error": "Audio not found"}, status_code=404)
-    audio_path = Path("resources/audio.wav")
-    audio_info = sf.info(str(audio_path))
+@app.get("/videos/buffering")
+def video_buffering(request: Request):
+    return media_file_response(request, "video.mp4", "video/mp4")
+
+
+@app.get("/audios/frame-buffers/{audio_id:path}")
+async def audio_frame_buffering(
+    audio_id: str,
+    start_frame: Annotated[int, Query(ge=0)] = 0,
+    spec: RenditionSpec = Depends(get_rendition_spec),
+):
+    audio = await get_rendition(get_catalog_entry(audio_id), spec)
+    if start_frame >= audio.frames:
+        return Response(
+            status_code=416,
+            headers={"Content-Range": f"bytes */{audio.data_size}", "Frame-Range": f"frames */{audio.frames}"},
+        )
     number_of_frames = BUFFER_SIZE * RANGED_REQUEST_BUFFERS
-    pprint(f"Requested frames: {start_frame}-{start_frame + number_of_frames}")
-    start_byte_position = frames_to_bytes(start_frame, extract_bit_depth(audio_info.extra_info), audio_info.channels)
-    response_byte_length = frames_to_bytes(number_of_frames, extract_bit_depth(audio_info.extra_info), audio_info.channels)
+    end_frame = min(start_frame + number_of_frames, audio.frames)
+    start_byte_position = audio.frame_to_byte(start_frame) - audio.data_offset
+    end_byte_position = audio.frame_to_byte(end_frame) - audio.data_offset
 
-    data = read_audio_frames(audio_path, start_frame, number_of_frames)
+    if FRAME_SERVING_MODE == "mmap":
+        # The memoryview slice goes straight into the response body, no copies
+        data = (await get_data_view(audio))[start_byte_position:end_byte_position]
+    else:
+        data = await asyncio.to_thread(read_audio_frames, audio, start_frame, number_of_frames)
     return Response(
         content=data,
         media_type="application/octet-stream",
         headers={
-            "Content-Range": f"bytes {start_byte_position}-{start_byte_position+response_byte_length}/*",
-            "Frame-Range": f"frames {start_frame}-{start_frame + number_of_frames}/*",
+            # Content-Range's last byte is inclusive; Frame-Range's end isn't
+            "Content-Range": f"bytes {start_byte_position}-{end_byte_position - 1}/{audio.data_size}",
+            "Frame-Range": f"frames {start_frame}-{end_frame}/{audio.frames}",
+            "Accept-Ranges": "frames",
+        }
+    )
+
+
+@app.get("/audios/frame-stream/{audio_id:path}")
+async def audio_frame_streaming(
+    audio_id: str,
+    start_frame: Annotated[int, Query(ge=0)] = 0,
+    spec: RenditionSpec = Depends(get_rendition_spec),
+):
+    # One response for the whole file, framed so that a client can resume
+    # from the last frame offset it received (see python_streaming.frame_stream).
+    audio = get_catalog_entry(audio_id)
+    if not spec.is_identity(audio) and (rendition := await rendition_cache.get(audio, spec)) is not None:
+        audio = rendition
+    elif not spec.is_identity(audio) and start_frame == 0:
+        # Convert while streaming rather than making the client wait for the
+        # whole rendition, which is built meanwhile for later requests.
+        # Mapped now, so that a stale file fails before the response starts.
+        await get_data_view(audio)
+        run_in_background(
+            rendition_cache.get_or_build(audio, spec), f"build rendition {spec.label} of {audio.audio_id}"
+        )
+        output_frames = spec.output_frames(audio)
+        return StreamingResponse(
+            iterate_transformed_frame_stream(mapped_audio_files, AudioTransformer(audio, spec), BUFFER_SIZE),
+            media_type="application/octet-stream",
+            headers={
+                "Frame-Range": f"frames 0-{output_frames}/{output_frames}",
+                "Accept-Ranges": "frames",
+            }
+        )
+    elif not spec.is_identity(audio):
+        # Resuming mid-stream needs the output frames before `start_frame`
+        audio = await rendition_cache.get_or_build(audio, spec)
+    start_frame = min(start_frame, audio.frames)
+    await get_data_view(audio)
+    return StreamingResponse(
+        iterate_frame_stream(mapped_audio_files, audio, start_frame, BUFFER_SIZE),
+        media_type="application/octet-stream",
+        headers={
+            "Frame-Range": f"frames {start_frame}-{audio.frames}/{audio.frames}",
             "Accept-Ranges": "frames",
         }
     )
 
 
+def get_segmentable_entry(audio_id: str) -> AudioEntry:
+    audio = get_catalog_entry(audio_id)
+    if audio.format != "PCM":
+        raise HTTPException(status_code=422, detail="Only PCM audio is segmented")
+    return audio
+
+
+@app.get("/audios/segments/{audio_id:path}/playlist.m3u8")
+async def get_audio_playlist(request: Request, audio_id: str):
+    # Players fetch the segments it lists as static files, which a reverse
+    # proxy can cache: no per-listener slicing as in audio_frame_buffering
+    audio = get_segmentable_entry(audio_id)
+    headers = {
+        "ETag": f'"{segment_cache.playlist_version(audio)}"',
+        "Cache-Control": f"public, max-age={SEGMENT_PLAYLIST_MAX_AGE}",
+    }
+    if if_none_match_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(segment_cache.playlist(audio), media_type=PLAYLIST_MEDIA_TYPE, headers=headers)
+
+
+@app.get("/audios/segments/{audio_id:path}/{index:int}.{key}.wav")
+async def get_audio_segment(request: Request, audio_id: str, index: int, key: str):
+    audio = get_segmentable_entry(audio_id)
+    if index >= segment_cache.segment_count(audio) or segment_cache.key_for(audio, index) != key:
+        # Also the case of playlists fetched before the source changed
+        raise HTTPException(status_code=404, detail="Segment not found")
+    path = await segment_cache.get_or_build(audio, index)
+    # The URL names the content, so it can be cached for good
+    return ranged_file_response(
+        request, path, media_type="audio/wav", headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+
+@app.get("/audios/{audio_id:path}")
+async def get_audio_info(audio_id: str, spec: RenditionSpec = Depends(get_rendition_spec)):
+    audio = get_catalog_entry(audio_id)
+    if spec.is_identity(audio):
+        return {
+            "audio_id": audio.audio_id,
+            "format": audio.format,
+            "sample_rate": audio.sample_rate,
+            "bit_depth": audio.bit_depth,
+            "channels": audio.channels,
+            "frames": audio.frames,
+            "duration": audio.duration,
+            "content_length": audio.data_size,
+        }
+    # Describe the rendition without building it
+    channels, sample_rate, bit_depth = spec.output_format(audio)
+    frames = spec.output_frames(audio)
+    return {
+        "audio_id": audio.audio_id,
+        "format": "PCM",
+        "sample_rate": sample_rate,
+        "bit_depth": bit_depth,
+        "channels": channels,
+        "frames": frames,
+        "duration": frames / sample_rate,
+        "content_length": frames * channels * bit_depth // 8,
+    }
+
+
 # @app.get("/audios/byte-buffers")
 # async def audio_buffering(range: str = Header(None)):
 #     # TODO: implement with wave file
@@ -150,16 +403,72 @@ async def audio_frame_buffering(audio_id: str, start_frame: Annotated[int, Query
 
 @app.post("/chat")
 async def get_ai_response(chat_request: ChatRequestDto):
-    # The chatting service exposes a generator that iterates over Bedrock response events
-    bedrock_streaming_response = await chatting_service.chat(chat_request.message)
+    # The chatting service exposes a generator that iterates over Bedrock response events.
+    # Stream the response directly from it, in chunks worth sending.
+    return asgi_response(chat_pipeline(chat_request.message), media_type="text/plain")
 
-    # Stream the response directly from the generator
-    return StreamingResponse(
-        bedrock_streaming_response,
-        media_type="text/plain"
+
+def sse_headers(stream_id: str) -> dict[str, str]:
+    # X-Accel-Buffering stops nginx from holding events back
+    return {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Chat-Stream-Id": stream_id}
+
+
+def resume_chat_events(stream_id: str, last_event_id: str | None) -> Response:
+    after = -1
+    if last_event_id:
+        parsed = parse_event_id(last_event_id)
+        if parsed is None or parsed[0] != stream_id:
+            raise HTTPException(status_code=400, detail="Last-Event-ID isn't an event of this stream")
+        after = parsed[1]
+    status_code = chat_event_streams.resume_status(stream_id, after)
+    if status_code == 404:
+        raise HTTPException(status_code=404, detail="Chat stream not found or expired")
+    if status_code == 410:
+        raise HTTPException(status_code=410, detail="The events after Last-Event-ID are no longer buffered")
+    if status_code == 204:
+        # Tells EventSource to stop reconnecting
+        return Response(status_code=204)
+    return asgi_response(
+        resumed_chat_events_pipeline(stream_id, after), media_type=SSE_MEDIA_TYPE, headers=sse_headers(stream_id),
     )
 
 
+@app.post("/chat/events")
+async def get_ai_response_events(
+    chat_request: ChatRequestDto,
+    last_event_id: Annotated[str | None, Header()] = None,
+):
+    # The /chat answer as Server-Sent Events. A client that lost the connection
+    # sends the same request with Last-Event-ID (or GETs /chat/events/{stream_id})
+    # and resumes from the buffered events, without a new generation.
+    if last_event_id and (parsed := parse_event_id(last_event_id)) is not None:
+        return resume_chat_events(parsed[0], last_event_id)
+    stream_id = chat_event_streams.new_id()
+    return asgi_response(
+        chat_events_pipeline(chat_request.message, stream_id), media_type=SSE_MEDIA_TYPE, headers=sse_headers(stream_id),
+    )
+
+
+@app.get("/chat/cache-stats")
+async def get_chat_cache_stats():
+    return asdict(chat_stream_cache.stats)
+
+
+@app.get("/chat/resume-stats")
+async def get_chat_resume_stats():
+    return asdict(chat_event_streams.stats)
+
+
+@app.get("/chat/events/{stream_id}")
+async def resume_ai_response_events(stream_id: str, last_event_id: Annotated[str | None, Header()] = None):
+    return resume_chat_events(stream_id, last_event_id)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(stream_metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 if __name__ == '__main__':
     import uvicorn
     uvicorn.run(app, host="localhost", port=5000)
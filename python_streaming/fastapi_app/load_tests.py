@@ -1,28 +1,66 @@
+import time
+import uuid
+
 from locust import HttpUser, task, between
+from websockets.sync.client import connect
+
+
+def chat_body() -> dict:
+    # A fresh prompt per request: repeated ones would be replayed by the chat cache
+    return {"user_id": "locust", "message": f"Tell me a joke about pirates and quantum physics ({uuid.uuid4()})."}
 
 
 class StreamingUser(HttpUser):
     wait_time = between(1, 5)
 
+    def consume(self, response):
+        # Read the body as it's streamed, as a real client would
+        for _ in response.iter_content(chunk_size=None):
+            pass
+
     @task
     def get_audio_file_stream(self):
-        self.client.get("/audios/file-stream")
+        with self.client.get("/audios/file-stream", stream=True) as response:
+            self.consume(response)
 
     @task
     def get_audio_streaming_response(self):
-        self.client.get("/audios/streaming-response")
+        with self.client.get("/audios/streaming-response", stream=True) as response:
+            self.consume(response)
 
     @task
     def get_data_stream(self):
-        self.client.get("/data/stream")
+        with self.client.get("/data/stream", stream=True) as response:
+            self.consume(response)
 
-    # @task
-    # def get_websocket_data(self):
-    #     self.client.get("/data/websocket")
+    @task
+    def get_websocket_data(self):
+        # Locust's client only speaks HTTP: time the WebSocket stream here and report it
+        started = time.perf_counter()
+        size = 0
+        exception = None
+        try:
+            uri = self.host.replace("http", "ws", 1) + "/data/websocket"
+            with connect(uri, max_size=None) as websocket:
+                for message in websocket:
+                    size += len(message)
+        except Exception as e:
+            exception = e
+        self.environment.events.request.fire(
+            request_type="WS",
+            name="/data/websocket",
+            response_time=(time.perf_counter() - started) * 1000,
+            response_length=size,
+            exception=exception,
+            context={},
+        )
 
     @task
     def get_chat_response(self):
-        self.client.post(
-            "/chat",
-            data={"message": "Tell me a joke about pirates and quantum physics."}
-        )
\ No newline at end of file
+        with self.client.post("/chat", json=chat_body(), stream=True) as response:
+            self.consume(response)
+
+    @task
+    def get_chat_events(self):
+        with self.client.post("/chat/events", json=chat_body(), stream=True) as response:
+            self.consume(response)
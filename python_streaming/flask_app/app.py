@@ -1,15 +1,112 @@
+from dataclasses import asdict
+
 from flask import Flask, request
 
-from python_streaming import chatting_service
+from python_streaming.mp3_index import SeekPastEndError
+from python_streaming.pipelines import audio_pipeline, chat_event_streams, chat_events_pipeline, chat_pipeline, \
+    chat_stream_cache, data_pipeline, locate_audio, resumed_chat_events_pipeline
+from python_streaming.resumable_streams import SSE_MEDIA_TYPE, parse_event_id
+from python_streaming.s3_media import S3DownloadError
+from python_streaming.stream_metrics import install_flask_metrics
+from python_streaming.streaming_core import WSGIStreamingBridge, wsgi_response
 
 app = Flask("Flask streaming")
+install_flask_metrics(app)
+# Serve it with uvicorn (see __main__ and python_streaming.launcher) so that
+# streams don't hold a thread each
+asgi_app = WSGIStreamingBridge(app)
+
+
+@app.get("/audios/streaming-response")
+def get_audio_streaming_response():
+    if "t" not in request.args:
+        return wsgi_response(audio_pipeline(), media_type="audio/mpeg")
+    t = request.args.get("t", type=float)
+    if t is None or not t >= 0:
+        return "t must be a number of seconds, at least 0.", 400
+    # Start on the frame playing at t, found in the MP3's seek index
+    try:
+        start = locate_audio(t)
+    except SeekPastEndError as e:
+        return str(e), 416, {"Duration": f"{e.duration:.6f}"}
+    except S3DownloadError as e:
+        return str(e), 502
+    return wsgi_response(
+        audio_pipeline(start.byte_offset),
+        media_type="audio/mpeg",
+        headers={"Start-Time": f"{start.time:.6f}", "Start-Frame": str(start.frame)},
+    )
+
+
+@app.get("/data/stream")
+def get_data_http_stream():
+    return wsgi_response(data_pipeline(), media_type="application/json")
 
 
 @app.post("/chat")
-async def chat():
+def chat():
     if request.content_type != "application/json":
         return "Only JSON data is accepted.", 415
     user_message = request.get_json()["message"]
-    # The chatting service exposes a generator that iterates over Bedrock response events
-    bedrock_streaming_response = await chatting_service.chat(user_message)
-    return app.response_class(bedrock_streaming_response, content_type="text/plain")
\ No newline at end of file
+    # The chatting service exposes a generator that iterates over Bedrock response events.
+    # The pipeline is async: the view returns right away and the stream is produced
+    # on an event loop, not in the worker thread.
+    return wsgi_response(chat_pipeline(user_message), media_type="text/plain")
+
+
+def sse_headers(stream_id: str) -> dict[str, str]:
+    return {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Chat-Stream-Id": stream_id}
+
+
+def resume_chat_events(stream_id: str):
+    after = -1
+    if last_event_id := request.headers.get("Last-Event-ID"):
+        parsed = parse_event_id(last_event_id)
+        if parsed is None or parsed[0] != stream_id:
+            return "Last-Event-ID isn't an event of this stream.", 400
+        after = parsed[1]
+    status = chat_event_streams.resume_status(stream_id, after)
+    if status == 404:
+        return "Chat stream not found or expired.", 404
+    if status == 410:
+        return "The events after Last-Event-ID are no longer buffered.", 410
+    if status == 204:
+        return "", 204
+    return wsgi_response(
+        resumed_chat_events_pipeline(stream_id, after), media_type=SSE_MEDIA_TYPE, headers=sse_headers(stream_id),
+    )
+
+
+@app.post("/chat/events")
+def chat_events():
+    if request.content_type != "application/json":
+        return "Only JSON data is accepted.", 415
+    # A reconnecting client resumes the buffered stream instead of starting a new generation
+    if (last_event_id := request.headers.get("Last-Event-ID")) and (parsed := parse_event_id(last_event_id)):
+        return resume_chat_events(parsed[0])
+    stream_id = chat_event_streams.new_id()
+    return wsgi_response(
+        chat_events_pipeline(request.get_json()["message"], stream_id),
+        media_type=SSE_MEDIA_TYPE,
+        headers=sse_headers(stream_id),
+    )
+
+
+@app.get("/chat/events/<stream_id>")
+def resume_chat_events_stream(stream_id: str):
+    return resume_chat_events(stream_id)
+
+
+@app.get("/chat/cache-stats")
+def get_chat_cache_stats():
+    return asdict(chat_stream_cache.stats)
+
+
+@app.get("/chat/resume-stats")
+def get_chat_resume_stats():
+    return asdict(chat_event_streams.stats)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(asgi_app, host="localhost", port=5000)
@@ -1,28 +1,37 @@
+import uuid
+
 from locust import HttpUser, task, between
 
 
+def chat_body() -> dict:
+    # A fresh prompt per request: repeated ones would be replayed by the chat cache
+    return {"message": f"Tell me a joke about pirates and quantum physics ({uuid.uuid4()})."}
+
+
 class StreamingUser(HttpUser):
     wait_time = between(1, 5)
 
-    @task
-    def get_audio_file_stream(self):
-        self.client.get("/audios/file-stream")
+    def consume(self, response):
+        # Read the body as it's streamed, as a real client would
+        for _ in response.iter_content(chunk_size=None):
+            pass
 
     @task
     def get_audio_streaming_response(self):
-        self.client.get("/audios/streaming-response")
+        with self.client.get("/audios/streaming-response", stream=True) as response:
+            self.consume(response)
 
     @task
     def get_data_stream(self):
-        self.client.get("/data/stream")
+        with self.client.get("/data/stream", stream=True) as response:
+            self.consume(response)
 
     @task
-    def get_websocket_data(self):
-        self.client.get("/data/websocket")
+    def get_chat_response(self):
+        with self.client.post("/chat", json=chat_body(), stream=True) as response:
+            self.consume(response)
 
     @task
-    def get_chat_response(self):
-        self.client.get(
-            "/chat",
-            data={"message": "Tell me a joke about pirates and quantum physics."}
-        )
\ No newline at end of file
+    def get_chat_events(self):
+        with self.client.post("/chat/events", json=chat_body(), stream=True) as response:
+            self.consume(response)
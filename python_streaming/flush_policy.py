@@ -0,0 +1,190 @@
+"""Coalescing of small text chunks (typically model tokens) into bigger ones.
+
+Sending every one- or two-character token as its own HTTP chunk makes the
+chunked-encoding framing and the per-send overhead dominate. A flush policy
+accumulates text and only emits it when it's worth a chunk: once it reaches
+a size, when a deadline expires or at a word/sentence boundary. The very
+first token is always flushed right away, to keep the time to first byte.
+"""
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+import re
+import time
+from typing import AsyncIterator, Iterator, Literal
+
+from python_streaming.config import CHAT_FLUSH_BOUNDARY, CHAT_FLUSH_MAX_DELAY, CHAT_FLUSH_MIN_BYTES
+
+
+SENTENCE_END = re.compile(r"[.!?\n][\"')\]]*(?=\s|$)")
+
+
+def utf8_length(text: str) -> int:
+    return len(text) if text.isascii() else len(text.encode("utf-8"))
+
+
+@dataclass(frozen=True)
+class FlushPolicy:
+    """When to flush the accumulated text.
+
+    Args:
+        min_bytes (int): Flush once the buffer holds at least this many bytes.
+        max_delay (float): Flush whatever is buffered this many seconds after
+            its first character arrived. 0 disables the deadline.
+        boundary (str | None): "word" cuts size-triggered flushes at the last
+            whitespace, so words aren't split across chunks; "sentence" also
+            flushes as soon as a sentence is complete.
+        flush_first (bool): Send the first chunk immediately.
+    """
+    min_bytes: int = CHAT_FLUSH_MIN_BYTES
+    max_delay: float = CHAT_FLUSH_MAX_DELAY
+    boundary: Literal["word", "sentence"] | None = CHAT_FLUSH_BOUNDARY
+    flush_first: bool = True
+
+
+class _Buffer:
+    """Text accumulated between flushes, and the policy's decision logic."""
+
+    def __init__(self, policy: FlushPolicy):
+        self.policy = policy
+        self.parts: list[str] = []
+        self.size = 0
+        self.started_at = 0.0
+        self.flushed_once = False
+
+    def __bool__(self) -> bool:
+        return bool(self.parts)
+
+    def add(self, text: str):
+        if not self.parts:
+            self.started_at = time.monotonic()
+        self.parts.append(text)
+        self.size += utf8_length(text)
+
+    def deadline(self) -> float | None:
+        if not self.parts or not self.policy.max_delay:
+            return None
+        return self.started_at + self.policy.max_delay
+
+    def take(self, keep: str = "") -> str:
+        text = "".join(self.parts)
+        if keep:
+            text = text[:-len(keep)]
+        self.parts = [keep] if keep else []
+        self.size = utf8_length(keep) if keep else 0
+        if keep:
+            self.started_at = time.monotonic()
+        self.flushed_once = True
+        return text
+
+    def ready(self) -> str | None:
+        """Text to flush now, if the policy says so, or None."""
+        if not self.parts:
+            return None
+        if self.policy.flush_first and not self.flushed_once:
+            return self.take()
+        if self.policy.boundary == "sentence":
+            text = "".join(self.parts)
+            sentence_ends = list(SENTENCE_END.finditer(text))
+            if sentence_ends:
+                return self.take(keep=text[sentence_ends[-1].end():])
+        if self.size >= self.policy.min_bytes:
+            if self.policy.boundary in ("word", "sentence"):
+                text = "".join(self.parts)
+                cut = max(text.rfind(" "), text.rfind("\n"))
+                if cut > 0:
+                    return self.take(keep=text[cut:])
+            return self.take()
+        deadline = self.deadline()
+        if deadline is not None and time.monotonic() >= deadline:
+            return self.take()
+        return None
+
+
+async def coalesce_chunks(
+    chunks: AsyncIterator[str],
+    policy: FlushPolicy = FlushPolicy(),
+) -> AsyncIterator[str]:
+    """Apply a flush policy to an async stream of text chunks.
+
+    A single task pulls the upstream chunks into the buffer, and the consumer
+    is only woken up when there's text to flush or a deadline to arm, rather
+    than once per token. The deadline is honoured even if the upstream goes
+    quiet.
+    """
+    buffer = _Buffer(policy)
+    flushable: deque[str] = deque()
+    wake_up = asyncio.Event()
+    finished = False
+    error = None
+
+    async def pump():
+        nonlocal finished, error
+        try:
+            async for chunk in chunks:
+                was_empty = not buffer
+                if chunk:
+                    buffer.add(chunk)
+                if (text := buffer.ready()) is not None:
+                    flushable.append(text)
+                    wake_up.set()
+                elif was_empty and buffer:
+                    # Let the consumer arm the deadline of the new buffer
+                    wake_up.set()
+        except Exception as e:
+            error = e
+        finally:
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+            finished = True
+            wake_up.set()
+
+    pump_task = asyncio.create_task(pump())
+    try:
+        while True:
+            if not flushable and not finished:
+                deadline = buffer.deadline()
+                try:
+                    async with asyncio.timeout_at(
+                        asyncio.get_running_loop().time() + max(deadline - time.monotonic(), 0)
+                        if deadline is not None else None
+                    ):
+                        await wake_up.wait()
+                except TimeoutError:
+                    if buffer:
+                        flushable.append(buffer.take())
+                wake_up.clear()
+            while flushable:
+                yield flushable.popleft()
+            if finished:
+                break
+    finally:
+        if not pump_task.done():
+            pump_task.cancel()
+            await asyncio.gather(pump_task, return_exceptions=True)
+    # What the upstream produced before failing is still worth sending
+    if buffer:
+        yield buffer.take()
+    if error is not None:
+        raise error
+
+
+def coalesce_chunks_sync(
+    chunks: Iterator[str],
+    policy: FlushPolicy = FlushPolicy(),
+) -> Iterator[str]:
+    """Blocking variant of `coalesce_chunks`. The deadline can only be checked
+    when a chunk arrives, since nothing wakes a blocked iterator up."""
+    buffer = _Buffer(policy)
+    try:
+        for chunk in chunks:
+            if chunk:
+                buffer.add(chunk)
+            if (text := buffer.ready()) is not None:
+                yield text
+    except Exception:
+        if buffer:
+            yield buffer.take()
+        raise
+    if buffer:
+        yield buffer.take()
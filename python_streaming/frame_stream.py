@@ -0,0 +1,103 @@
+"""Framed, continuous audio streaming over a single HTTP response.
+
+The body is a sequence of records, each made of a fixed header followed by
+its payload:
+
+    kind (1 byte) | payload length (uint32 LE) | frame offset (uint64 LE) | payload
+
+`DATA` records carry raw PCM frames starting at the given frame offset, so
+each of them doubles as a resume marker: a client that drops reconnects with
+`start_frame` set to the end of the last record it fully received. A single
+`END` record, with the total number of frames as offset, closes the stream.
+"""
+import struct
+from typing import AsyncIterator
+
+from python_streaming.audio_transforms import AudioTransformer
+from python_streaming.catalog import AudioEntry
+from python_streaming.mapped_audio import MappedAudioFiles
+
+
+RECORD_HEADER = struct.Struct("<cIQ")
+DATA = b"D"
+END = b"E"
+
+
+def encode_record_header(kind: bytes, frame_offset: int, payload_length: int = 0) -> bytes:
+    return RECORD_HEADER.pack(kind, payload_length, frame_offset)
+
+
+async def iterate_frame_stream(
+    mapped_files: MappedAudioFiles,
+    audio: AudioEntry,
+    start_frame: int,
+    frames_per_record: int,
+) -> AsyncIterator[bytes | memoryview]:
+    """Yield the records of an audio file from `start_frame` to its end.
+
+    Payloads are slices of the file's memory map, yielded separately from
+    their headers so they reach the transport without being copied.
+    """
+    data = mapped_files.data_view(audio)
+    for first_frame in range(start_frame, audio.frames, frames_per_record):
+        payload = data[
+            first_frame * audio.block_align:
+            min(first_frame + frames_per_record, audio.frames) * audio.block_align
+        ]
+        yield encode_record_header(DATA, first_frame, len(payload))
+        yield payload
+    yield encode_record_header(END, audio.frames)
+
+
+async def iterate_transformed_frame_stream(
+    mapped_files: MappedAudioFiles,
+    transformer: AudioTransformer,
+    frames_per_record: int,
+) -> AsyncIterator[bytes]:
+    """Yield the records of a whole file converted on the fly, from its start.
+
+    Frame offsets count output frames. The source is read a record's worth at
+    a time, so the first record goes out after a single small transform.
+    """
+    audio = transformer.source
+    data = mapped_files.data_view(audio)
+    produced = 0
+    for first_frame in range(0, audio.frames, frames_per_record):
+        payload = transformer.process(data[
+            first_frame * audio.block_align:
+            min(first_frame + frames_per_record, audio.frames) * audio.block_align
+        ])
+        if payload:
+            yield encode_record_header(DATA, produced, len(payload)) + payload
+            produced += len(payload) // transformer.block_align
+    if payload := transformer.flush():
+        yield encode_record_header(DATA, produced, len(payload)) + payload
+        produced += len(payload) // transformer.block_align
+    yield encode_record_header(END, produced)
+
+
+class FrameStreamDecoder:
+    """Incremental parser of a frame stream, fed with arbitrary network chunks.
+
+    Bytes are accumulated in a single `bytearray` and complete records are
+    cut out of it; only the unparsed tail is kept between feeds.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> list[tuple[bytes, int, bytes]]:
+        """Return the `(kind, frame_offset, payload)` records completed by `chunk`."""
+        self._buffer += chunk
+        records = []
+        position = 0
+        header_size = RECORD_HEADER.size
+        while len(self._buffer) - position >= header_size:
+            kind, payload_length, frame_offset = RECORD_HEADER.unpack_from(self._buffer, position)
+            record_end = position + header_size + payload_length
+            if len(self._buffer) < record_end:
+                break
+            records.append((kind, frame_offset, bytes(self._buffer[position + header_size:record_end])))
+            position = record_end
+        del self._buffer[:position]
+        return records
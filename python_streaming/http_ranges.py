@@ -0,0 +1,321 @@
+"""HTTP Range requests (RFC 9110) for static media files.
+
+Parses `Range` headers (including suffix and multiple ranges), validates
+`If-Range` against the file's ETag/Last-Modified and builds 200/206/304/416
+responses whose bodies are streamed from disk in bounded chunks (or with
+sendfile, when enabled), or from S3.
+"""
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+import os
+from pathlib import Path
+import secrets
+from typing import AsyncIterator, Callable
+
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from python_streaming.config import FILE_CHUNK_SIZE
+from python_streaming.responses import FileChunksResponse
+from python_streaming.s3_media import S3Downloader, S3Object, S3ObjectNotFound, s3_downloader
+from python_streaming.util import iterate_file_chunks
+
+
+# Past this many ranges a client is more likely abusing us than seeking
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(ValueError):
+    """None of the requested ranges overlap the representation."""
+
+
+@dataclass(frozen=True)
+class FileValidators:
+    """Validators of a file, derived from a single stat() call."""
+    size: int
+    mtime: float
+    etag: str
+    last_modified: str
+
+    @classmethod
+    def from_path(cls, path: Path) -> "FileValidators":
+        stat = os.stat(path)
+        return cls(
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            etag=f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            last_modified=formatdate(stat.st_mtime, usegmt=True),
+        )
+
+    @classmethod
+    def from_s3_object(cls, s3_object: S3Object) -> "FileValidators":
+        mtime = s3_object.last_modified.timestamp()
+        return cls(
+            size=s3_object.size,
+            mtime=mtime,
+            etag=s3_object.etag,
+            last_modified=formatdate(mtime, usegmt=True),
+        )
+
+
+def parse_range_header(range_header: str | None, size: int) -> list[tuple[int, int]] | None:
+    """Turn a `Range` header into a list of inclusive (first, last) byte positions.
+
+    Returns None when the header is absent, malformed or uses a unit other than
+    bytes, in which case the whole representation must be served. Raises
+    `RangeNotSatisfiable` when it is well formed but no range fits in `size`.
+    Overlapping and adjacent ranges are merged.
+    """
+    if not range_header:
+        return None
+    unit, _, range_set = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not range_set:
+        return None
+
+    ranges = []
+    for range_spec in range_set.split(","):
+        first, separator, last = range_spec.strip().partition("-")
+        if not separator:
+            return None
+        try:
+            if not first:
+                # Suffix range: the last N bytes
+                suffix_length = int(last)
+                if suffix_length < 0:
+                    return None
+                if suffix_length == 0 or size == 0:
+                    continue
+                ranges.append((max(size - suffix_length, 0), size - 1))
+                continue
+            first = int(first)
+            last = int(last) if last else None
+        except ValueError:
+            return None
+        if first < 0 or (last is not None and last < first):
+            return None
+        if first >= size:
+            continue
+        if last is None:
+            last = size - 1
+        ranges.append((first, min(last, size - 1)))
+
+    if not ranges:
+        raise RangeNotSatisfiable(range_header)
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for first, last in ranges[1:]:
+        previous_first, previous_last = merged[-1]
+        if first <= previous_last + 1:
+            merged[-1] = (previous_first, max(previous_last, last))
+        else:
+            merged.append((first, last))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def if_none_match_matches(if_none_match: str | None, etag: str) -> bool:
+    """Whether `If-None-Match` lists the ETag, or is "*". The comparison is
+    weak: `W/"x"` matches `"x"`."""
+    if not if_none_match:
+        return False
+    opaque_tag = etag.removeprefix("W/")
+    return any(
+        tag == "*" or tag.removeprefix("W/") == opaque_tag
+        for tag in (tag.strip() for tag in if_none_match.split(","))
+    )
+
+
+def if_range_matches(if_range: str | None, validators: FileValidators) -> bool:
+    """Whether the ranges may be served, given the request's `If-Range`."""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        # Only strong ETags may be used with If-Range
+        return if_range == validators.etag
+    try:
+        return parsedate_to_datetime(if_range).timestamp() == int(validators.mtime)
+    except (TypeError, ValueError):
+        return False
+
+
+async def iterate_multipart_ranges(
+    iterate_range: Callable[[int, int], AsyncIterator[bytes]],
+    ranges: list[tuple[int, int]],
+    part_headers: list[bytes],
+    boundary: str,
+) -> AsyncIterator[bytes]:
+    for (first, last), headers in zip(ranges, part_headers):
+        yield headers
+        async for chunk in iterate_range(first, last - first + 1):
+            yield chunk
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode()
+
+
+def evaluate_conditions(
+    request: Request,
+    validators: FileValidators,
+    headers: dict[str, str],
+) -> Response | list[tuple[int, int]] | None:
+    """Apply `If-None-Match`, `If-Range` and `Range` to a representation.
+
+    Returns:
+        Response | list[tuple[int, int]] | None: The 304 or 416 response to
+            send, the ranges to serve, or None to serve the whole representation.
+    """
+    if if_none_match_matches(request.headers.get("if-none-match"), validators.etag):
+        return Response(status_code=304, headers=headers)
+
+    if not if_range_matches(request.headers.get("if-range"), validators):
+        return None
+    try:
+        return parse_range_header(request.headers.get("range"), validators.size)
+    except RangeNotSatisfiable:
+        return Response(
+            status_code=416,
+            headers={**headers, "Content-Range": f"bytes */{validators.size}"},
+        )
+
+
+def multipart_ranges_response(
+    iterate_range: Callable[[int, int], AsyncIterator[bytes]],
+    ranges: list[tuple[int, int]],
+    validators: FileValidators,
+    media_type: str,
+    headers: dict[str, str],
+) -> StreamingResponse:
+    boundary = secrets.token_hex(16)
+    part_headers = [
+        (
+            f"--{boundary}\r\n"
+            f"Content-Type: {media_type}\r\n"
+            f"Content-Range: bytes {first}-{last}/{validators.size}\r\n\r\n"
+        ).encode()
+        for first, last in ranges
+    ]
+    content_length = (
+        sum(len(part) for part in part_headers)
+        + sum(last - first + 1 + 2 for first, last in ranges)
+        + len(f"--{boundary}--\r\n")
+    )
+    return StreamingResponse(
+        iterate_multipart_ranges(iterate_range, ranges, part_headers, boundary),
+        status_code=206,
+        media_type=f"multipart/byteranges; boundary={boundary}",
+        headers={**headers, "Content-Length": str(content_length)},
+    )
+
+
+def ranged_file_response(
+    request: Request,
+    path: Path | str,
+    media_type: str,
+    chunk_size: int = FILE_CHUNK_SIZE,
+    headers: dict[str, str] | None = None,
+) -> Response:
+    """Serve a file honouring `Range`, `If-Range` and `If-None-Match`.
+
+    Args:
+        request (Request): The incoming request, used for its headers.
+        path (Path | str): The file to serve.
+        media_type (str): The file's content type.
+        chunk_size (int): Maximum number of bytes read from disk at once.
+        headers (dict[str, str] | None): Added to every response, e.g. `Cache-Control`.
+
+    Returns:
+        Response: 200 with the whole file, 206 with one range or with a
+            `multipart/byteranges` body, 304 if the client's copy is fresh,
+            or 416 if the ranges can't be satisfied.
+    """
+    path = Path(path)
+    try:
+        validators = FileValidators.from_path(path)
+    except FileNotFoundError:
+        return Response("Not found", status_code=404, media_type="text/plain")
+    headers = {
+        **(headers or {}),
+        "Accept-Ranges": "bytes",
+        "ETag": validators.etag,
+        "Last-Modified": validators.last_modified,
+    }
+
+    ranges = evaluate_conditions(request, validators, headers)
+    if isinstance(ranges, Response):
+        return ranges
+
+    if ranges is None:
+        return FileChunksResponse(
+            path,
+            media_type=media_type,
+            headers=headers,
+            length=validators.size,
+            chunk_size=chunk_size,
+        )
+
+    if len(ranges) == 1:
+        first, last = ranges[0]
+        return FileChunksResponse(
+            path,
+            status_code=206,
+            media_type=media_type,
+            headers={**headers, "Content-Range": f"bytes {first}-{last}/{validators.size}"},
+            offset=first,
+            length=last - first + 1,
+            chunk_size=chunk_size,
+        )
+
+    return multipart_ranges_response(
+        lambda first, length: iterate_file_chunks(path, chunk_size, first, length),
+        ranges, validators, media_type, headers,
+    )
+
+
+def ranged_s3_response(
+    request: Request,
+    bucket: str,
+    key: str,
+    media_type: str,
+    downloader: S3Downloader = s3_downloader,
+    chunk_size: int = FILE_CHUNK_SIZE,
+) -> Response:
+    """`ranged_file_response` for an S3 object, downloaded with parallel
+    ranged GETs. Looks the object up with a blocking HEAD request."""
+    try:
+        s3_object = downloader.head(bucket, key)
+    except S3ObjectNotFound:
+        return Response("Not found", status_code=404, media_type="text/plain")
+    validators = FileValidators.from_s3_object(s3_object)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": validators.etag,
+        "Last-Modified": validators.last_modified,
+    }
+
+    def iterate_range(first: int, length: int) -> AsyncIterator[memoryview]:
+        return downloader.iterate_async(s3_object, first, length, chunk_size)
+
+    ranges = evaluate_conditions(request, validators, headers)
+    if isinstance(ranges, Response):
+        return ranges
+    if ranges is None:
+        return StreamingResponse(
+            iterate_range(0, validators.size),
+            media_type=media_type,
+            headers={**headers, "Content-Length": str(validators.size)},
+        )
+    if len(ranges) == 1:
+        first, last = ranges[0]
+        return StreamingResponse(
+            iterate_range(first, last - first + 1),
+            status_code=206,
+            media_type=media_type,
+            headers={
+                **headers,
+                "Content-Range": f"bytes {first}-{last}/{validators.size}",
+                "Content-Length": str(last - first + 1),
+            },
+        )
+    return multipart_ranges_response(iterate_range, ranges, validators, media_type, headers)
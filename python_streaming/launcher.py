@@ -0,0 +1,188 @@
+"""Multi-process launcher for the FastAPI and Flask apps.
+
+The master process binds the port once, scans the audio catalog into shared
+memory and starts N uvicorn workers that all accept on the inherited socket.
+The Flask app runs in the same workers through `WSGIStreamingBridge`.
+
+Signals sent to the master:
+
+- SIGHUP: graceful reload. The catalog is rescanned and republished, then
+  workers are replaced one at a time: a new worker is started and, once it
+  accepts connections, the old one is asked to stop and finishes its
+  in-flight streams (up to `--graceful-timeout` seconds).
+- SIGTERM/SIGINT: graceful shutdown of every worker.
+
+Workers that die unexpectedly are restarted.
+
+Run it with `python -m python_streaming.launcher fastapi --workers 4`.
+"""
+import argparse
+import logging
+import multiprocessing
+from multiprocessing.context import SpawnProcess
+import os
+from pathlib import Path
+import signal
+import socket
+import time
+
+import uvicorn
+
+from python_streaming.catalog import AudioCatalog
+from python_streaming.config import CATALOG_INDEX_PATH, GRACEFUL_TIMEOUT, HTTP_PORT, MEDIA_DIRECTORY, SERVER_WORKERS
+from python_streaming.shared_catalog import SharedAudioCatalog
+
+
+logger = logging.getLogger(__name__)
+
+APPS = {
+    "fastapi": ("python_streaming.fastapi_app.app:app", "asgi3"),
+    "flask": ("python_streaming.flask_app.app:asgi_app", "asgi3"),
+}
+
+
+class _NotifyingServer(uvicorn.Server):
+    """Sets an event once it's ready to accept connections."""
+
+    def __init__(self, config: uvicorn.Config, ready):
+        super().__init__(config)
+        self.ready = ready
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets)
+        self.ready.set()
+
+
+def run_worker(app_name: str, listening_socket: socket.socket, ready, graceful_timeout: float):
+    app, interface = APPS[app_name]
+    config = uvicorn.Config(
+        app,
+        interface=interface,
+        timeout_graceful_shutdown=graceful_timeout,
+        log_level="info",
+    )
+    _NotifyingServer(config, ready).run(sockets=[listening_socket])
+
+
+class Launcher:
+    """Supervises the worker processes of one app.
+
+    Args:
+        app_name (str): "fastapi" or "flask".
+        listening_socket (socket.socket): The bound, listening socket.
+        workers (int): Number of worker processes.
+        graceful_timeout (float): Seconds a stopping worker gets to finish
+            its responses before being killed.
+    """
+
+    def __init__(self, app_name: str, listening_socket: socket.socket, workers: int, graceful_timeout: float):
+        self.app_name = app_name
+        self.listening_socket = listening_socket
+        self.number_of_workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.context = multiprocessing.get_context("spawn")
+        self.workers: list[SpawnProcess] = []
+        self.catalog: SharedAudioCatalog | None = None
+        self._reload_requested = False
+        self._stop_requested = False
+
+    def publish_catalog(self):
+        """Scan the media directory and share the result with future workers."""
+        catalog = AudioCatalog(Path(MEDIA_DIRECTORY), Path(CATALOG_INDEX_PATH))
+        catalog.scan()
+        previous = self.catalog
+        self.catalog = SharedAudioCatalog.create(catalog)
+        # Spawned workers inherit the environment at start time
+        os.environ["SHARED_CATALOG_NAME"] = self.catalog.name
+        return previous
+
+    def spawn(self) -> SpawnProcess:
+        ready = self.context.Event()
+        process = self.context.Process(
+            target=run_worker,
+            args=(self.app_name, self.listening_socket, ready, self.graceful_timeout),
+            name=f"{self.app_name}-worker",
+        )
+        process.start()
+        if not ready.wait(timeout=60):
+            logger.warning("Worker %d isn't ready after 60 s", process.pid)
+        return process
+
+    def stop_worker(self, process: SpawnProcess):
+        if process.is_alive():
+            process.terminate()
+        process.join(self.graceful_timeout + 5)
+        if process.is_alive():
+            logger.warning("Killing worker %d, still busy after the graceful timeout", process.pid)
+            process.kill()
+            process.join()
+
+    def reload(self):
+        logger.info("Reloading %d workers", len(self.workers))
+        previous_catalog = self.publish_catalog()
+        for index, old_worker in enumerate(self.workers):
+            self.workers[index] = self.spawn()
+            self.stop_worker(old_worker)
+        if previous_catalog is not None:
+            previous_catalog.close()
+            previous_catalog.unlink()
+        logger.info("Reload done")
+
+    def run(self):
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, "_reload_requested", True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, "_stop_requested", True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, "_stop_requested", True))
+
+        self.publish_catalog()
+        self.workers = [self.spawn() for _ in range(self.number_of_workers)]
+        logger.info(
+            "%s: %d workers on %s:%d", self.app_name, len(self.workers), *self.listening_socket.getsockname()[:2]
+        )
+        try:
+            while not self._stop_requested:
+                if self._reload_requested:
+                    self._reload_requested = False
+                    self.reload()
+                for index, worker in enumerate(self.workers):
+                    if not worker.is_alive():
+                        logger.warning("Worker %d exited with %s, restarting it", worker.pid, worker.exitcode)
+                        self.workers[index] = self.spawn()
+                time.sleep(0.5)
+        finally:
+            logger.info("Stopping %d workers", len(self.workers))
+            for worker in self.workers:
+                if worker.is_alive():
+                    worker.terminate()
+            for worker in self.workers:
+                self.stop_worker(worker)
+            if self.catalog is not None:
+                self.catalog.close()
+                self.catalog.unlink()
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    listening_socket = socket.socket(family, socket.SOCK_STREAM)
+    listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listening_socket.bind((host, port))
+    listening_socket.listen(2048)
+    listening_socket.set_inheritable(True)
+    return listening_socket
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("app", choices=sorted(APPS))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=HTTP_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--graceful-timeout", type=float, default=GRACEFUL_TIMEOUT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(name)s %(message)s")
+    listening_socket = bind_socket(args.host, args.port)
+    Launcher(args.app, listening_socket, args.workers, args.graceful_timeout).run()
+
+
+if __name__ == "__main__":
+    main()
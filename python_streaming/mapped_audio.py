@@ -0,0 +1,93 @@
+"""Zero-copy frame serving: WAVE files are kept memory-mapped and frame ranges
+are served as `memoryview` slices of the mapping, instead of opening, seeking
+and reading a new `bytes` object on every request.
+
+Media files must be replaced atomically (written elsewhere, then renamed over
+the old one), never rewritten in place: a mapping keeps the file it was made
+from, so a replaced file is still served whole until the catalog picks up the
+new one, whereas a file truncated in place makes reads of the lost pages
+crash the process with SIGBUS. A file whose size or mtime doesn't match its
+catalog entry is refused when it's mapped.
+"""
+from collections import OrderedDict
+import mmap
+from threading import Lock
+
+from python_streaming.catalog import AudioEntry, ensure_unchanged
+
+
+class MappedAudioFiles:
+    """LRU of read-only memory maps, shared by every request.
+
+    Evicting a map only drops the cache's reference: views handed out before
+    (and the slices still being sent) keep the mapping alive until the last
+    of them is gone. Views are never released here, as another thread may be
+    about to slice one.
+
+    Args:
+        max_open_maps (int): Maximum number of files kept mapped at once.
+    """
+
+    def __init__(self, max_open_maps: int = 64):
+        self.max_open_maps = max_open_maps
+        self._maps: OrderedDict[tuple[str, int, int], memoryview] = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._maps)
+
+    @staticmethod
+    def _key(audio: AudioEntry) -> tuple[str, int, int]:
+        # Keying by mtime and size means a rewritten file gets a fresh mapping
+        return audio.path, audio.mtime_ns, audio.file_size
+
+    def cached_view(self, audio: AudioEntry) -> memoryview | None:
+        """The view over the file's `data` chunk if it's mapped already.
+        Never touches the file system."""
+        key = self._key(audio)
+        with self._lock:
+            if (view := self._maps.get(key)) is not None:
+                self._maps.move_to_end(key)
+            return view
+
+    def data_view(self, audio: AudioEntry) -> memoryview:
+        """Return a view over the `data` chunk of the given file.
+
+        Raises:
+            StaleAudioError: If the file no longer matches `audio`, whose
+                offsets would then be wrong. Rescanning the catalog fixes it.
+        """
+        if (view := self.cached_view(audio)) is not None:
+            return view
+
+        if audio.data_size == 0:
+            return memoryview(b"")
+        with open(audio.path, "rb") as file:
+            ensure_unchanged(audio, file.fileno())
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapping)[audio.data_offset:audio.data_offset + audio.data_size]
+
+        key = self._key(audio)
+        with self._lock:
+            self._maps[key] = view
+            self._maps.move_to_end(key)
+            while len(self._maps) > self.max_open_maps:
+                self._maps.popitem(last=False)
+        return view
+
+    def clear(self) -> None:
+        with self._lock:
+            self._maps.clear()
+
+
+def read_mapped_audio_frames(
+    mapped_files: MappedAudioFiles,
+    audio: AudioEntry,
+    start_frame: int,
+    frames: int,
+) -> memoryview:
+    """Same as `audio.read_audio_frames`, but returns a slice of the file's
+    memory map. No syscall nor copy happens after the first request."""
+    start_byte = audio.frame_to_byte(start_frame) - audio.data_offset
+    end_byte = audio.frame_to_byte(start_frame + frames) - audio.data_offset
+    return mapped_files.data_view(audio)[start_byte:end_byte]
@@ -0,0 +1,360 @@
+"""Seek index of MP3 files: the byte offset of every frame.
+
+An MP3 stream is a sequence of frames that each hold the same number of
+samples, so the frame playing at time t is `t * sample_rate /
+samples_per_frame` and it starts at the offset the index has for it. That's
+exact for CBR and VBR files alike, unlike offsets interpolated from the
+bitrate or from a Xing table of contents.
+
+The index is built once by scanning the frame headers (an ID3v2 tag at the
+start is skipped, and a frame is only accepted if the next one follows it,
+to avoid false syncs). A Xing/Info or VBRI header in the first frame is read
+for the frame count it declares, and isn't indexed since it holds no audio.
+Indexes are cached on disk, keyed by the source and its version (mtime and
+size, or ETag), and the last ones used are kept in memory.
+
+Layer III frames may borrow bits from the previous frames (the bit
+reservoir): a decoder starting at a seek point can skip a frame's worth of
+audio, as when seeking in any MP3 player.
+"""
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+from typing import Callable, Iterable, NamedTuple
+
+from python_streaming.config import SEEK_INDEX_DIRECTORY, SEEK_INDEX_MEMORY_ENTRIES
+
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+MPEG1, MPEG2, MPEG25 = 3, 2, 0
+LAYER1, LAYER2, LAYER3 = 3, 2, 1
+
+BITRATES = {
+    (MPEG1, LAYER1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (MPEG1, LAYER2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (MPEG1, LAYER3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (MPEG2, LAYER1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (MPEG2, LAYER2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (MPEG2, LAYER3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+SAMPLE_RATES = {MPEG1: (44100, 48000, 32000), MPEG2: (22050, 24000, 16000), MPEG25: (11025, 12000, 8000)}
+# Tags that may follow the last frame
+TRAILING_TAGS = (b"TAG", b"APE", b"LYR")
+
+
+class Mp3FormatError(ValueError):
+    """No MPEG audio frames were found."""
+
+
+class SeekPastEndError(ValueError):
+    """The requested time is at or past the end of the audio."""
+
+    def __init__(self, seconds: float, duration: float):
+        super().__init__(f"{seconds:g} s is past the end of the audio ({duration:.3f} s)")
+        self.seconds = seconds
+        self.duration = duration
+
+
+class FrameHeader(NamedTuple):
+    version: int
+    layer: int
+    sample_rate: int
+    samples: int
+    length: int
+    mono: bool
+    crc: bool
+
+
+_headers: dict[int, FrameHeader | None] = {}
+
+
+def parse_frame_header(data: bytes | bytearray, position: int) -> FrameHeader | None:
+    """The frame header at `position`, or None if there's none."""
+    if data[position] != 0xFF:
+        return None
+    # Only the fields that matter here, so that the cache stays small
+    key = data[position + 1] << 16 | data[position + 2] << 8 | data[position + 3] & 0xC0
+    if key in _headers:
+        return _headers[key]
+    b1, b2, b3 = data[position + 1], data[position + 2], data[position + 3]
+    version, layer = b1 >> 3 & 3, b1 >> 1 & 3
+    bitrate_index, sample_rate_index = b2 >> 4, b2 >> 2 & 3
+    header = None
+    if (b1 & 0xE0 == 0xE0 and version != 1 and layer != 0
+            and bitrate_index not in (0, 15) and sample_rate_index != 3):
+        bitrate = BITRATES[MPEG1 if version == MPEG1 else MPEG2, layer][bitrate_index] * 1000
+        sample_rate = SAMPLE_RATES[version][sample_rate_index]
+        padding = b2 >> 1 & 1
+        if layer == LAYER1:
+            samples, length = 384, (12 * bitrate // sample_rate + padding) * 4
+        elif layer == LAYER2 or version == MPEG1:
+            samples, length = 1152, 144 * bitrate // sample_rate + padding
+        else:
+            samples, length = 576, 72 * bitrate // sample_rate + padding
+        header = FrameHeader(version, layer, sample_rate, samples, length, b3 >> 6 == 3, not b1 & 1)
+    _headers[key] = header
+    return header
+
+
+def read_declared_frames(frame: bytes | bytearray, header: FrameHeader) -> int | None:
+    """The frame count of a Xing/Info or VBRI header in `frame`, -1 if it has
+    one without a count, or None if it's an audio frame."""
+    if header.version == MPEG1:
+        side_info = 17 if header.mono else 32
+    else:
+        side_info = 9 if header.mono else 17
+    for offset in (4 + side_info, 6 + side_info):
+        tag = frame[offset:offset + 4]
+        if tag in (b"Xing", b"Info"):
+            flags = int.from_bytes(frame[offset + 4:offset + 8], "big")
+            return int.from_bytes(frame[offset + 8:offset + 12], "big") if flags & 1 else -1
+    if frame[36:40] == b"VBRI":
+        return int.from_bytes(frame[50:54], "big")
+    return None
+
+
+class SeekPoint(NamedTuple):
+    frame: int
+    byte_offset: int
+    time: float
+
+
+@dataclass
+class Mp3SeekIndex:
+    """Byte offsets of the audio frames of one MP3 source."""
+    source: str
+    version: str
+    sample_rate: int
+    samples_per_frame: int
+    audio_end: int
+    declared_frames: int | None = None
+    frame_offsets: array = field(default_factory=lambda: array("Q"), repr=False)
+
+    @property
+    def frames(self) -> int:
+        return len(self.frame_offsets)
+
+    @property
+    def duration(self) -> float:
+        return self.frames * self.samples_per_frame / self.sample_rate
+
+    def locate(self, seconds: float) -> SeekPoint:
+        """The frame playing at `seconds`. Past the end, the end of the audio."""
+        if seconds >= self.duration:
+            frame = self.frames
+        else:
+            frame = max(int(seconds * self.sample_rate / self.samples_per_frame), 0)
+        byte_offset = self.frame_offsets[frame] if frame < self.frames else self.audio_end
+        return SeekPoint(frame, byte_offset, frame * self.samples_per_frame / self.sample_rate)
+
+    def save(self, path: Path):
+        metadata = {
+            "index_version": INDEX_VERSION,
+            "source": self.source,
+            "version": self.version,
+            "sample_rate": self.sample_rate,
+            "samples_per_frame": self.samples_per_frame,
+            "audio_end": self.audio_end,
+            "declared_frames": self.declared_frames,
+        }
+        temporary_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(temporary_path, "wb") as file:
+            file.write(json.dumps(metadata).encode("utf-8") + b"\n")
+            self.frame_offsets.tofile(file)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "Mp3SeekIndex":
+        with open(path, "rb") as file:
+            metadata = json.loads(file.readline())
+            if metadata.pop("index_version") != INDEX_VERSION:
+                raise ValueError(f"{path} was written by another version")
+            frame_offsets = array("Q", file.read())
+        return cls(**metadata, frame_offsets=frame_offsets)
+
+
+class Mp3IndexBuilder:
+    """Scans MP3 data fed in sequential chunks of any size."""
+
+    def __init__(self, source: str, version: str):
+        self.source = source
+        self.version = version
+        self._buffer = bytearray()
+        # File offset of the buffer's first byte
+        self._base = 0
+        self._to_skip = 0
+        self._tag_checked = False
+        self._stream: FrameHeader | None = None
+        self._declared_frames: int | None = None
+        self._offsets = array("Q")
+        self._audio_end = 0
+
+    def _same_stream(self, header: FrameHeader | None) -> bool:
+        return header is not None and (
+            self._stream is None
+            or (header.version, header.layer, header.sample_rate)
+            == (self._stream.version, self._stream.layer, self._stream.sample_rate)
+        )
+
+    def feed(self, chunk: bytes, final: bool = False):
+        if self._to_skip:
+            skipped = min(self._to_skip, len(chunk))
+            chunk = chunk[skipped:]
+            self._to_skip -= skipped
+            self._base += skipped
+        self._buffer += chunk
+        buffer = self._buffer
+        position = 0
+
+        if not self._tag_checked:
+            if len(buffer) < 10 and not final:
+                return
+            if buffer[:3] == b"ID3" and len(buffer) >= 10:
+                tag_size = buffer[6] << 21 | buffer[7] << 14 | buffer[8] << 7 | buffer[9]
+                position = 10 + tag_size + (10 if buffer[5] & 0x10 else 0)
+            self._tag_checked = True
+
+        while position + 4 <= len(buffer):
+            header = parse_frame_header(buffer, position)
+            if not self._same_stream(header):
+                position = buffer.find(b"\xff", position + 1)
+                if position < 0:
+                    position = len(buffer)
+                continue
+            end = position + header.length
+            if end + 4 > len(buffer) and not final:
+                break
+            if end > len(buffer):
+                # Truncated last frame
+                position = len(buffer)
+                break
+            if not (
+                self._same_stream(parse_frame_header(buffer, end) if end + 4 <= len(buffer) else None)
+                or buffer[end:end + 3] in TRAILING_TAGS
+                or end == len(buffer)
+            ):
+                position = buffer.find(b"\xff", position + 1)
+                if position < 0:
+                    position = len(buffer)
+                continue
+            if self._stream is None:
+                self._stream = header
+                self._declared_frames = read_declared_frames(buffer[position:end], header)
+                if self._declared_frames is not None:
+                    position = end
+                    continue
+            self._offsets.append(self._base + position)
+            self._audio_end = self._base + end
+            position = end
+
+        if position > len(buffer):
+            self._to_skip = position - len(buffer)
+            position = len(buffer)
+        del buffer[:position]
+        self._base += position
+
+    def finish(self) -> Mp3SeekIndex:
+        self.feed(b"", final=True)
+        if self._stream is None or not self._offsets:
+            raise Mp3FormatError(f"No MPEG audio frames in {self.source}")
+        declared = self._declared_frames if self._declared_frames and self._declared_frames > 0 else None
+        return Mp3SeekIndex(
+            source=self.source,
+            version=self.version,
+            sample_rate=self._stream.sample_rate,
+            samples_per_frame=self._stream.samples,
+            audio_end=self._audio_end,
+            declared_frames=declared,
+            frame_offsets=self._offsets,
+        )
+
+
+def build_seek_index(source: str, version: str, chunks: Iterable[bytes]) -> Mp3SeekIndex:
+    builder = Mp3IndexBuilder(source, version)
+    for chunk in chunks:
+        builder.feed(chunk)
+    return builder.finish()
+
+
+def iterate_file_blocks(path: Path | str, block_size: int = 1024 * 1024) -> Iterable[bytes]:
+    with open(path, "rb") as file:
+        while block := file.read(block_size):
+            yield block
+
+
+class SeekIndexCache:
+    """Seek indexes on disk, the most recently used ones in memory too.
+
+    Builds run in a worker thread, one per source and version however many
+    requests (and event loops, or WSGI threads) ask for it at once.
+
+    Args:
+        directory (Path): Where indexes are stored.
+        memory_entries (int): Indexes kept in memory.
+    """
+
+    def __init__(self, directory: Path = Path(SEEK_INDEX_DIRECTORY), memory_entries: int = SEEK_INDEX_MEMORY_ENTRIES):
+        self.directory = Path(directory)
+        self.memory_entries = memory_entries
+        self._indexes: OrderedDict[tuple[str, str], Mp3SeekIndex] = OrderedDict()
+        self._building: dict[tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="seek-index")
+
+    def path_for(self, source: str, version: str) -> Path:
+        identity = f"{source}|{version}"
+        return self.directory / f"{hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]}.idx"
+
+    def _remember(self, key: tuple[str, str], index: Mp3SeekIndex):
+        with self._lock:
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.memory_entries:
+                self._indexes.popitem(last=False)
+
+    def _load_or_build(self, source: str, version: str, open_chunks: Callable[[], Iterable[bytes]]) -> Mp3SeekIndex:
+        path = self.path_for(source, version)
+        try:
+            index = Mp3SeekIndex.load(path)
+        except FileNotFoundError:
+            index = None
+        except ValueError:
+            logger.warning("Rebuilding the unreadable seek index %s", path)
+            index = None
+        if index is None:
+            index = build_seek_index(source, version, open_chunks())
+            path.parent.mkdir(parents=True, exist_ok=True)
+            index.save(path)
+            logger.info("Indexed %d frames of %s", index.frames, source)
+        self._remember((source, version), index)
+        return index
+
+    def get_or_build(self, source: str, version: str, open_chunks: Callable[[], Iterable[bytes]]) -> Mp3SeekIndex:
+        """The index of `source` at `version`, loaded or built if needed.
+
+        Args:
+            source (str): The file path or object URL.
+            version (str): Changes whenever the content does.
+            open_chunks (Callable[[], Iterable[bytes]]): Reads the content,
+                if the index has to be built.
+        """
+        key = (source, version)
+        with self._lock:
+            if (index := self._indexes.get(key)) is not None:
+                self._indexes.move_to_end(key)
+                return index
+            if (building := self._building.get(key)) is None:
+                building = self._executor.submit(self._load_or_build, source, version, open_chunks)
+                self._building[key] = building
+                building.add_done_callback(lambda _: self._building.pop(key, None))
+        return building.result()
@@ -0,0 +1,168 @@
+"""Token-bucket pacing of line feeds over persistent connections.
+
+A `Pacer` limits one connection to a number of messages and/or bytes per
+second. `pace_batches` sends lines as soon as the limits allow and, while it
+has to wait for tokens, keeps packing the lines that are already available
+into the next message: a consumer that falls behind catches up with fewer,
+bigger frames instead of a growing backlog.
+"""
+import asyncio
+import time
+from typing import AsyncIterator
+
+from python_streaming.config import DATA_BATCH_BYTES, DATA_BATCH_LINES, PACING_BURST_SECONDS
+
+
+class TokenBucket:
+    """Tokens accrue at `rate` per second, up to `capacity`.
+
+    A consumer may take more tokens than the capacity (e.g. a message bigger
+    than the burst); the bucket then goes into debt and the next consumers
+    wait until it's repaid. A rate of None means no limit.
+    """
+
+    def __init__(self, rate: float | None, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def delay(self, amount: float) -> float:
+        """Seconds to wait before `amount` tokens can be taken."""
+        if self.rate is None:
+            return 0.0
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing / self.rate, 0.0)
+
+    def consume(self, amount: float):
+        self._refill()
+        if self.rate is not None:
+            self.tokens -= amount
+
+
+class Pacer:
+    """The rate limits of one connection. Rates can change at any time.
+
+    Args:
+        messages_per_second (float | None): None for no message limit.
+        bytes_per_second (float | None): None for no byte limit.
+        burst_seconds (float): How much unused rate can be saved up.
+    """
+
+    def __init__(
+        self,
+        messages_per_second: float | None = None,
+        bytes_per_second: float | None = None,
+        burst_seconds: float = PACING_BURST_SECONDS,
+    ):
+        self.burst_seconds = burst_seconds
+        self.messages = TokenBucket(None, 0)
+        self.bytes = TokenBucket(None, 0)
+        self.set_rates(messages_per_second, bytes_per_second)
+
+    def set_rates(self, messages_per_second: float | None, bytes_per_second: float | None):
+        messages = TokenBucket(messages_per_second, max(1.0, (messages_per_second or 0) * self.burst_seconds))
+        bytes_ = TokenBucket(bytes_per_second, max(1.0, (bytes_per_second or 0) * self.burst_seconds))
+        # Changing rates mustn't be a way to refill the buckets
+        for old, new in ((self.messages, messages), (self.bytes, bytes_)):
+            if old.rate is not None:
+                old._refill()
+                new.tokens = min(old.tokens, new.capacity)
+        self.messages = messages
+        self.bytes = bytes_
+
+    def max_batch_size(self, max_bytes: int) -> float:
+        """`max_bytes`, capped at the byte burst so that batching never lets
+        more than a burst through at once."""
+        if self.bytes.rate is None:
+            return max_bytes
+        return min(max_bytes, self.bytes.capacity)
+
+    def delay(self, size: int) -> float:
+        return max(self.messages.delay(1), self.bytes.delay(size))
+
+    def consume(self, size: int):
+        self.messages.consume(1)
+        self.bytes.consume(size)
+
+
+def negotiate_rate(requested: float | None, default: float | None, maximum: float | None) -> float | None:
+    """The rate granted to a client: its request (or the default) capped at
+    `maximum`. Rates of 0 or None mean unlimited."""
+    rate = default if requested is None else requested
+    if not rate:
+        return maximum or None
+    return min(rate, maximum) if maximum else rate
+
+
+_END = object()
+
+
+async def pace_batches(
+    lines: AsyncIterator[bytes],
+    pacer: Pacer,
+    max_lines: int = DATA_BATCH_LINES,
+    max_bytes: int = DATA_BATCH_BYTES,
+) -> AsyncIterator[bytes]:
+    """Yield newline-separated batches of `lines` at the pace allowed by `pacer`.
+
+    A batch is sent as soon as the pacer allows it and no further line is
+    ready, or once it's full. The consumer awaiting each send (and therefore
+    pausing under transport backpressure) is what holds the next batch back;
+    the tokens saved up meanwhile are capped by the pacer's burst, and so
+    are batches: only a single line bigger than the burst may exceed it.
+    """
+    iterator = aiter(lines)
+    pending: asyncio.Future | None = None
+    batch = []
+    batch_size = 0
+    exhausted = False
+    overflowing = False
+    try:
+        while batch or not exhausted:
+            if not exhausted and pending is None:
+                pending = asyncio.ensure_future(anext(iterator, _END))
+            if batch:
+                full = overflowing or len(batch) >= max_lines or batch_size >= pacer.max_batch_size(max_bytes)
+                wait = pacer.delay(batch_size)
+                if full or exhausted:
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    ready = False
+                else:
+                    # Keep batching while waiting for tokens; stop as soon as
+                    # the tokens are there and no other line is
+                    done, _ = await asyncio.wait({pending}, timeout=wait)
+                    ready = bool(done)
+                if not ready:
+                    pacer.consume(batch_size)
+                    yield b"\n".join(batch)
+                    batch = []
+                    batch_size = 0
+                    overflowing = False
+                    continue
+            line = await pending
+            if line is _END:
+                pending = None
+                exhausted = True
+                continue
+            if batch and batch_size + len(line) + 1 > pacer.max_batch_size(max_bytes):
+                # Send the batch first; `pending` keeps the line for the next one
+                overflowing = True
+                continue
+            pending = None
+            batch.append(line)
+            batch_size += len(line) + 1
+    finally:
+        if pending is not None:
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
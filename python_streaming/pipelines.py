@@ -0,0 +1,87 @@
+"""The streams served by both the FastAPI and the Flask app.
+
+Each function returns a `StreamPipeline` of bytes; the apps only validate the
+request and pass the pipeline to their framework's sink.
+"""
+import os
+from pathlib import Path
+
+from python_streaming import chatting_service
+from python_streaming.chat_cache import ChatStreamCache
+from python_streaming.config import DATA_FILE_PATH, MEDIA_BACKEND, S3_MEDIA_BUCKET, S3_MEDIA_PREFIX
+from python_streaming.flush_policy import FlushPolicy, coalesce_chunks
+from python_streaming.mp3_index import SeekIndexCache, SeekPastEndError, SeekPoint, iterate_file_blocks
+from python_streaming.resumable_streams import ResumableStreams
+from python_streaming.s3_media import s3_downloader
+from python_streaming.streaming_core import StreamPipeline, encode_text
+from python_streaming.util import batch_lines, iterate_lines, iterate_over_audio
+
+
+chat_stream_cache = ChatStreamCache()
+chat_flush_policy = FlushPolicy()
+seek_index_cache = SeekIndexCache()
+chat_event_streams = ResumableStreams()
+
+
+def locate_audio(seconds: float, name: str = "audio.mp3") -> SeekPoint:
+    """The frame of an MP3 playing at `seconds`, from its seek index.
+
+    Blocking: the object may be looked up in S3, and the index built.
+
+    Raises:
+        SeekPastEndError: If `seconds` is at or past the end of the audio.
+    """
+    if MEDIA_BACKEND == "s3":
+        s3_object = s3_downloader.head(S3_MEDIA_BUCKET, S3_MEDIA_PREFIX + name)
+        index = seek_index_cache.get_or_build(
+            f"s3://{s3_object.bucket}/{s3_object.key}",
+            s3_object.etag,
+            lambda: s3_downloader.iterate(s3_object),
+        )
+    else:
+        path = Path("resources", name)
+        stat = os.stat(path)
+        index = seek_index_cache.get_or_build(
+            str(path), f"{stat.st_mtime_ns}-{stat.st_size}", lambda: iterate_file_blocks(path),
+        )
+    if seconds >= index.duration:
+        raise SeekPastEndError(seconds, index.duration)
+    return index.locate(seconds)
+
+
+def audio_pipeline(offset: int = 0) -> StreamPipeline:
+    # Start at `offset` (a frame boundary from `locate_audio`) to seek
+    if MEDIA_BACKEND == "s3":
+        return StreamPipeline(lambda: s3_downloader.open_async(S3_MEDIA_BUCKET, S3_MEDIA_PREFIX + "audio.mp3", offset))
+    return StreamPipeline(lambda: iterate_over_audio(offset=offset))
+
+
+def data_pipeline(path: Path | str = DATA_FILE_PATH) -> StreamPipeline:
+    # Lines are read lazily and packed into batches, one batch per HTTP chunk
+    return StreamPipeline(lambda: iterate_lines(path)).through(batch_lines)
+
+
+def chat_pipeline(user_message: str) -> StreamPipeline:
+    # Identical prompts share one upstream stream, and completed ones are
+    # replayed. Tokens are coalesced into chunks worth sending.
+    return (
+        StreamPipeline(lambda: chat_stream_cache.stream(user_message, lambda: chatting_service.chat(user_message)))
+        .through(coalesce_chunks, chat_flush_policy)
+        .through(encode_text)
+    )
+
+
+def chat_events_pipeline(user_message: str, stream_id: str) -> StreamPipeline:
+    # The same chunks as chat_pipeline, as SSE events. The generation runs on
+    # its own and is buffered, so that a client can resume it after a disconnect.
+    return StreamPipeline(lambda: chat_event_streams.start(
+        stream_id,
+        lambda: coalesce_chunks(
+            chat_stream_cache.stream(user_message, lambda: chatting_service.chat(user_message)),
+            chat_flush_policy,
+        ),
+    ))
+
+
+def resumed_chat_events_pipeline(stream_id: str, after: int) -> StreamPipeline:
+    return StreamPipeline(lambda: chat_event_streams.resume(stream_id, after))
@@ -0,0 +1,393 @@
+"""Playback of streamed PCM through a jitter buffer.
+
+Buffers arrive from the network at irregular times, while the audio device
+consumes them at a fixed rate. Between the two sits a `JitterBuffer`: the
+device pulls from it (PyAudio in callback mode, or a sink of our own with
+the same contract), and playback only starts, or resumes after an underrun,
+once it holds its target depth.
+
+The target depth adapts to the measured arrival times. As for TCP's
+retransmission timeout (RFC 6298), it's the smoothed time spent waiting for
+each buffer plus four times its mean deviation, within the configured
+bounds. Every underrun also scales it up, and it eases back while playback
+runs smoothly. A deeper buffer means fewer dropouts but more latency.
+
+What listeners would hear is counted in `PlaybackStats`: underruns, the
+silence they inserted, and the buffers that arrived after the device
+needed them.
+"""
+from abc import ABC, abstractmethod
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+import threading
+import time
+from typing import AsyncIterable, Callable, Iterable
+
+from python_streaming.config import (
+    BUFFER_SIZE,
+    PLAYBACK_FILE_PATH,
+    PLAYBACK_MAX_BUFFER_SECONDS,
+    PLAYBACK_MIN_BUFFER_SECONDS,
+    PLAYBACK_SINK,
+)
+from python_streaming.recorder import WaveRecorder
+from python_streaming.util import iterate_off_loop
+
+
+# Pulls `frames` frames: (the PCM, whether it's the last buffer of the stream)
+Pull = Callable[[int], tuple[bytes, bool]]
+
+
+@dataclass
+class PlaybackStats:
+    buffers: int = 0
+    # Buffers that arrived while playback was stalled waiting for them
+    late_buffers: int = 0
+    underruns: int = 0
+    frames_played: int = 0
+    # Silence played after playback had started: the dropouts
+    dropout_frames: int = 0
+    # Reported by the device (or sink) itself, e.g. a callback that ran late
+    device_underflows: int = 0
+    startup_seconds: float = 0.0
+    # Smoothed wait for each buffer, and its mean deviation
+    arrival_wait: float = 0.0
+    jitter: float = 0.0
+    target_depth: float = 0.0
+    max_target_depth: float = 0.0
+
+
+class JitterBuffer:
+    """PCM between the network (`write`) and the audio device (`read`).
+
+    Reads happen on the device's thread and never block: missing audio is
+    replaced by silence.
+
+    Args:
+        channels (int): Number of channels.
+        sample_rate (int): Frames per second.
+        bit_depth (int): Bits per sample.
+        min_depth (float): Lower bound of the target depth, in seconds.
+        max_depth (float): Upper bound of the target depth, in seconds. The
+            writer is expected to wait while the buffer holds that much.
+        clock (Callable[[], float]): Time source, in seconds of audio: scale
+            it along with a sink's `speed`.
+    """
+
+    def __init__(
+        self,
+        channels: int,
+        sample_rate: int,
+        bit_depth: int,
+        min_depth: float = PLAYBACK_MIN_BUFFER_SECONDS,
+        max_depth: float = PLAYBACK_MAX_BUFFER_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.sample_rate = sample_rate
+        self.block_align = channels * bit_depth // 8
+        # 8-bit PCM is unsigned
+        self.silence = b"\x80" if bit_depth == 8 else b"\x00"
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.clock = clock
+        self.stats = PlaybackStats(target_depth=min_depth, max_target_depth=min_depth)
+        self._chunks: deque[bytes] = deque()
+        self._offset = 0
+        self._size = 0
+        self._lock = threading.Lock()
+        self._playing = False
+        self._started = False
+        self._starved = False
+        self._ended = False
+        self._safety = 1.0
+        self._waits_measured = False
+        self._created_at = clock()
+
+    @property
+    def depth(self) -> float:
+        """Seconds of audio buffered."""
+        return self._size / self.block_align / self.sample_rate
+
+    def _update_target(self):
+        stats = self.stats
+        target = (stats.arrival_wait + 4 * stats.jitter) * self._safety
+        stats.target_depth = min(self.max_depth, max(self.min_depth, target))
+        stats.max_target_depth = max(stats.max_target_depth, stats.target_depth)
+
+    def write(self, chunk: bytes, waited: float | None = None):
+        """Queue a buffer.
+
+        Args:
+            chunk (bytes): PCM, a whole number of frames.
+            waited (float | None): Seconds the writer waited for it to arrive,
+                or None if unknown (e.g. the first buffer, which waited for
+                the connection too).
+        """
+        with self._lock:
+            stats = self.stats
+            stats.buffers += 1
+            if self._starved:
+                stats.late_buffers += 1
+            if waited is not None:
+                if not self._waits_measured:
+                    self._waits_measured = True
+                    stats.arrival_wait, stats.jitter = waited, waited / 2
+                else:
+                    stats.jitter += (abs(waited - stats.arrival_wait) - stats.jitter) / 4
+                    stats.arrival_wait += (waited - stats.arrival_wait) / 8
+            if self._playing:
+                self._safety = max(1.0, self._safety * 0.98)
+            self._update_target()
+            if chunk:
+                self._chunks.append(chunk)
+                self._size += len(chunk)
+
+    def end(self):
+        """No more buffers will be written: play what's left."""
+        with self._lock:
+            self._ended = True
+
+    def _take(self, size: int) -> bytearray:
+        data = bytearray()
+        while len(data) < size and self._chunks:
+            chunk = self._chunks[0]
+            part = chunk[self._offset:self._offset + size - len(data)]
+            data += part
+            self._offset += len(part)
+            if self._offset == len(chunk):
+                self._chunks.popleft()
+                self._offset = 0
+        self._size -= len(data)
+        return data
+
+    def read(self, frames: int) -> tuple[bytes, bool]:
+        """The next `frames` frames, padded with silence if there aren't
+        enough, and whether the stream is over."""
+        size = frames * self.block_align
+        with self._lock:
+            stats = self.stats
+            if not self._playing:
+                if self._ended or self.depth >= stats.target_depth:
+                    self._playing = True
+                    self._starved = False
+                    if not self._started:
+                        self._started = True
+                        stats.startup_seconds = self.clock() - self._created_at
+                else:
+                    if self._started:
+                        stats.dropout_frames += frames
+                    return self.silence * size, False
+            data = self._take(size)
+            stats.frames_played += len(data) // self.block_align
+            if self._ended and not self._size:
+                return bytes(data), True
+            if len(data) < size:
+                # Stall until the target depth is back, rather than play
+                # whatever trickles in and stall again right away
+                stats.underruns += 1
+                stats.dropout_frames += frames - len(data) // self.block_align
+                self._playing = False
+                self._starved = True
+                self._safety = min(self._safety * 1.5, 8.0)
+                self._update_target()
+                data += self.silence * (size - len(data))
+            return bytes(data), False
+
+
+class OutputSink(ABC):
+    """Plays PCM that it pulls, at its own pace, from the thread of its choice.
+
+    Args:
+        frames_per_buffer (int): Frames pulled at once.
+    """
+
+    def __init__(self, frames_per_buffer: int = BUFFER_SIZE):
+        self.frames_per_buffer = frames_per_buffer
+        self.device_underflows = 0
+
+    @abstractmethod
+    def start(self, pull: Pull, channels: int, sample_rate: int, bit_depth: int):
+        ...
+
+    @abstractmethod
+    def wait(self):
+        """Block until the last buffer has been played."""
+
+    @abstractmethod
+    def close(self):
+        ...
+
+
+class PyAudioSink(OutputSink):
+    """The default output device, driven by PyAudio in callback mode."""
+
+    def start(self, pull: Pull, channels: int, sample_rate: int, bit_depth: int):
+        import pyaudio
+
+        def callback(in_data, frame_count, time_info, status):
+            if status & pyaudio.paOutputUnderflow:
+                self.device_underflows += 1
+            data, finished = pull(frame_count)
+            return data, pyaudio.paComplete if finished else pyaudio.paContinue
+
+        self._pyaudio = pyaudio.PyAudio()
+        try:
+            self._stream = self._pyaudio.open(
+                format=self._pyaudio.get_format_from_width(bit_depth // 8),
+                channels=channels,
+                rate=sample_rate,
+                output=True,
+                frames_per_buffer=self.frames_per_buffer,
+                stream_callback=callback,
+            )
+        except BaseException:
+            # play() only closes sinks that started
+            self._pyaudio.terminate()
+            raise
+
+    def wait(self):
+        while self._stream.is_active():
+            time.sleep(0.05)
+
+    def close(self):
+        self._stream.close()
+        self._pyaudio.terminate()
+
+
+class NullSink(OutputSink):
+    """Discards the audio, pulling it in real time like a device would.
+
+    Args:
+        frames_per_buffer (int): Frames pulled at once.
+        speed (float): How much faster than real time to run, for benchmarks.
+    """
+
+    def __init__(self, frames_per_buffer: int = BUFFER_SIZE, speed: float = 1.0):
+        super().__init__(frames_per_buffer)
+        self.speed = speed
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def consume(self, data: bytes):
+        pass
+
+    def start(self, pull: Pull, channels: int, sample_rate: int, bit_depth: int):
+        period = self.frames_per_buffer / sample_rate / self.speed
+        self._thread = threading.Thread(target=self._run, args=(pull, period), name="playback", daemon=True)
+        self._thread.start()
+
+    def _run(self, pull: Pull, period: float):
+        deadline = time.monotonic()
+        while not self._stopped.is_set():
+            data, finished = pull(self.frames_per_buffer)
+            self.consume(data)
+            if finished:
+                return
+            deadline += period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self._stopped.wait(delay)
+            elif delay < -period:
+                # A whole buffer late: a device would have played silence
+                self.device_underflows += 1
+                deadline = time.monotonic()
+
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+
+    def close(self):
+        self._stopped.set()
+        self.wait()
+
+
+class FileSink(NullSink):
+    """Writes what would be played, silences included, to a WAVE file."""
+
+    def __init__(self, output_file_path: Path, frames_per_buffer: int = BUFFER_SIZE, speed: float = 1.0):
+        super().__init__(frames_per_buffer, speed)
+        self.output_file_path = Path(output_file_path)
+        self._recorder: WaveRecorder | None = None
+
+    def start(self, pull: Pull, channels: int, sample_rate: int, bit_depth: int):
+        self._recorder = WaveRecorder(self.output_file_path, channels, sample_rate, bit_depth, block_when_full=True)
+        super().start(pull, channels, sample_rate, bit_depth)
+
+    def consume(self, data: bytes):
+        self._recorder.write(data)
+
+    def close(self):
+        super().close()
+        if self._recorder is not None:
+            self._recorder.close()
+
+
+def create_sink(kind: str = PLAYBACK_SINK, frames_per_buffer: int = BUFFER_SIZE) -> OutputSink:
+    """The sink named by `PLAYBACK_SINK`: "pyaudio", "null" or "file"."""
+    if kind == "pyaudio":
+        return PyAudioSink(frames_per_buffer)
+    if kind == "null":
+        return NullSink(frames_per_buffer)
+    if kind == "file":
+        return FileSink(Path(PLAYBACK_FILE_PATH), frames_per_buffer)
+    raise ValueError(f"Unknown playback sink {kind!r}")
+
+
+async def play(
+    buffers: Iterable[bytes] | AsyncIterable[bytes],
+    sink: OutputSink,
+    channels: int,
+    sample_rate: int,
+    bit_depth: int,
+    jitter_buffer: JitterBuffer | None = None,
+    on_buffer: Callable[[bytes], None] | None = None,
+) -> PlaybackStats:
+    """Play a stream of PCM buffers through a jitter buffer until it ends.
+
+    Args:
+        buffers (Iterable[bytes] | AsyncIterable[bytes]): The PCM. Blocking
+            iterators are consumed in a worker thread.
+        sink (OutputSink): Where the audio goes; closed when done.
+        channels (int): Number of channels.
+        sample_rate (int): Frames per second.
+        bit_depth (int): Bits per sample.
+        jitter_buffer (JitterBuffer | None): A configured buffer, if not the default one.
+        on_buffer (Callable[[bytes], None] | None): Called with every buffer as it arrives.
+    """
+    jitter_buffer = jitter_buffer or JitterBuffer(channels, sample_rate, bit_depth)
+    if not isinstance(buffers, AsyncIterable):
+        blocking_buffers = buffers
+        buffers = iterate_off_loop(lambda: blocking_buffers)
+    loop = asyncio.get_running_loop()
+    room = asyncio.Event()
+
+    def pull(frames: int) -> tuple[bytes, bool]:
+        result = jitter_buffer.read(frames)
+        loop.call_soon_threadsafe(room.set)
+        return result
+
+    sink.start(pull, channels, sample_rate, bit_depth)
+    try:
+        iterator = aiter(buffers)
+        first = True
+        while True:
+            while jitter_buffer.depth >= jitter_buffer.max_depth:
+                room.clear()
+                await room.wait()
+            started = jitter_buffer.clock()
+            try:
+                buffer = await anext(iterator)
+            except StopAsyncIteration:
+                break
+            jitter_buffer.write(buffer, None if first else jitter_buffer.clock() - started)
+            first = False
+            if on_buffer is not None:
+                on_buffer(buffer)
+        jitter_buffer.end()
+        await asyncio.to_thread(sink.wait)
+    finally:
+        sink.close()
+    jitter_buffer.stats.device_underflows = sink.device_underflows
+    return jitter_buffer.stats
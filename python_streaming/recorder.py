@@ -0,0 +1,200 @@
+"""Recording of a PCM stream to WAVE files, off the playback thread.
+
+The playback side only copies each buffer into a preallocated ring buffer.
+A writer thread drains it in large blocks, aligned to whole frames, into a
+file whose RIFF header is written up front with placeholder sizes and
+patched on close. Long recordings can be split into fixed-length segments.
+"""
+from pathlib import Path
+import struct
+import threading
+
+from python_streaming.config import RECORDER_BLOCK_SIZE, RECORDER_RING_SIZE
+
+
+WAVE_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+WAVE_FORMAT_PCM = 0x0001
+
+
+def wave_header(channels: int, sample_rate: int, bit_depth: int, data_size: int) -> bytes:
+    block_align = channels * bit_depth // 8
+    return WAVE_HEADER.pack(
+        b"RIFF", 36 + data_size + data_size % 2, b"WAVE",
+        b"fmt ", 16, WAVE_FORMAT_PCM, channels, sample_rate,
+        sample_rate * block_align, block_align, bit_depth,
+        b"data", data_size,
+    )
+
+
+class RingBuffer:
+    """Fixed-size byte FIFO shared by one producer and one consumer thread."""
+
+    def __init__(self, capacity: int):
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self.capacity = capacity
+        self._start = 0
+        self._size = 0
+        self.closed = False
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def write(self, data: bytes, block: bool = False) -> bool:
+        """Append `data` whole. Returns False (writing nothing) if it doesn't fit
+        and `block` is False."""
+        data = memoryview(data).cast("B")
+        if len(data) > self.capacity:
+            raise ValueError(f"Can't write {len(data)} bytes to a {self.capacity}-byte ring")
+        with self._condition:
+            while self.capacity - self._size < len(data):
+                if not block or self.closed:
+                    return False
+                self._condition.wait()
+            end = (self._start + self._size) % self.capacity
+            first_part = min(len(data), self.capacity - end)
+            self._view[end:end + first_part] = data[:first_part]
+            self._view[:len(data) - first_part] = data[first_part:]
+            self._size += len(data)
+            self._condition.notify_all()
+        return True
+
+    def read(self, min_size: int, multiple_of: int = 1) -> bytes | None:
+        """Wait for at least `min_size` bytes (or closing) and take as many
+        as available, rounded down to `multiple_of`. None once closed and empty."""
+        with self._condition:
+            while self._size < min_size and not self.closed:
+                self._condition.wait()
+            size = self._size if self.closed else self._size - self._size % multiple_of
+            if size == 0:
+                return None if self.closed else b""
+            first_part = min(size, self.capacity - self._start)
+            data = bytes(self._view[self._start:self._start + first_part])
+            if first_part < size:
+                data += self._view[:size - first_part]
+            self._start = (self._start + size) % self.capacity
+            self._size -= size
+            self._condition.notify_all()
+            return data
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class WaveRecorder:
+    """Writes a PCM stream to WAVE file(s) from a background thread.
+
+    Args:
+        output_file_path (Path): The file to write. With segments, `_0001`,
+            `_0002`... are appended to its stem.
+        channels (int): Number of channels.
+        sample_rate (int): Frames per second.
+        bit_depth (int): Bits per sample.
+        block_size (int): Bytes written to disk at once (rounded to frames).
+        ring_size (int): Bytes the playback side can get ahead of the disk.
+        segment_seconds (float | None): Start a new file every this many seconds.
+        block_when_full (bool): Make `write` wait for room instead of dropping
+            the buffer when the disk can't keep up.
+    """
+
+    def __init__(
+        self,
+        output_file_path: Path,
+        channels: int,
+        sample_rate: int,
+        bit_depth: int,
+        block_size: int = RECORDER_BLOCK_SIZE,
+        ring_size: int = RECORDER_RING_SIZE,
+        segment_seconds: float | None = None,
+        block_when_full: bool = False,
+    ):
+        self.output_file_path = Path(output_file_path)
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.bit_depth = bit_depth
+        self.block_align = channels * bit_depth // 8
+        self.block_size = max(block_size - block_size % self.block_align, self.block_align)
+        self.segment_size = (
+            int(segment_seconds * sample_rate) * self.block_align if segment_seconds else None
+        )
+        if self.segment_size is not None and self.segment_size < self.block_align:
+            raise ValueError(f"Segments of {segment_seconds} s are shorter than a frame at {sample_rate} Hz")
+        self.block_when_full = block_when_full
+        self.dropped_bytes = 0
+        self.segment_paths: list[Path] = []
+        self._ring = RingBuffer(max(ring_size, 2 * self.block_size))
+        self._file = None
+        self._data_size = 0
+        self._error: BaseException | None = None
+        self._writer = threading.Thread(target=self._write_blocks, name="wave-recorder", daemon=True)
+        self._writer.start()
+
+    def __enter__(self) -> "WaveRecorder":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, data: bytes):
+        """Queue a buffer for writing. Never touches the disk."""
+        if self._error is not None:
+            raise self._error
+        if not self._ring.write(data, block=self.block_when_full):
+            self.dropped_bytes += len(data)
+
+    def close(self):
+        """Flush what's left, patch the header(s) and wait for the writer."""
+        self._ring.close()
+        self._writer.join()
+        if self._error is not None:
+            raise self._error
+
+    def _segment_path(self) -> Path:
+        if self.segment_size is None:
+            return self.output_file_path
+        path = self.output_file_path
+        return path.with_name(f"{path.stem}_{len(self.segment_paths) + 1:04d}{path.suffix}")
+
+    def _open_segment(self):
+        path = self._segment_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, "wb")
+        self._file.write(wave_header(self.channels, self.sample_rate, self.bit_depth, 0))
+        self._data_size = 0
+        self.segment_paths.append(path)
+
+    def _close_segment(self):
+        if self._data_size % 2:
+            # RIFF chunks are word-aligned
+            self._file.write(b"\x00")
+        self._file.seek(0)
+        self._file.write(wave_header(self.channels, self.sample_rate, self.bit_depth, self._data_size))
+        self._file.close()
+        self._file = None
+
+    def _write_blocks(self):
+        try:
+            while (block := self._ring.read(self.block_size, self.block_align)) is not None:
+                view = memoryview(block)
+                while len(view):
+                    if self._file is None:
+                        self._open_segment()
+                    room = len(view)
+                    if self.segment_size is not None:
+                        room = min(room, self.segment_size - self._data_size)
+                    self._file.write(view[:room])
+                    self._data_size += room
+                    view = view[room:]
+                    if self.segment_size is not None and self._data_size >= self.segment_size:
+                        self._close_segment()
+            if self._file is None and not self.segment_paths:
+                # Leave a valid, empty file rather than none at all
+                self._open_segment()
+            if self._file is not None:
+                self._close_segment()
+        except BaseException as e:
+            self._error = e
+            self._ring.close()
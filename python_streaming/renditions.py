@@ -0,0 +1,94 @@
+"""On-disk cache of transformed renditions of catalog audio.
+
+A rendition is the whole source file run through an `AudioTransformer` and
+saved as a plain PCM WAVE file, named after a hash of the source's identity
+(ID, mtime and size) and of the spec. Once built it's served exactly like a
+catalog file. The least recently used renditions are deleted when the cache
+grows past its size limit.
+"""
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+
+from python_streaming.audio_transforms import AudioTransformer, RenditionSpec
+from python_streaming.catalog import AudioEntry, ensure_unchanged, read_audio_entry
+from python_streaming.config import FILE_CHUNK_SIZE, RENDITION_CACHE_DIRECTORY, RENDITION_CACHE_MAX_BYTES
+from python_streaming.disk_cache import DiskCache
+from python_streaming.recorder import wave_header
+
+
+logger = logging.getLogger(__name__)
+
+
+class RenditionCache(DiskCache):
+    """Builds renditions on demand and keeps them on disk.
+
+    Args:
+        directory (Path): Where renditions are stored.
+        max_bytes (int): Total size above which old renditions are evicted.
+    """
+
+    def __init__(
+        self,
+        directory: Path = Path(RENDITION_CACHE_DIRECTORY),
+        max_bytes: int = RENDITION_CACHE_MAX_BYTES,
+    ):
+        super().__init__(directory, max_bytes, "*.wav")
+        self._entries: dict[Path, AudioEntry] = {}
+
+    def path_for(self, audio: AudioEntry, spec: RenditionSpec) -> Path:
+        identity = f"{audio.audio_id}|{audio.mtime_ns}|{audio.file_size}|{spec.label}"
+        return self.directory / f"{hashlib.sha256(identity.encode('utf-8')).hexdigest()[:32]}.wav"
+
+    async def get(self, audio: AudioEntry, spec: RenditionSpec) -> AudioEntry | None:
+        """The cached rendition, if it has been built already, looked up in a
+        worker thread."""
+        return await asyncio.to_thread(self.lookup, audio, spec)
+
+    def lookup(self, audio: AudioEntry, spec: RenditionSpec) -> AudioEntry | None:
+        path = self.path_for(audio, spec)
+        if (entry := self._entries.get(path)) is not None and self.touch(path, entry.mtime_ns):
+            return entry
+        self._entries.pop(path, None)
+        if path.exists():
+            entry = read_audio_entry(f"{audio.audio_id}@{spec.label}", path)
+            self._entries[path] = entry
+            return entry
+        return None
+
+    async def get_or_build(self, audio: AudioEntry, spec: RenditionSpec) -> AudioEntry:
+        """The rendition, building it in a worker thread if needed. Concurrent
+        requests for the same rendition wait for a single build."""
+        return await self.single_flight(
+            self.path_for(audio, spec), lambda: self.lookup(audio, spec) or self.build(audio, spec)
+        )
+
+    def build(self, audio: AudioEntry, spec: RenditionSpec) -> AudioEntry:
+        path = self.path_for(audio, spec)
+        transformer = AudioTransformer(audio, spec)
+        data_size = 0
+        with open(audio.path, "rb") as source, self.writing(path) as rendition:
+            # The offsets come from the entry, and the name from its identity
+            ensure_unchanged(audio, source.fileno())
+            rendition.write(wave_header(transformer.channels, transformer.sample_rate, transformer.bit_depth, 0))
+            source.seek(audio.data_offset)
+            remaining = audio.data_size
+            while remaining > 0 and (chunk := source.read(min(FILE_CHUNK_SIZE * 4, remaining))):
+                remaining -= len(chunk)
+                data_size += rendition.write(transformer.process(chunk))
+            data_size += rendition.write(transformer.flush())
+            if data_size % 2:
+                rendition.write(b"\x00")
+            rendition.seek(0)
+            rendition.write(
+                wave_header(transformer.channels, transformer.sample_rate, transformer.bit_depth, data_size)
+            )
+        logger.info("Built rendition %s of %s (%d bytes)", spec.label, audio.audio_id, data_size)
+
+        entry = read_audio_entry(f"{audio.audio_id}@{spec.label}", path)
+        self._entries[path] = entry
+        return entry
+
+    def evicted(self, path: Path):
+        self._entries.pop(path, None)
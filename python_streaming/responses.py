@@ -0,0 +1,72 @@
+"""Starlette responses shared by the streaming endpoints."""
+import os
+from pathlib import Path
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from python_streaming.config import FILE_CHUNK_SIZE, USE_SENDFILE
+from python_streaming.util import iterate_file_chunks
+
+
+ZERO_COPY_SEND_EXTENSION = "http.response.zerocopysend"
+
+
+class FileChunksResponse(StreamingResponse):
+    """Stream (a slice of) a file from an async chunked source.
+
+    When `use_sendfile` is set and the ASGI server advertises the zero-copy
+    send extension, the body is handed to the server as a file descriptor
+    instead, so it goes from the page cache to the socket with sendfile(2).
+
+    Args:
+        path (Path | str): The file to serve.
+        offset (int): Byte position of the first byte to send.
+        length (int | None): Number of bytes to send, or None to send to EOF.
+        chunk_size (int): Size of the chunks read when not using sendfile.
+        use_sendfile (bool): Opt into the zero-copy path when available.
+    """
+
+    def __init__(
+        self,
+        path: Path | str,
+        status_code: int = 200,
+        headers: dict[str, str] | None = None,
+        media_type: str | None = None,
+        offset: int = 0,
+        length: int | None = None,
+        chunk_size: int = FILE_CHUNK_SIZE,
+        use_sendfile: bool = USE_SENDFILE,
+    ):
+        self.path = path
+        self.offset = offset
+        self.length = length if length is not None else os.stat(path).st_size - offset
+        self.use_sendfile = use_sendfile
+        headers = {**(headers or {}), "Content-Length": str(self.length)}
+        super().__init__(
+            iterate_file_chunks(path, chunk_size, offset, self.length),
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not (self.use_sendfile and ZERO_COPY_SEND_EXTENSION in scope.get("extensions", {})):
+            await super().__call__(scope, receive, send)
+            return
+
+        # The chunked source won't be used: close it before it opens the file
+        await self.body_iterator.aclose()
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        with open(self.path, "rb") as file:
+            await send({
+                "type": ZERO_COPY_SEND_EXTENSION,
+                "file": file,
+                "offset": self.offset,
+                "count": self.length,
+                "more_body": False,
+            })
@@ -0,0 +1,236 @@
+"""Server-Sent Events streams that a client can resume after a disconnect.
+
+A stream's generation runs in its own task, not in the HTTP response, and
+its text chunks are kept in a bounded ring buffer. Every chunk is sent as an
+SSE event whose ID is `<stream id>:<sequence number>`, so that a client
+reconnecting with `Last-Event-ID` (as `EventSource` does by itself) gets the
+events it missed from the buffer and then follows the generation live,
+without it being started again.
+
+A stream outlives its last connection by `ttl` seconds: the generation
+carries on meanwhile, and is cancelled if nobody came back for it. Streams
+live in the memory of one process, so resuming needs the same worker.
+
+The end of a stream is an `end` event, and a failure an `error` event. A
+client resuming a stream it has fully received gets a 204, which tells
+`EventSource` to stop reconnecting.
+"""
+import asyncio
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+import re
+import secrets
+import time
+from typing import AsyncIterator, Callable
+
+from python_streaming.config import (
+    CHAT_RESUME_MAX_EVENTS,
+    CHAT_RESUME_MAX_STREAMS,
+    CHAT_RESUME_TTL,
+    CHAT_SSE_RETRY_MILLISECONDS,
+)
+
+
+SSE_MEDIA_TYPE = "text/event-stream"
+LINE_BREAK = re.compile(r"\r\n|\r|\n")
+
+
+class StreamGone(LookupError):
+    """The stream, or the events after the given ID, are no longer buffered."""
+
+
+def format_event(data: str, event_id: str | None = None, event: str | None = None) -> bytes:
+    """One SSE event. Line breaks in `data` survive as "\\n"."""
+    lines = []
+    if event is not None:
+        lines.append(f"event: {event}")
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.extend(f"data: {line}" for line in LINE_BREAK.split(data))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+def parse_event_id(event_id: str) -> tuple[str, int] | None:
+    """The (stream id, sequence number) of an event ID, if it's one of ours."""
+    stream_id, _, sequence = event_id.strip().rpartition(":")
+    if not stream_id or not sequence.isdigit():
+        return None
+    return stream_id, int(sequence)
+
+
+class ResumableStream:
+    """The events of one generation, the last `max_events` of them buffered."""
+
+    def __init__(self, stream_id: str, max_events: int):
+        self.stream_id = stream_id
+        self.events: deque[str] = deque(maxlen=max_events)
+        # Sequence numbers of the first buffered event and of the next one
+        self.first_sequence = 0
+        self.next_sequence = 0
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self.task: asyncio.Task | None = None
+        self.expires_at: float | None = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _append(self, text: str):
+        if len(self.events) == self.events.maxlen:
+            self.first_sequence += 1
+        self.events.append(text)
+        self.next_sequence += 1
+        self._notify()
+
+    async def produce(self, create_chunks: Callable[[], AsyncIterator[str]]):
+        chunks = None
+        try:
+            chunks = create_chunks()
+            async for text in chunks:
+                self._append(text)
+        except asyncio.CancelledError:
+            self.error = ConnectionAbortedError("The stream was abandoned")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            if chunks is not None and hasattr(chunks, "aclose"):
+                await chunks.aclose()
+            self.done = True
+            self._notify()
+
+    async def follow(self, after: int) -> AsyncIterator[bytes]:
+        """The events after sequence number `after` (-1 for all of them),
+        then the live ones, then the end or error event."""
+        position = after + 1
+        while True:
+            changed = self._changed
+            while position < self.next_sequence:
+                if position < self.first_sequence:
+                    # This subscriber lagged further behind than the buffer holds
+                    raise StreamGone(f"Events of {self.stream_id} from {position} are no longer buffered")
+                text = self.events[position - self.first_sequence]
+                yield format_event(text, f"{self.stream_id}:{position}")
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    yield format_event(str(self.error) or type(self.error).__name__, event="error")
+                else:
+                    yield format_event("", f"{self.stream_id}:{self.next_sequence}", event="end")
+                return
+            await changed.wait()
+
+
+@dataclass
+class ResumableStreamStats:
+    started: int = 0
+    resumed: int = 0
+    # Events sent again from the buffer to resuming clients
+    replayed_events: int = 0
+    expired: int = 0
+    streams: int = 0
+
+
+class ResumableStreams:
+    """The resumable streams of a process.
+
+    Args:
+        ttl (float): Seconds a stream is kept after its last connection ended.
+        max_events (int): Events buffered per stream.
+        max_streams (int): Streams kept; the oldest are dropped beyond that.
+        retry_milliseconds (int): Reconnection delay suggested to clients.
+    """
+
+    def __init__(
+        self,
+        ttl: float = CHAT_RESUME_TTL,
+        max_events: int = CHAT_RESUME_MAX_EVENTS,
+        max_streams: int = CHAT_RESUME_MAX_STREAMS,
+        retry_milliseconds: int = CHAT_SSE_RETRY_MILLISECONDS,
+    ):
+        self.ttl = ttl
+        self.max_events = max_events
+        self.max_streams = max_streams
+        self.retry_milliseconds = retry_milliseconds
+        self.stats = ResumableStreamStats()
+        self._streams: OrderedDict[str, ResumableStream] = OrderedDict()
+
+    @staticmethod
+    def new_id() -> str:
+        return secrets.token_urlsafe(12)
+
+    def _drop(self, stream_id: str):
+        stream = self._streams.pop(stream_id)
+        if stream.task is not None and not stream.task.done():
+            stream.task.cancel()
+        self.stats.streams -= 1
+
+    @staticmethod
+    def _expired(stream: ResumableStream, now: float) -> bool:
+        return stream.subscribers == 0 and stream.expires_at is not None and stream.expires_at <= now
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [stream_id for stream_id, stream in self._streams.items() if self._expired(stream, now)]
+        for stream_id in expired:
+            self._drop(stream_id)
+            self.stats.expired += 1
+
+    def get(self, stream_id: str) -> ResumableStream | None:
+        self._expire()
+        return self._streams.get(stream_id)
+
+    def resume_status(self, stream_id: str, after: int) -> int:
+        """The HTTP status of a resumption after sequence number `after`:
+        200, 204 if there's nothing left to send, 404 if the stream is
+        unknown or expired, 410 if the next events are no longer buffered.
+
+        Only reads, so that it can be called from any thread (e.g. a WSGI view).
+        """
+        stream = self._streams.get(stream_id)
+        if stream is None or self._expired(stream, time.monotonic()):
+            return 404
+        if stream.done and stream.error is None and after >= stream.next_sequence:
+            return 204
+        if after + 1 < stream.first_sequence:
+            return 410
+        return 200
+
+    async def start(self, stream_id: str, create_chunks: Callable[[], AsyncIterator[str]]) -> AsyncIterator[bytes]:
+        """Start generating a new stream and follow it from the beginning."""
+        self._expire()
+        stream = ResumableStream(stream_id, self.max_events)
+        self._streams[stream_id] = stream
+        self.stats.started += 1
+        self.stats.streams += 1
+        while len(self._streams) > self.max_streams:
+            self._drop(next(iter(self._streams)))
+        stream.task = asyncio.create_task(stream.produce(create_chunks))
+        async for event in self._subscribe(stream, -1):
+            yield event
+
+    async def resume(self, stream_id: str, after: int) -> AsyncIterator[bytes]:
+        """Follow a stream from the event after sequence number `after`."""
+        if (stream := self.get(stream_id)) is None:
+            raise StreamGone(f"Stream {stream_id} is unknown or expired")
+        self.stats.resumed += 1
+        self.stats.replayed_events += max(stream.next_sequence - (after + 1), 0)
+        async for event in self._subscribe(stream, after):
+            yield event
+
+    async def _subscribe(self, stream: ResumableStream, after: int) -> AsyncIterator[bytes]:
+        yield f"retry: {self.retry_milliseconds}\n\n".encode("utf-8")
+        stream.subscribers += 1
+        stream.expires_at = None
+        try:
+            async for event in stream.follow(after):
+                yield event
+        finally:
+            stream.subscribers -= 1
+            if stream.subscribers == 0:
+                stream.expires_at = time.monotonic() + self.ttl
+                # Not only on the next request: an abandoned generation must stop
+                asyncio.get_running_loop().call_later(self.ttl, self._expire)
@@ -0,0 +1,260 @@
+"""Media served from S3 with parallel ranged GETs.
+
+An object is split into blocks that are fetched concurrently, each with its
+own `Range` GET, and handed back in order. Blocks are fetched at most
+`blocks_in_flight` ahead of the consumer: that bounds both the requests a
+download keeps open and the memory it holds while waiting for a slow block
+(the reorder buffer). Block sizes adapt to the measured throughput: the first
+block is small, so the first bytes arrive quickly, and the following ones
+grow until each takes about `S3_BLOCK_TARGET_SECONDS`.
+
+Every block is requested with `If-Match` on the object's ETag, so an object
+replaced mid-download fails the download instead of mixing two versions.
+Failures raise `S3DownloadError` from the iterator.
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import cycle
+import threading
+import time
+from typing import AsyncIterator, Callable, Iterator
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from python_streaming.config import (
+    FILE_CHUNK_SIZE,
+    S3_BLOCK_TARGET_SECONDS,
+    S3_BLOCKS_IN_FLIGHT,
+    S3_CLIENT_POOL_SIZE,
+    S3_ENDPOINT_URL,
+    S3_MAX_BLOCK_SIZE,
+    S3_MAX_CONCURRENCY,
+    S3_MIN_BLOCK_SIZE,
+)
+
+
+class S3DownloadError(IOError):
+    """An object (or one of its blocks) couldn't be downloaded."""
+
+
+class S3ObjectNotFound(S3DownloadError, FileNotFoundError):
+    pass
+
+
+class S3ClientPool:
+    """A fixed set of S3 clients, created lazily and handed out round-robin.
+
+    Args:
+        size (int): Number of clients.
+        max_pool_connections (int): Connections kept alive by each client.
+        endpoint_url (str | None): An S3-compatible server instead of AWS.
+    """
+
+    def __init__(
+        self,
+        size: int = S3_CLIENT_POOL_SIZE,
+        max_pool_connections: int = S3_MAX_CONCURRENCY,
+        endpoint_url: str | None = S3_ENDPOINT_URL,
+    ):
+        self.size = size
+        self.max_pool_connections = max_pool_connections
+        self.endpoint_url = endpoint_url
+        self._clients = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._clients is None:
+                config = Config(
+                    max_pool_connections=self.max_pool_connections,
+                    retries={"max_attempts": 3, "mode": "standard"},
+                    # Stand-ins are addressed by host and port, buckets can't be subdomains
+                    s3={"addressing_style": "path"} if self.endpoint_url else None,
+                )
+                # boto3.client() isn't thread-safe on the default session
+                session = boto3.session.Session()
+                self._clients = cycle([
+                    session.client("s3", endpoint_url=self.endpoint_url, config=config)
+                    for _ in range(self.size)
+                ])
+            return next(self._clients)
+
+
+@dataclass(frozen=True)
+class S3Object:
+    bucket: str
+    key: str
+    size: int
+    etag: str
+    last_modified: datetime
+    content_type: str | None = None
+
+
+class AdaptiveBlockSize:
+    """Block size aiming at blocks that take `target_seconds` to download.
+
+    It at most doubles or halves per observation, within the bounds.
+    """
+
+    def __init__(
+        self,
+        minimum: int = S3_MIN_BLOCK_SIZE,
+        maximum: int = S3_MAX_BLOCK_SIZE,
+        target_seconds: float = S3_BLOCK_TARGET_SECONDS,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.size = minimum
+
+    def observe(self, size: int, seconds: float):
+        ideal = size / seconds * self.target_seconds if seconds > 0 else self.maximum
+        self.size = int(max(self.minimum, min(self.maximum, self.size * 2, max(ideal, self.size / 2))))
+
+
+class S3Downloader:
+    """Parallel ranged downloads of S3 objects.
+
+    Args:
+        client_pool (S3ClientPool): Where clients come from.
+        executor (ThreadPoolExecutor): Runs the GETs of every download.
+        blocks_in_flight (int): Blocks fetched ahead of the consumer, per download.
+        create_block_size (Callable[[], AdaptiveBlockSize]): Block sizing, per download.
+    """
+
+    def __init__(
+        self,
+        client_pool: S3ClientPool,
+        executor: ThreadPoolExecutor,
+        blocks_in_flight: int = S3_BLOCKS_IN_FLIGHT,
+        create_block_size: Callable[[], AdaptiveBlockSize] = AdaptiveBlockSize,
+    ):
+        self.client_pool = client_pool
+        self.executor = executor
+        self.blocks_in_flight = blocks_in_flight
+        self.create_block_size = create_block_size
+
+    def head(self, bucket: str, key: str) -> S3Object:
+        try:
+            response = self.client_pool.get().head_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise S3ObjectNotFound(f"s3://{bucket}/{key} doesn't exist") from e
+            raise S3DownloadError(f"Can't read s3://{bucket}/{key}: {e}") from e
+        except BotoCoreError as e:
+            raise S3DownloadError(f"Can't read s3://{bucket}/{key}: {e}") from e
+        return S3Object(
+            bucket=bucket,
+            key=key,
+            size=response["ContentLength"],
+            etag=response["ETag"],
+            last_modified=response["LastModified"],
+            content_type=response.get("ContentType"),
+        )
+
+    def _get_block(self, s3_object: S3Object, start: int, size: int, block_size: AdaptiveBlockSize) -> bytes:
+        started = time.perf_counter()
+        try:
+            response = self.client_pool.get().get_object(
+                Bucket=s3_object.bucket,
+                Key=s3_object.key,
+                Range=f"bytes={start}-{start + size - 1}",
+                IfMatch=s3_object.etag,
+            )
+            with response["Body"] as body:
+                block = body.read()
+        except (BotoCoreError, ClientError) as e:
+            raise S3DownloadError(
+                f"Can't read bytes {start}-{start + size - 1} of s3://{s3_object.bucket}/{s3_object.key}: {e}"
+            ) from e
+        if len(block) != size:
+            raise S3DownloadError(
+                f"Got {len(block)} bytes instead of {size} at {start} of s3://{s3_object.bucket}/{s3_object.key}"
+            )
+        block_size.observe(size, time.perf_counter() - started)
+        return block
+
+    def _schedule(self, s3_object: S3Object, pending: deque, position: int, end: int,
+                  block_size: AdaptiveBlockSize) -> int:
+        """Start blocks until `blocks_in_flight` are pending; return the new position."""
+        while position < end and len(pending) < self.blocks_in_flight:
+            size = min(block_size.size, end - position)
+            pending.append(self.executor.submit(self._get_block, s3_object, position, size, block_size))
+            position += size
+        return position
+
+    def _range(self, s3_object: S3Object, offset: int, length: int | None) -> tuple[int, int]:
+        end = s3_object.size if length is None else min(offset + length, s3_object.size)
+        return offset, end
+
+    @staticmethod
+    def _slices(block: bytes, chunk_size: int) -> Iterator[memoryview]:
+        view = memoryview(block)
+        for start in range(0, len(view), chunk_size):
+            yield view[start:start + chunk_size]
+
+    def iterate(
+        self,
+        s3_object: S3Object,
+        offset: int = 0,
+        length: int | None = None,
+        chunk_size: int = FILE_CHUNK_SIZE,
+    ) -> Iterator[memoryview]:
+        """Yield the object's bytes (from `offset`, `length` of them) in order,
+        in chunks of at most `chunk_size`. Blocking."""
+        position, end = self._range(s3_object, offset, length)
+        block_size = self.create_block_size()
+        pending: deque[Future] = deque()
+        try:
+            position = self._schedule(s3_object, pending, position, end, block_size)
+            while pending:
+                block = pending.popleft().result()
+                position = self._schedule(s3_object, pending, position, end, block_size)
+                yield from self._slices(block, chunk_size)
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def iterate_async(
+        self,
+        s3_object: S3Object,
+        offset: int = 0,
+        length: int | None = None,
+        chunk_size: int = FILE_CHUNK_SIZE,
+    ) -> AsyncIterator[memoryview]:
+        """`iterate` for the event loop: GETs run in the executor."""
+        position, end = self._range(s3_object, offset, length)
+        block_size = self.create_block_size()
+        pending: deque[Future] = deque()
+        try:
+            position = self._schedule(s3_object, pending, position, end, block_size)
+            while pending:
+                block = await asyncio.wrap_future(pending[0])
+                pending.popleft()
+                position = self._schedule(s3_object, pending, position, end, block_size)
+                for chunk in self._slices(block, chunk_size):
+                    yield chunk
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def open_async(
+        self,
+        bucket: str,
+        key: str,
+        offset: int = 0,
+        chunk_size: int = FILE_CHUNK_SIZE,
+    ) -> AsyncIterator[memoryview]:
+        """The object from `offset` to its end, looked up without blocking the loop."""
+        s3_object = await asyncio.get_running_loop().run_in_executor(self.executor, self.head, bucket, key)
+        async for chunk in self.iterate_async(s3_object, offset, chunk_size=chunk_size):
+            yield chunk
+
+
+s3_executor = ThreadPoolExecutor(max_workers=S3_MAX_CONCURRENCY, thread_name_prefix="s3")
+s3_downloader = S3Downloader(S3ClientPool(), s3_executor)
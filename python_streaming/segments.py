@@ -0,0 +1,156 @@
+"""Catalog audio cut into fixed-duration segments, listed by an HLS-style
+playlist.
+
+Every segment is a small WAVE file of its own, built once (ahead of time with
+`python -m python_streaming.segments`, or on its first request) and then
+served as a static file. Segments are content-addressed: the name is a hash
+of what determines their bytes (the source's ID, mtime and size, the
+segment duration and the segment's index), so a segment URL always denotes
+the same bytes and can be cached forever, by clients and reverse proxies
+alike. When the source changes, so do the names in its playlist.
+
+The least recently used segments are deleted when the cache grows past its
+size limit.
+"""
+import argparse
+import hashlib
+import logging
+from math import ceil
+import os
+from pathlib import Path
+
+from python_streaming.catalog import AudioCatalog, AudioEntry, ensure_unchanged
+from python_streaming.config import (
+    CATALOG_INDEX_PATH,
+    MEDIA_DIRECTORY,
+    SEGMENT_CACHE_DIRECTORY,
+    SEGMENT_CACHE_MAX_BYTES,
+    SEGMENT_DURATION,
+)
+from python_streaming.disk_cache import DiskCache
+from python_streaming.recorder import wave_header
+
+
+logger = logging.getLogger(__name__)
+
+PLAYLIST_MEDIA_TYPE = "application/vnd.apple.mpegurl"
+
+
+class SegmentCache(DiskCache):
+    """Builds segments on demand and keeps them on disk.
+
+    Args:
+        directory (Path): Where segments are stored.
+        max_bytes (int): Total size above which old segments are evicted.
+        segment_seconds (float): Duration of every segment but the last.
+    """
+
+    def __init__(
+        self,
+        directory: Path = Path(SEGMENT_CACHE_DIRECTORY),
+        max_bytes: int = SEGMENT_CACHE_MAX_BYTES,
+        segment_seconds: float = SEGMENT_DURATION,
+    ):
+        super().__init__(directory, max_bytes, "*/*.wav")
+        self.segment_seconds = segment_seconds
+
+    def frames_per_segment(self, audio: AudioEntry) -> int:
+        return max(round(self.segment_seconds * audio.sample_rate), 1)
+
+    def segment_count(self, audio: AudioEntry) -> int:
+        return ceil(audio.frames / self.frames_per_segment(audio))
+
+    def segment_frames(self, audio: AudioEntry, index: int) -> tuple[int, int]:
+        """The (start, end) frames of a segment."""
+        start = index * self.frames_per_segment(audio)
+        return start, min(start + self.frames_per_segment(audio), audio.frames)
+
+    def key_for(self, audio: AudioEntry, index: int) -> str:
+        identity = f"{audio.audio_id}|{audio.mtime_ns}|{audio.file_size}|{self.segment_seconds:g}|{index}"
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:32]
+
+    def path_for(self, key: str) -> Path:
+        # Fanned out, so that no directory holds every segment
+        return self.directory / key[:2] / f"{key}.wav"
+
+    def playlist_version(self, audio: AudioEntry) -> str:
+        identity = f"{audio.audio_id}|{audio.mtime_ns}|{audio.file_size}|{self.segment_seconds:g}"
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:32]
+
+    def playlist(self, audio: AudioEntry) -> str:
+        """An HLS media playlist of the audio's segments, with URIs relative
+        to the playlist (`{index}.{key}.wav`)."""
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{ceil(self.segment_seconds)}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:VOD",
+            "#EXT-X-INDEPENDENT-SEGMENTS",
+        ]
+        for index in range(self.segment_count(audio)):
+            start, end = self.segment_frames(audio, index)
+            lines.append(f"#EXTINF:{(end - start) / audio.sample_rate:.6f},")
+            lines.append(f"{index}.{self.key_for(audio, index)}.wav")
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def get(self, audio: AudioEntry, index: int) -> Path | None:
+        """The cached segment, if it has been built already."""
+        path = self.path_for(self.key_for(audio, index))
+        return path if self.touch(path) else None
+
+    async def get_or_build(self, audio: AudioEntry, index: int) -> Path:
+        """The segment, building it in a worker thread if needed. Concurrent
+        requests for the same segment wait for a single build."""
+        return await self.single_flight(
+            self.path_for(self.key_for(audio, index)), lambda: self.get(audio, index) or self.build(audio, index)
+        )
+
+    def build(self, audio: AudioEntry, index: int) -> Path:
+        if not 0 <= index < self.segment_count(audio):
+            raise IndexError(f"{audio.audio_id} has no segment {index}")
+        path = self.path_for(self.key_for(audio, index))
+        start, end = self.segment_frames(audio, index)
+        start_byte, end_byte = audio.frame_to_byte(start), audio.frame_to_byte(end)
+        # With the source's mtime, a rebuilt segment keeps its ETag and Last-Modified
+        with open(audio.path, "rb") as source, self.writing(path, mtime_ns=audio.mtime_ns) as segment:
+            # The name hashes the entry's identity: other bytes must not be cached under it
+            ensure_unchanged(audio, source.fileno())
+            data = os.pread(source.fileno(), end_byte - start_byte, start_byte)
+            segment.write(wave_header(audio.channels, audio.sample_rate, audio.bit_depth, len(data)))
+            segment.write(data)
+            if len(data) % 2:
+                segment.write(b"\x00")
+        return path
+
+    def build_all(self, audio: AudioEntry) -> int:
+        """Build the audio's missing segments; return how many were built."""
+        built = 0
+        for index in range(self.segment_count(audio)):
+            if self.get(audio, index) is None:
+                self.build(audio, index)
+                built += 1
+        return built
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cut the catalog's audio into segments ahead of time.")
+    parser.add_argument("--media-directory", type=Path, default=Path(MEDIA_DIRECTORY))
+    parser.add_argument("--directory", type=Path, default=Path(SEGMENT_CACHE_DIRECTORY))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    catalog = AudioCatalog(args.media_directory, Path(CATALOG_INDEX_PATH))
+    catalog.scan()
+    segment_cache = SegmentCache(args.directory)
+    for audio in catalog:
+        if audio.format != "PCM":
+            logger.warning("Skipping %s: segments are built from PCM audio only", audio.audio_id)
+            continue
+        built = segment_cache.build_all(audio)
+        logger.info("%s: %d segments, %d built", audio.audio_id, segment_cache.segment_count(audio), built)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Audio catalog published in shared memory, for multi-process serving.
+
+The launcher scans the media directory once and packs the entries into a
+single shared memory block: a header, fixed-size records sorted by audio ID,
+and the strings they point into. Workers attach to the block by name and
+look entries up in place with a binary search, so however many workers
+there are, the metadata exists once.
+
+Media data itself is already shared: frames are served from memory maps,
+and every worker mapping the same file reads the same page cache pages.
+"""
+from multiprocessing.shared_memory import SharedMemory
+import struct
+from typing import Iterable, Iterator
+
+from python_streaming.catalog import AudioEntry
+
+
+HEADER = struct.Struct("<8sII")
+MAGIC = b"PSCATLG1"
+# Offsets and lengths of the ID, path and format strings, then the numeric fields
+RECORD = struct.Struct("<IIIIII IHHI QQqQ")
+
+
+class SharedAudioCatalog:
+    """Read-only `AudioCatalog` lookalike backed by a shared memory block.
+
+    Args:
+        shared_memory (SharedMemory): A block written by `create`.
+    """
+
+    def __init__(self, shared_memory: SharedMemory):
+        self.shared_memory = shared_memory
+        self._buffer = shared_memory.buf
+        magic, self._count, self._strings_offset = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Shared memory {shared_memory.name} doesn't hold an audio catalog")
+
+    @classmethod
+    def create(cls, entries: Iterable[AudioEntry]) -> "SharedAudioCatalog":
+        """Pack `entries` into a new block. The caller owns it and must `unlink` it."""
+        entries = sorted(entries, key=lambda entry: entry.audio_id.encode("utf-8"))
+        strings = bytearray()
+        records = bytearray()
+        for entry in entries:
+            spans = []
+            for text in (entry.audio_id, entry.path, entry.format):
+                encoded = text.encode("utf-8")
+                spans += [len(strings), len(encoded)]
+                strings += encoded
+            records += RECORD.pack(
+                *spans, entry.sample_rate, entry.channels, entry.bit_depth, entry.block_align,
+                entry.data_offset, entry.data_size, entry.mtime_ns, entry.file_size,
+            )
+        strings_offset = HEADER.size + len(records)
+        shared_memory = SharedMemory(create=True, size=max(strings_offset + len(strings), 1))
+        HEADER.pack_into(shared_memory.buf, 0, MAGIC, len(entries), strings_offset)
+        shared_memory.buf[HEADER.size:strings_offset] = records
+        shared_memory.buf[strings_offset:strings_offset + len(strings)] = strings
+        return cls(shared_memory)
+
+    @classmethod
+    def attach(cls, name: str) -> "SharedAudioCatalog":
+        return cls(SharedMemory(name=name))
+
+    @property
+    def name(self) -> str:
+        return self.shared_memory.name
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, audio_id: str) -> bool:
+        return self.get(audio_id) is not None
+
+    def __iter__(self) -> Iterator[AudioEntry]:
+        return (self._entry(index) for index in range(self._count))
+
+    def _string(self, offset: int, length: int) -> bytes:
+        start = self._strings_offset + offset
+        return bytes(self._buffer[start:start + length])
+
+    def _record(self, index: int) -> tuple:
+        return RECORD.unpack_from(self._buffer, HEADER.size + index * RECORD.size)
+
+    def _entry(self, index: int, record: tuple | None = None) -> AudioEntry:
+        (id_offset, id_length, path_offset, path_length, format_offset, format_length,
+         sample_rate, channels, bit_depth, block_align,
+         data_offset, data_size, mtime_ns, file_size) = record or self._record(index)
+        return AudioEntry(
+            audio_id=self._string(id_offset, id_length).decode("utf-8"),
+            path=self._string(path_offset, path_length).decode("utf-8"),
+            format=self._string(format_offset, format_length).decode("utf-8"),
+            sample_rate=sample_rate,
+            channels=channels,
+            bit_depth=bit_depth,
+            block_align=block_align,
+            data_offset=data_offset,
+            data_size=data_size,
+            mtime_ns=mtime_ns,
+            file_size=file_size,
+        )
+
+    def get(self, audio_id: str) -> AudioEntry | None:
+        key = audio_id.encode("utf-8")
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            record = self._record(middle)
+            candidate = self._string(record[0], record[1])
+            if candidate == key:
+                return self._entry(middle, record)
+            if candidate < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def scan(self) -> None:
+        """Nothing to do: the launcher rescans and publishes a new block on reload."""
+
+    def close(self):
+        self._buffer = None
+        self.shared_memory.close()
+
+    def unlink(self):
+        self.shared_memory.unlink()
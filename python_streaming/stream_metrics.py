@@ -0,0 +1,343 @@
+"""Per-stream metrics for the ASGI and WSGI apps, exported in the Prometheus
+text format.
+
+The middlewares wrap each response body and time its chunks as they leave
+the app: time-to-first-byte, total duration, chunk count, bytes, the longest
+gap between two chunks, and whether the client went away before the end.
+Per chunk this costs a clock read and a few additions; the histograms are
+only updated (under a lock) once per response.
+"""
+from bisect import bisect_left
+import logging
+import threading
+import time
+from typing import AsyncIterator, Callable, Iterable, Iterator
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CHUNK_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 10000, 100000)
+BYTE_BUCKETS = tuple(256 * 4 ** exponent for exponent in range(11))
+
+COMPLETED = "completed"
+DISCONNECTED = "disconnected"
+FAILED = "error"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Cumulative histogram per label set, as Prometheus expects it."""
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...], label_names: tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.label_names = label_names
+        # Label values -> [count per bucket (last one is +Inf), sum]
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, label_values: tuple[str, ...], value: float):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, label_values, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.label_names, label_values)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values: dict[tuple[str, ...], int] = {}
+
+    def increment(self, label_values: tuple[str, ...]):
+        self._values[label_values] = self._values.get(label_values, 0) + 1
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.label_names, label_values)} {value}"
+
+
+class StreamObservation:
+    """Timings of one response body, fed chunk by chunk."""
+    __slots__ = ("started", "first_chunk_at", "last_chunk_at", "chunks", "size", "longest_stall", "status")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_chunk_at: float | None = None
+        self.last_chunk_at = self.started
+        self.chunks = 0
+        self.size = 0
+        self.longest_stall = 0.0
+        self.status = 0
+
+    def chunk(self, size: int):
+        if not size:
+            return
+        now = time.perf_counter()
+        if self.first_chunk_at is None:
+            self.first_chunk_at = now
+        elif now - self.last_chunk_at > self.longest_stall:
+            self.longest_stall = now - self.last_chunk_at
+        self.last_chunk_at = now
+        self.chunks += 1
+        self.size += size
+
+
+class StreamMetrics:
+    """The histograms and counters of every streamed response, by route."""
+
+    def __init__(self, prefix: str = "http_stream"):
+        labels = ("method", "route")
+        self.ttfb = Histogram(
+            f"{prefix}_ttfb_seconds", "Time from request to first body byte.", LATENCY_BUCKETS, labels
+        )
+        self.duration = Histogram(
+            f"{prefix}_duration_seconds", "Time from request to last body byte.", LATENCY_BUCKETS, labels
+        )
+        self.longest_stall = Histogram(
+            f"{prefix}_longest_stall_seconds", "Longest gap between two body chunks.", LATENCY_BUCKETS, labels
+        )
+        self.chunks = Histogram(f"{prefix}_chunks", "Body chunks per response.", CHUNK_BUCKETS, labels)
+        self.size = Histogram(f"{prefix}_bytes", "Body bytes per response.", BYTE_BUCKETS, labels)
+        self.responses = Counter(
+            f"{prefix}_responses_total",
+            "Responses by status and outcome (completed, disconnected or error).",
+            (*labels, "status", "outcome"),
+        )
+        self._lock = threading.Lock()
+
+    def record(self, method: str, route: str, observation: StreamObservation, outcome: str):
+        labels = (method, route)
+        ended = observation.last_chunk_at if observation.chunks else time.perf_counter()
+        with self._lock:
+            if observation.first_chunk_at is not None:
+                self.ttfb.observe(labels, observation.first_chunk_at - observation.started)
+            self.duration.observe(labels, ended - observation.started)
+            self.longest_stall.observe(labels, observation.longest_stall)
+            self.chunks.observe(labels, observation.chunks)
+            self.size.observe(labels, observation.size)
+            self.responses.increment((*labels, str(observation.status), outcome))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "stream method=%s route=%s status=%d outcome=%s ttfb=%.4f duration=%.4f "
+                "chunks=%d bytes=%d longest_stall=%.4f",
+                method, route, observation.status, outcome,
+                (observation.first_chunk_at or ended) - observation.started, ended - observation.started,
+                observation.chunks, observation.size, observation.longest_stall,
+            )
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                line
+                for metric in (self.ttfb, self.duration, self.longest_stall, self.chunks, self.size, self.responses)
+                for line in metric.render()
+            ]
+        return "\n".join(lines) + "\n"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+stream_metrics = StreamMetrics()
+
+
+class StreamMetricsMiddleware:
+    """ASGI middleware recording the metrics of every HTTP response body.
+
+    Routes are labelled with their template (e.g. `/audios/{audio_id:path}`),
+    which the router leaves in the scope, so label cardinality stays bounded.
+
+    Args:
+        app (ASGIApp): The wrapped application.
+        metrics (StreamMetrics): Where to record.
+        excluded_paths (tuple[str, ...]): Paths not to record, e.g. `/metrics`.
+    """
+
+    def __init__(self, app: ASGIApp, metrics: StreamMetrics = stream_metrics, excluded_paths=("/metrics",)):
+        self.app = app
+        self.metrics = metrics
+        self.excluded_paths = excluded_paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] in self.excluded_paths:
+            await self.app(scope, receive, send)
+            return
+
+        observation = StreamObservation()
+        finished = False
+        disconnected = False
+
+        async def receive_and_watch() -> Message:
+            nonlocal disconnected
+            message = await receive()
+            if message["type"] == "http.disconnect" and not finished:
+                disconnected = True
+            return message
+
+        async def send_and_time(message: Message):
+            nonlocal finished
+            message_type = message["type"]
+            if message_type == "http.response.body":
+                observation.chunk(len(message.get("body", b"")))
+                finished = not message.get("more_body", False)
+            elif message_type == "http.response.zerocopysend":
+                observation.chunk(message.get("count") or 0)
+                finished = not message.get("more_body", False)
+            elif message_type == "http.response.start":
+                observation.status = message["status"]
+            await send(message)
+
+        outcome = FAILED
+        try:
+            await self.app(scope, receive_and_watch, send_and_time)
+            outcome = COMPLETED if finished and not disconnected else DISCONNECTED
+        except OSError:
+            outcome = DISCONNECTED
+            raise
+        finally:
+            route = scope.get("route")
+            self.metrics.record(
+                scope["method"], getattr(route, "path", "unmatched"), observation,
+                DISCONNECTED if disconnected else outcome,
+            )
+
+
+class _ObservedBody:
+    """A WSGI response iterable that times its chunks. WSGI servers call
+    `close` early when the client goes away; some never call it, so the
+    end of the body is recorded as soon as it's reached."""
+
+    def __init__(self, body: Iterable[bytes], on_finish: Callable[[StreamObservation, str], None],
+                 observation: StreamObservation):
+        self._body = body
+        self._iterator = iter(body)
+        self._on_finish = on_finish
+        self.observation = observation
+        self._finished = False
+
+    def _finish(self, outcome: str):
+        if not self._finished:
+            self._finished = True
+            self._on_finish(self.observation, outcome)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            self._finish(COMPLETED)
+            raise
+        except Exception:
+            self._finish(FAILED)
+            raise
+        self.observation.chunk(len(chunk))
+        return chunk
+
+    def close(self):
+        try:
+            if hasattr(self._body, "close"):
+                self._body.close()
+        finally:
+            self._finish(DISCONNECTED)
+
+
+class _ObservedAsyncBody(_ObservedBody):
+    """`_ObservedBody` of a body that can also be iterated asynchronously,
+    such as `streaming_core.WSGIStreamBody`."""
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self._body:
+                self.observation.chunk(len(chunk))
+                yield chunk
+        except Exception:
+            self._finish(FAILED)
+            raise
+        self._finish(COMPLETED)
+
+
+ROUTE_ENVIRON_KEY = "python_streaming.route"
+
+
+class StreamMetricsWSGIMiddleware:
+    """WSGI counterpart of `StreamMetricsMiddleware`.
+
+    The route template is read from the environ, where `install_flask_metrics`
+    has the app store it.
+    """
+
+    def __init__(self, app, metrics: StreamMetrics = stream_metrics, excluded_paths=("/metrics",)):
+        self.app = app
+        self.metrics = metrics
+        self.excluded_paths = excluded_paths
+
+    def __call__(self, environ: dict, start_response: Callable):
+        if environ.get("PATH_INFO") in self.excluded_paths:
+            return self.app(environ, start_response)
+
+        observation = StreamObservation()
+
+        def start_and_watch(status: str, headers, exc_info=None):
+            observation.status = int(status.split(" ", 1)[0])
+            return start_response(status, headers, exc_info)
+
+        def record(observation: StreamObservation, outcome: str):
+            route = environ.get(ROUTE_ENVIRON_KEY, "unmatched")
+            self.metrics.record(environ.get("REQUEST_METHOD", ""), route, observation, outcome)
+
+        try:
+            body = self.app(environ, start_and_watch)
+        except Exception:
+            record(observation, FAILED)
+            raise
+        if hasattr(body, "__aiter__"):
+            return _ObservedAsyncBody(body, record, observation)
+        return _ObservedBody(body, record, observation)
+
+
+def install_flask_metrics(app, metrics: StreamMetrics = stream_metrics):
+    """Wrap a Flask app with the metrics middleware and serve them at `/metrics`."""
+    from flask import Response, request
+
+    @app.before_request
+    def remember_route():
+        if request.url_rule is not None:
+            request.environ[ROUTE_ENVIRON_KEY] = request.url_rule.rule
+
+    @app.get("/metrics")
+    def get_metrics():
+        return Response(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    app.wsgi_app = StreamMetricsWSGIMiddleware(app.wsgi_app, metrics)
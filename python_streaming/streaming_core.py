@@ -0,0 +1,251 @@
+"""Framework-agnostic streaming: pipelines and their ASGI and WSGI adapters.
+
+A `StreamPipeline` is a source (a callable returning an async iterator, such
+as `util.iterate_lines` or a chat completion) followed by transforms (async
+iterator in, async iterator out: `util.batch_lines`,
+`flush_policy.coalesce_chunks`, `encode_text`...). The routes build
+pipelines, the same ones in both apps, and hand them to a sink:
+
+- `asgi_response`: a Starlette `StreamingResponse`, for FastAPI.
+- `wsgi_response`: a werkzeug response, for Flask. Its body is a
+  `WSGIStreamBody`, which a plain WSGI server iterates like any other body,
+  while the pipeline runs on a background event loop. Served through
+  `WSGIStreamingBridge`, the body is iterated on the server's event loop
+  instead and a long stream holds no thread at all.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import io
+import threading
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+from uvicorn.middleware.wsgi import build_environ
+
+from python_streaming.config import WSGI_MAX_THREADS, WSGI_STREAM_QUEUE_SIZE
+from python_streaming.util import iterate_on_loop
+
+
+Source = Callable[[], AsyncIterable]
+Transform = Callable[[AsyncIterator], AsyncIterator]
+
+
+class StreamPipeline:
+    """A source and the transforms its items go through.
+
+    Pipelines are immutable and reusable: every iteration opens the source
+    again.
+
+    Args:
+        source (Source): Opens the stream.
+        transforms (tuple[Transform, ...]): Applied in order.
+    """
+
+    def __init__(self, source: Source, transforms: tuple[Transform, ...] = ()):
+        self.source = source
+        self.transforms = transforms
+
+    def through(self, transform: Callable[..., AsyncIterator], *args, **kwargs) -> "StreamPipeline":
+        """A new pipeline with `transform(stream, *args, **kwargs)` appended."""
+        return StreamPipeline(self.source, (*self.transforms, lambda stream: transform(stream, *args, **kwargs)))
+
+    def __aiter__(self) -> AsyncIterator:
+        stream = self.source()
+        for transform in self.transforms:
+            stream = transform(stream)
+        return aiter(stream)
+
+
+async def encode_text(chunks: AsyncIterator[str], encoding: str = "utf-8") -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        yield chunk.encode(encoding)
+
+
+def asgi_response(
+    pipeline: StreamPipeline,
+    media_type: str,
+    status_code: int = 200,
+    headers: dict[str, str] | None = None,
+) -> StreamingResponse:
+    return StreamingResponse(pipeline, status_code=status_code, headers=headers, media_type=media_type)
+
+
+class BackgroundLoop:
+    """An event loop running in a daemon thread, started on first use.
+
+    WSGI servers that don't know about `WSGIStreamBody` run its pipeline
+    there: one loop for every stream of the process.
+    """
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="stream-loop", daemon=True).start()
+            return self._loop
+
+
+background_loop = BackgroundLoop()
+
+
+class WSGIStreamBody:
+    """WSGI response iterable over an async stream of bytes.
+
+    Args:
+        stream (AsyncIterable[bytes]): Usually a `StreamPipeline`.
+        max_queued (int): Chunks produced ahead of a blocking server.
+    """
+
+    def __init__(self, stream: AsyncIterable[bytes], max_queued: int = WSGI_STREAM_QUEUE_SIZE):
+        self.stream = stream
+        self.max_queued = max_queued
+        self._iterator: Iterator[bytes] | None = None
+
+    def __aiter__(self) -> AsyncIterator[bytes]:
+        return aiter(self.stream)
+
+    def __iter__(self) -> Iterator[bytes]:
+        self._iterator = self._iterate()
+        return self._iterator
+
+    def _iterate(self) -> Iterator[bytes]:
+        # A generator, so the background loop only starts if the body is iterated
+        yield from iterate_on_loop(self.stream, background_loop.loop, self.max_queued)
+
+    def close(self):
+        if self._iterator is not None:
+            self._iterator.close()
+
+
+def wsgi_response(
+    pipeline: StreamPipeline,
+    media_type: str,
+    status: int = 200,
+    headers: dict[str, str] | None = None,
+):
+    from werkzeug.wrappers import Response
+
+    # Passed through as is, so that the server gets the `WSGIStreamBody`
+    return Response(WSGIStreamBody(pipeline), status=status, headers=headers, mimetype=media_type,
+                    direct_passthrough=True)
+
+
+_END_OF_BODY = object()
+
+
+class WSGIStreamingBridge:
+    """ASGI app serving a WSGI app, to run it under uvicorn.
+
+    uvicorn's own WSGI interface runs each request, response body included,
+    in one of a few threads: a handful of long chat streams is enough to stop
+    the app from answering. Here views run in a bounded thread pool, and the
+    response body is iterated on the event loop: `WSGIStreamBody` items are
+    awaited and hold no thread, other bodies get a thread for each chunk.
+
+    Request bodies are read in full before the view is called.
+
+    Args:
+        app: The WSGI application.
+        max_threads (int): Size of the thread pool.
+    """
+
+    def __init__(self, app: Callable, max_threads: int = WSGI_MAX_THREADS):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="wsgi")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "websocket":
+            await receive()
+            await send({"type": "websocket.close", "code": 1000})
+        else:
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive: Receive, send: Send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope: Scope, receive: Receive, send: Send):
+        request_body = bytearray()
+        message = {"more_body": True}
+        while message.get("more_body", False):
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            request_body += message.get("body", b"")
+        environ = build_environ(scope, message, io.BytesIO(request_body))
+
+        response_start = {}
+
+        def start_response(status: str, headers: list[tuple[str, str]], exc_info=None):
+            response_start.update(
+                type="http.response.start",
+                status=int(status.split(" ", 1)[0]),
+                headers=[(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers],
+            )
+
+        loop = asyncio.get_running_loop()
+        body = await loop.run_in_executor(self.executor, self.app, environ, start_response)
+        sender = asyncio.create_task(self._send_body(body, response_start, send))
+        # Stop producing as soon as the client goes away: sends wouldn't fail
+        disconnection = asyncio.create_task(self._wait_for_disconnect(receive))
+        try:
+            await asyncio.wait({sender, disconnection}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            disconnection.cancel()
+            if not sender.done():
+                sender.cancel()
+                await asyncio.gather(sender, return_exceptions=True)
+            if hasattr(body, "close"):
+                await loop.run_in_executor(self.executor, body.close)
+        if sender.done() and not sender.cancelled():
+            sender.result()
+
+    @staticmethod
+    async def _wait_for_disconnect(receive: Receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    async def _send_body(self, body: Iterable[bytes], response_start: dict, send: Send):
+        started = False
+
+        async def send_chunk(chunk: bytes):
+            nonlocal started
+            if not started:
+                # WSGI apps may call start_response as late as their first chunk
+                if not response_start:
+                    raise RuntimeError("The WSGI app didn't call start_response")
+                await send(response_start)
+                started = True
+            if chunk:
+                await send({"type": "http.response.body", "body": bytes(chunk), "more_body": True})
+
+        if hasattr(body, "__aiter__"):
+            chunks = aiter(body)
+            try:
+                async for chunk in chunks:
+                    await send_chunk(chunk)
+            finally:
+                if hasattr(chunks, "aclose"):
+                    await chunks.aclose()
+        else:
+            loop = asyncio.get_running_loop()
+            iterator = await loop.run_in_executor(self.executor, iter, body)
+            while (chunk := await loop.run_in_executor(self.executor, next, iterator, _END_OF_BODY)) \
+                    is not _END_OF_BODY:
+                await send_chunk(chunk)
+        await send_chunk(b"")
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
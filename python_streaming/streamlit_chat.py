@@ -1,6 +1,6 @@
 import streamlit as st
 
-from python_streaming.chat_client import consume_chat_response
+from python_streaming.chat_client import consume_chat_events
 
 
 with st.chat_message("assistant"):
@@ -15,4 +15,5 @@ if user_input:
     with st.chat_message("user"):
         st.write(user_input)
     with st.chat_message("assistant"):
-        response = st.write_stream(consume_chat_response(user_input))
+        # Over SSE, so that a flaky connection resumes the answer instead of paying for it twice
+        response = st.write_stream(consume_chat_events(user_input))
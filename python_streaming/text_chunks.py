@@ -0,0 +1,286 @@
+"""Chunk-level processing of streamed text, as plain iterators and as
+reactivex operators.
+
+Every transform works on whole chunks: it keeps what it can't emit yet (an
+incomplete UTF-8 sequence, a partial line...) and emits slices of the data it
+has, so the cost is per chunk rather than per character. The transforms are
+small stateful objects with `feed(chunk)` and `flush()`, each returning the
+chunks to emit; `iterate` and `operator` apply them to an iterable or an
+observable, and every transform has a shortcut of both kinds, e.g.
+`decode_utf8(chunks)` and `rx_decode_utf8()`.
+
+Joined back together, the output of a transform is its input (decoded, for
+`Utf8Decoder`): nothing is added or dropped unless asked for (`keepends`).
+"""
+from abc import ABC, abstractmethod
+import codecs
+import re
+import time
+from typing import Callable, Generic, Iterable, Iterator, Sequence, TypeVar
+
+import reactivex as rx
+from reactivex import Observable
+from reactivex import operators as ops
+
+
+Chunk = TypeVar("Chunk", str, bytes)
+Output = TypeVar("Output", str, bytes)
+
+SENTENCE_CLOSERS = "\"')]」』）"
+# Full-width terminators end a sentence even when text follows without a space
+SENTENCE_END = re.compile(
+    rf"[.!?\n][{re.escape(SENTENCE_CLOSERS)}]*(?=\s|$)|[。！？][{re.escape(SENTENCE_CLOSERS)}]*"
+)
+
+
+def _join(parts: Sequence[Chunk]) -> Chunk:
+    return parts[0][:0].join(parts)
+
+
+class ChunkTransform(ABC, Generic[Chunk, Output]):
+    @abstractmethod
+    def feed(self, chunk: Chunk) -> Sequence[Output]:
+        ...
+
+    def flush(self) -> Sequence[Output]:
+        return ()
+
+
+class Utf8Decoder(ChunkTransform[bytes, str]):
+    """Decodes UTF-8 chunks, keeping a multibyte character that's split
+    across two chunks until its last byte arrives.
+
+    Args:
+        errors (str): As for `bytes.decode`.
+    """
+
+    def __init__(self, errors: str = "strict"):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors)
+
+    def feed(self, chunk: bytes) -> Sequence[str]:
+        text = self._decoder.decode(chunk)
+        return (text,) if text else ()
+
+    def flush(self) -> Sequence[str]:
+        # Raises on a truncated character, unless errors say otherwise
+        text = self._decoder.decode(b"", final=True)
+        return (text,) if text else ()
+
+
+class Rechunker(ChunkTransform[Chunk, Chunk]):
+    """Cuts the stream into chunks of exactly `size` characters (or bytes),
+    the last one excepted.
+    """
+
+    def __init__(self, size: int):
+        if size <= 0:
+            raise ValueError("The chunk size must be positive")
+        self.size = size
+        self._parts: list = []
+        self._length = 0
+
+    def feed(self, chunk: Chunk) -> Sequence[Chunk]:
+        if not chunk:
+            return ()
+        self._parts.append(chunk)
+        self._length += len(chunk)
+        if self._length < self.size:
+            return ()
+        data = _join(self._parts)
+        end = len(data) - len(data) % self.size
+        rest = data[end:]
+        self._parts = [rest] if rest else []
+        self._length = len(rest)
+        return [data[start:start + self.size] for start in range(0, end, self.size)]
+
+    def flush(self) -> Sequence[Chunk]:
+        if not self._parts:
+            return ()
+        data = _join(self._parts)
+        self._parts = []
+        self._length = 0
+        return (data,)
+
+
+class TimeWindow(ChunkTransform[Chunk, Chunk]):
+    """Joins the chunks received within `seconds` of the first one.
+
+    Without a timer, a window is only closed by the first chunk that arrives
+    after it; use `rx_buffer_by_time` to close windows on time.
+    """
+
+    def __init__(self, seconds: float, clock: Callable[[], float] = time.monotonic):
+        self.seconds = seconds
+        self.clock = clock
+        self._parts: list = []
+        self._started_at = 0.0
+
+    def feed(self, chunk: Chunk) -> Sequence[Chunk]:
+        if not chunk:
+            return ()
+        now = self.clock()
+        if not self._parts:
+            self._started_at = now
+        self._parts.append(chunk)
+        if now - self._started_at < self.seconds:
+            return ()
+        return self.flush()
+
+    def flush(self) -> Sequence[Chunk]:
+        if not self._parts:
+            return ()
+        data = _join(self._parts)
+        self._parts = []
+        return (data,)
+
+
+class LineSplitter(ChunkTransform[Chunk, Chunk]):
+    """Splits the stream on newlines. A trailing "\\r" is removed with the
+    newline unless `keepends` is set.
+    """
+
+    def __init__(self, keepends: bool = False):
+        self.keepends = keepends
+        self._parts: list = []
+
+    def feed(self, chunk: Chunk) -> Sequence[Chunk]:
+        newline = "\n" if isinstance(chunk, str) else b"\n"
+        if newline not in chunk:
+            if chunk:
+                self._parts.append(chunk)
+            return ()
+        self._parts.append(chunk)
+        lines = _join(self._parts).split(newline)
+        rest = lines.pop()
+        self._parts = [rest] if rest else []
+        if self.keepends:
+            return [line + newline for line in lines]
+        carriage_return = "\r" if isinstance(chunk, str) else b"\r"
+        return [line.removesuffix(carriage_return) for line in lines]
+
+    def flush(self) -> Sequence[Chunk]:
+        if not self._parts:
+            return ()
+        data = _join(self._parts)
+        self._parts = []
+        return (data,)
+
+
+class SentenceSplitter(ChunkTransform[str, str]):
+    """Splits text after every sentence end (see `SENTENCE_END`): ., ! or ?
+    followed by whitespace, a line break, or a full-width 。, ！ or ？.
+
+    A sentence end is only confirmed by the character that follows it, so a
+    sentence is emitted once the next one has started. The whitespace
+    between two sentences starts the second one.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        # Everything before was already searched for sentence ends
+        self._searched = 0
+
+    def feed(self, chunk: str) -> Sequence[str]:
+        if not chunk:
+            return ()
+        buffer = self._buffer + chunk
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(buffer, self._searched):
+            if match.end() == len(buffer):
+                break
+            sentences.append(buffer[start:match.end()])
+            start = match.end()
+        self._buffer = buffer[start:]
+        # Only a sentence end at the very end of the buffer can still be completed
+        self._searched = max(len(self._buffer.rstrip(SENTENCE_CLOSERS)) - 1, 0)
+        return sentences
+
+    def flush(self) -> Sequence[str]:
+        buffer, self._buffer, self._searched = self._buffer, "", 0
+        return (buffer,) if buffer else ()
+
+
+def iterate(chunks: Iterable, transform: ChunkTransform) -> Iterator:
+    """Apply `transform` to every chunk of an iterable."""
+    for chunk in chunks:
+        yield from transform.feed(chunk)
+    yield from transform.flush()
+
+
+def operator(create_transform: Callable[[], ChunkTransform]) -> Callable[[Observable], Observable]:
+    """A reactivex operator applying a new `create_transform()` to each subscription."""
+    def apply(source: Observable) -> Observable:
+        def subscribe(observer, scheduler=None):
+            transform = create_transform()
+
+            def emit(outputs: Callable[[], Sequence]) -> bool:
+                try:
+                    produced = outputs()
+                except Exception as e:
+                    observer.on_error(e)
+                    return False
+                for output in produced:
+                    observer.on_next(output)
+                return True
+
+            def on_completed():
+                if emit(transform.flush):
+                    observer.on_completed()
+
+            return source.subscribe(
+                lambda chunk: emit(lambda: transform.feed(chunk)),
+                observer.on_error,
+                on_completed,
+                scheduler=scheduler,
+            )
+
+        return rx.create(subscribe)
+
+    return apply
+
+
+def decode_utf8(chunks: Iterable[bytes], errors: str = "strict") -> Iterator[str]:
+    return iterate(chunks, Utf8Decoder(errors))
+
+
+def rechunk(chunks: Iterable[Chunk], size: int) -> Iterator[Chunk]:
+    return iterate(chunks, Rechunker(size))
+
+
+def buffer_by_time(chunks: Iterable[Chunk], seconds: float) -> Iterator[Chunk]:
+    return iterate(chunks, TimeWindow(seconds))
+
+
+def split_lines(chunks: Iterable[Chunk], keepends: bool = False) -> Iterator[Chunk]:
+    return iterate(chunks, LineSplitter(keepends))
+
+
+def split_sentences(chunks: Iterable[str]) -> Iterator[str]:
+    return iterate(chunks, SentenceSplitter())
+
+
+def rx_decode_utf8(errors: str = "strict") -> Callable[[Observable], Observable]:
+    return operator(lambda: Utf8Decoder(errors))
+
+
+def rx_rechunk(size: int) -> Callable[[Observable], Observable]:
+    return operator(lambda: Rechunker(size))
+
+
+def rx_buffer_by_time(seconds: float, scheduler=None) -> Callable[[Observable], Observable]:
+    """Join the chunks of every `seconds` window, closing windows on a timer.
+    Windows without chunks emit nothing."""
+    return rx.compose(
+        ops.buffer_with_time(seconds, scheduler=scheduler),
+        ops.filter(bool),
+        ops.map(_join),
+    )
+
+
+def rx_split_lines(keepends: bool = False) -> Callable[[Observable], Observable]:
+    return operator(lambda: LineSplitter(keepends))
+
+
+def rx_split_sentences() -> Callable[[Observable], Observable]:
+    return operator(SentenceSplitter)
@@ -1,34 +1,252 @@
+import asyncio
+from concurrent.futures import Executor
 import json
-from typing import Iterator
+from pathlib import Path
+import queue
+import threading
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator
 
-import boto3
-from botocore.exceptions import ClientError
+from python_streaming.config import DATA_BATCH_BYTES, DATA_BATCH_LINES, FILE_CHUNK_SIZE
+from python_streaming.s3_media import s3_downloader
 
 
-def iterate_over_json_data() -> Iterator:
-    with open('resources/data.json', 'r') as file:
-        data = file.read()
-    for line in data.splitlines():
-        yield line
+async def iterate_file_chunks(
+    path: Path | str,
+    chunk_size: int = FILE_CHUNK_SIZE,
+    offset: int = 0,
+    length: int | None = None,
+) -> AsyncIterator[bytes]:
+    """Yield a file's bytes in fixed-size chunks without blocking the event loop.
 
+    Reads run in a worker thread and are double buffered: the next chunk is
+    already being read while the current one is sent downstream.
 
-def iterate_over_audio() -> Iterator:
-    with open("resources/audio.mp3", "rb") as file:
-        yield from file
+    Args:
+        path (Path | str): The file to read.
+        chunk_size (int): Size of every chunk but (possibly) the last one.
+        offset (int): Byte position to start reading from.
+        length (int | None): Number of bytes to read, or None to read to EOF.
+    """
+    def open_at_offset():
+        file = open(path, "rb")
+        file.seek(offset)
+        return file
 
+    file = await asyncio.to_thread(open_at_offset)
+    remaining = length if length is not None else float("inf")
+    pending = None
+    try:
+        pending = asyncio.ensure_future(asyncio.to_thread(file.read, int(min(chunk_size, remaining))))
+        while True:
+            chunk = await pending
+            pending = None
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            if remaining > 0:
+                # Read ahead while the current chunk goes out
+                pending = asyncio.ensure_future(
+                    asyncio.to_thread(file.read, int(min(chunk_size, remaining)))
+                )
+            yield chunk
+            if remaining <= 0:
+                break
+    finally:
+        if pending is not None:
+            # The read can't be cancelled once it's in the thread: let it finish
+            # before closing the file under its feet
+            await asyncio.gather(pending, return_exceptions=True)
+        await asyncio.to_thread(file.close)
 
-def download_s3_object_streaming(
-    object_key: str,
-    bucket_name: str,
-    chunk_size: int = 1024
+
+async def iterate_lines(
+    path: Path | str,
+    chunk_size: int = FILE_CHUNK_SIZE,
+) -> AsyncIterator[bytes]:
+    """Yield a file's lines (without line terminators) as soon as they're read.
+
+    Memory is bounded by the chunk size plus the longest line, whatever the
+    size of the file. Lines are kept as bytes: splitting UTF-8 on newlines is
+    safe, and it spares decoding data that's going to be sent as bytes anyway.
+    """
+    remainder = b""
+    async for chunk in iterate_file_chunks(path, chunk_size):
+        lines = chunk.split(b"\n")
+        lines[0] = remainder + lines[0]
+        remainder = lines.pop()
+        for line in lines:
+            yield line.removesuffix(b"\r")
+    if remainder:
+        yield remainder.removesuffix(b"\r")
+
+
+async def iterate_ndjson(
+    path: Path | str,
+    validate: bool = False,
+    parse: bool = False,
+    chunk_size: int = FILE_CHUNK_SIZE,
+) -> AsyncIterator:
+    """Yield the records of a newline-delimited JSON file, skipping blank lines.
+
+    Args:
+        path (Path | str): The NDJSON file.
+        validate (bool): Raise ValueError on the first line that isn't JSON.
+        parse (bool): Yield the decoded objects instead of the raw lines.
+        chunk_size (int): Size of the chunks read from disk.
+    """
+    line_number = 0
+    async for line in iterate_lines(path, chunk_size):
+        line_number += 1
+        if not line.strip():
+            continue
+        if not (validate or parse):
+            yield line
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"{path}:{line_number} is not valid JSON: {e}") from e
+        yield record if parse else line
+
+
+async def batch_lines(
+    lines: AsyncIterator[bytes],
+    max_lines: int = DATA_BATCH_LINES,
+    max_bytes: int = DATA_BATCH_BYTES,
+    terminate_lines: bool = True,
+) -> AsyncIterator[bytes]:
+    """Pack lines into batches of at most `max_lines` lines, flushing early once
+    a batch reaches `max_bytes`, so that each batch is one HTTP chunk or one
+    WebSocket frame.
+
+    Args:
+        lines (AsyncIterator[bytes]): Lines without their terminators.
+        max_lines (int): Lines per batch.
+        max_bytes (int): Size at which a batch is flushed, even if it has
+            fewer than `max_lines` lines.
+        terminate_lines (bool): End every line, including the batch's last
+            one, with a newline (NDJSON over HTTP). Otherwise lines are only
+            separated by newlines (one message per WebSocket frame).
+    """
+    batch = []
+    batch_size = 0
+    separator = b"\n"
+    terminator = separator if terminate_lines else b""
+    async for line in lines:
+        batch.append(line)
+        batch_size += len(line) + 1
+        if len(batch) >= max_lines or batch_size >= max_bytes:
+            yield separator.join(batch) + terminator
+            batch = []
+            batch_size = 0
+    if batch:
+        yield separator.join(batch) + terminator
+
+
+def iterate_over_audio(chunk_size: int = FILE_CHUNK_SIZE, offset: int = 0) -> AsyncIterator[bytes]:
+    return iterate_file_chunks("resources/audio.mp3", chunk_size, offset)
+
+
+_END_OF_STREAM = object()
+
+
+class _StreamError:
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+async def iterate_off_loop(
+    open_iterator: Callable[[], Iterable],
+    max_queued: int = 64,
+    executor: Executor | None = None,
+) -> AsyncIterator:
+    """Run a blocking iterator in a worker thread and yield its items on the loop.
+
+    The thread hands items over through a bounded `asyncio.Queue`, so it stops
+    reading when the consumer falls behind. If the consumer goes away, the
+    iterator is closed at its next item. `executor` defaults to the loop's.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(max_queued)
+    stopped = threading.Event()
+
+    def put(item):
+        if not stopped.is_set():
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        iterable = None
+        try:
+            iterable = open_iterator()
+            for item in iterable:
+                if stopped.is_set():
+                    break
+                put(item)
+        except BaseException as e:
+            put(_StreamError(e))
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+            put(_END_OF_STREAM)
+
+    loop.run_in_executor(executor, produce)
+    try:
+        while (item := await queue.get()) is not _END_OF_STREAM:
+            if isinstance(item, _StreamError):
+                raise item.exception
+            yield item
+    finally:
+        stopped.set()
+        # Unblock a producer waiting for room in the queue
+        while not queue.empty():
+            queue.get_nowait()
+
+
+def iterate_on_loop(
+    stream: AsyncIterable,
+    loop: asyncio.AbstractEventLoop,
+    max_queued: int = 64,
 ) -> Iterator:
-    s3 = boto3.resource('s3')
+    """Iterate an async iterable on a loop running in another thread, from a
+    blocking caller. The counterpart of `iterate_off_loop`.
+
+    At most `max_queued` items wait for the caller: the loop stops pulling
+    from `stream` until they're taken. Closing the returned iterator cancels
+    the stream.
+    """
+    items = queue.Queue()
+    room = asyncio.Semaphore(max_queued)
+
+    async def produce():
+        iterator = aiter(stream)
+        try:
+            async for item in iterator:
+                await room.acquire()
+                items.put(item)
+        except Exception as e:
+            items.put(_StreamError(e))
+        finally:
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+            items.put(_END_OF_STREAM)
+
+    production = asyncio.run_coroutine_threadsafe(produce(), loop)
     try:
-        s3_object = s3.Object(bucket_name, object_key)
-        streaming_body = s3_object.get()['Body']
+        while (item := items.get()) is not _END_OF_STREAM:
+            if isinstance(item, _StreamError):
+                raise item.exception
+            loop.call_soon_threadsafe(room.release)
+            yield item
+    finally:
+        production.cancel()
 
-        for chunk in iter(lambda: streaming_body.read(chunk_size), b''):
-            yield chunk
-    except ClientError as e:
-        print(f"Error streaming object from S3: {e}")
-        yield None
+
+def download_s3_object_streaming(
+    object_key: str,
+    bucket_name: str,
+    chunk_size: int = FILE_CHUNK_SIZE,
+) -> Iterator[memoryview]:
+    """Yield an S3 object's bytes in order, downloaded with parallel ranged GETs
+    (see python_streaming.s3_media). Raises `S3DownloadError` if it can't be read."""
+    s3_object = s3_downloader.head(bucket_name, object_key)
+    yield from s3_downloader.iterate(s3_object, chunk_size=chunk_size)
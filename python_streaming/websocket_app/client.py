@@ -12,6 +12,9 @@ async def chat_with_server():
             await websocket.send(message)
             while (response := await websocket.recv()) != "EOF":
                 # websocket.eof_received()
+                if isinstance(response, bytes):
+                    # Data batches come as binary frames of UTF-8 JSON lines
+                    response = response.decode("utf-8")
                 print(f"Received: {response}")
 
 
@@ -1,32 +1,82 @@
 import asyncio
+from contextlib import aclosing
+import logging
 import websockets
 
-from python_streaming.util import iterate_over_json_data
+from python_streaming.broadcast import BroadcastHub, SlowConsumerError
+from python_streaming.config import BROADCAST_FEED_INTERVAL, DATA_FILE_PATH
+from python_streaming.util import batch_lines, iterate_lines
+
+
+logger = logging.getLogger(__name__)
+
+END_OF_FEED = "EOF"
+
+json_data_hub = BroadcastHub()
+
+
+async def feed_json_data(hub: BroadcastHub, interval: float = BROADCAST_FEED_INTERVAL):
+    # A single reader for every client: each pass over the file is published
+    # once, as encoded batches, and closed with an end of feed marker. Clients
+    # joining midway wait for the next pass, so that all get the whole file.
+    while True:
+        await hub.wait_for_subscribers()
+        hub.start_pass()
+        async with (
+            aclosing(iterate_lines(DATA_FILE_PATH)) as lines,
+            aclosing(batch_lines(lines, terminate_lines=False)) as batches,
+        ):
+            async for batch in batches:
+                hub.publish(batch)
+                await asyncio.sleep(interval)
+                if not len(hub):
+                    # Everyone left: start over for those waiting, if any
+                    break
+            else:
+                hub.end_pass(END_OF_FEED)
 
 
 async def stream_json_data(websocket):
     async for message in websocket:
         if message != "json":
-            print(f"Received message: {message}")
+            logger.debug("Received message: %s", message)
             await websocket.send(f"Echoing message: {message}")
-        else:
-            print("Asked for JSON...")
-            data_iterator = iterate_over_json_data()
-            try:
-                while new_line := next(data_iterator):
-                    await asyncio.sleep(0.05)
-                    print(f"New data chunk: {new_line}")
-                    await websocket.send(new_line)
-            except StopIteration:
-                pass
-        await websocket.send("EOF")
-        # await websocket.close()
+            await websocket.send(END_OF_FEED)
+            continue
+
+        # Batches are sent as binary frames holding UTF-8 JSON lines, so the
+        # bytes encoded by the hub go out as they are
+        subscription = json_data_hub.subscribe(from_start=True)
+        try:
+            async for data in subscription:
+                await websocket.send(data)
+                if data == END_OF_FEED:
+                    break
+        except SlowConsumerError:
+            await websocket.close(code=1008, reason="Too slow to follow the feed")
+            return
+        finally:
+            json_data_hub.unsubscribe(subscription)
 
 
 async def main():
+    logging.basicConfig(level=logging.INFO)
+    feed = asyncio.create_task(feed_json_data(json_data_hub))
     server = await websockets.serve(stream_json_data, "localhost", 8765)
-    print("WebSocket server started")
-    await server.wait_closed()
+
+    def stop_on_feed_failure(task: asyncio.Task):
+        # Clients would otherwise keep connecting to a feed that never comes
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("The JSON feed failed, shutting the server down", exc_info=task.exception())
+            json_data_hub.close()
+            server.close()
+
+    feed.add_done_callback(stop_on_feed_failure)
+    logger.info("WebSocket server started")
+    try:
+        await server.wait_closed()
+    finally:
+        feed.cancel()
 
 
 if __name__ == "__main__":
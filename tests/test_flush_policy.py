@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from python_streaming.flush_policy import FlushPolicy, coalesce_chunks, coalesce_chunks_sync
+
+
+POLICY = FlushPolicy(min_bytes=64, max_delay=0, boundary=None)
+
+
+class UpstreamError(Exception):
+    pass
+
+
+def failing_chunks():
+    yield "Hello"
+    yield " wor"
+    raise UpstreamError()
+
+
+async def failing_chunks_async():
+    for chunk in failing_chunks():
+        yield chunk
+
+
+async def collect(chunks, received: list[str]):
+    async for chunk in chunks:
+        received.append(chunk)
+
+
+def test_coalesce_chunks_flushes_the_buffer_before_an_upstream_error():
+    received = []
+    with pytest.raises(UpstreamError):
+        asyncio.run(collect(coalesce_chunks(failing_chunks_async(), POLICY), received))
+    assert "".join(received) == "Hello wor"
+
+
+def test_coalesce_chunks_sync_flushes_the_buffer_before_an_upstream_error():
+    received = []
+    with pytest.raises(UpstreamError):
+        for chunk in coalesce_chunks_sync(failing_chunks(), POLICY):
+            received.append(chunk)
+    assert "".join(received) == "Hello wor"